@@ -0,0 +1,57 @@
+"""Single entry point for the pipeline's jobs: python -m pipeline <command> [args].
+
+Only the module behind the chosen command is imported, and it runs as
+if started with `python -m <module>`, so every command keeps its own
+arguments (`python -m pipeline ingest --help`). Check cold-start cost
+with `python -m pipeline bench import_time`.
+"""
+
+import runpy
+import sys
+
+# command -> (module run as __main__, description)
+COMMANDS = {
+    "init-db": ("pipeline.load.init_db", "create or upgrade tables"),
+    "seed": ("pipeline.load.seed_products", "seed the tracked products"),
+    "ingest": ("pipeline.ingest.fetch_and_parse", "fetch and snapshot due products"),
+    "discover": ("pipeline.ingest.discover", "snapshot products from category listings"),
+    "replay": ("pipeline.ingest.replay", "re-parse archived pages into price_history"),
+    "export": ("pipeline.load.export_parquet", "export price_history to date-partitioned Parquet"),
+    "partitions": ("pipeline.load.partitions", "create partitions and roll up old ones"),
+    "dq": ("pipeline.dq.run_dq_checks", "run the data-quality suite"),
+    "alerts": ("pipeline.load.alert_price_drops", "post price-drop alerts"),
+    "summary": ("pipeline.load.report_summary", "post the latest-price summary"),
+    "reset": ("reset", "run every stage end to end (drops everything unless --keep-data)"),
+    "bench": (None, "run pipeline.bench.<name> [args]"),
+}
+
+
+def usage() -> str:
+    width = max(map(len, COMMANDS))
+    rows = "\n".join(f"  {name:<{width}}  {desc}" for name, (_, desc) in COMMANDS.items())
+    return f"usage: python -m pipeline <command> [args]\n\ncommands:\n{rows}"
+
+
+def main(argv: list[str] | None = None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] in ("-h", "--help"):
+        print(usage())
+        return 0
+    command, *args = argv
+    if command not in COMMANDS:
+        print(f"unknown command: {command}\n\n{usage()}", file=sys.stderr)
+        return 2
+    module = COMMANDS[command][0]
+    if module is None:
+        if not args:
+            print("usage: python -m pipeline bench <name> [args]", file=sys.stderr)
+            return 2
+        command, module, args = f"{command} {args[0]}", f"pipeline.bench.{args[0]}", args[1:]
+    sys.argv = [f"python -m pipeline {command}", *args]
+    # alter_sys makes the module __main__, so parse pools can import it
+    runpy.run_module(module, run_name="__main__", alter_sys=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+"""Benchmark windowed drop detection against the old full-history lag() scan.
+
+Usage: python -m pipeline.bench.alert_window [products] [snapshots_per_product]
+
+Builds a synthetic history in a scratch `bench_alerts` schema (dropped
+afterwards), with one snapshot per product every 12 hours. The windowed
+side is `alert_price_drops.history_drops` (window read by binary COPY,
+drops found with NumPy), with its queries pointed at that schema.
+"""
+
+import sys
+import time
+from contextlib import ExitStack
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+import pandas as pd
+from sqlalchemy import text
+
+from pipeline.common import db
+from pipeline.load import alert_price_drops, price_series
+
+SCHEMA = "bench_alerts"
+
+# The query alert_price_drops ran before it was windowed.
+FULL_SCAN_SQL = """
+    with hist as (
+      select ph.product_id, ph.ts_utc, ph.price_numeric as curr_price,
+        lag(ph.price_numeric) over (partition by ph.product_id order by ph.ts_utc) as prev_price
+      from public.price_history ph
+      where ph.price_numeric is not null
+    ),
+    drops as (
+      select product_id, ts_utc, prev_price, curr_price,
+        case
+          when prev_price is not null and curr_price < prev_price
+          then round(100.0 * (prev_price - curr_price) / nullif(prev_price, 0), 2)
+          else null
+        end as drop_pct
+      from hist
+    )
+    select p.product_id, p.name, p.site, p.url, d.prev_price, d.curr_price as new_price, d.drop_pct, d.ts_utc
+    from drops d
+    join public.product p on p.product_id = d.product_id
+    where d.drop_pct is not null
+      and d.drop_pct >= :min_drop_pct
+      and d.ts_utc > :since
+    order by d.ts_utc desc
+"""
+
+
+def build(conn, products: int, snapshots: int):
+    conn.execute(text(f"drop schema if exists {SCHEMA} cascade"))
+    conn.execute(text(f"create schema {SCHEMA}"))
+    conn.execute(text(f"create table {SCHEMA}.product (like public.product including all)"))
+    conn.execute(text(f"create table {SCHEMA}.price_history (like public.price_history including defaults)"))
+    conn.execute(text(f"""
+        insert into {SCHEMA}.product (product_id, site, url, name)
+        select g, 'bench', 'https://bench.invalid/' || g, 'Product ' || g
+        from generate_series(1, :products) g
+    """), {"products": products})
+    conn.execute(text(f"""
+        insert into {SCHEMA}.price_history (id, product_id, ts_utc, price_numeric, currency, in_stock_bool)
+        select
+          row_number() over (),
+          p,
+          now() - make_interval(hours => 12 * (:snapshots - s)) + make_interval(secs => p % 3600),
+          round((10 + (hashtext(p::text || ':' || s) & 1023) / 32.0)::numeric, 2),
+          'GBP',
+          true
+        from generate_series(1, :products) p, generate_series(1, :snapshots) s
+    """), {"products": products, "snapshots": snapshots})
+    conn.execute(text(f"create index on {SCHEMA}.price_history (ts_utc)"))
+    conn.execute(text(f"create index on {SCHEMA}.price_history (product_id, ts_utc)"))
+    conn.execute(text(f"analyze {SCHEMA}.product"))
+    conn.execute(text(f"analyze {SCHEMA}.price_history"))
+
+
+def in_schema(sql: str) -> str:
+    return sql.replace("public.", f"{SCHEMA}.")
+
+def timed(fn, repeats: int = 3):
+    best, df = None, None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        df = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, df
+
+def bench_schema_queries() -> ExitStack:
+    """Point the queries behind `history_drops` at the bench schema."""
+    stack = ExitStack()
+    for module, name in [
+        (alert_price_drops, "PRODUCTS_SQL"),
+        (price_series, "SINCE_ROWS_SQL"),
+    ]:
+        stack.enter_context(mock.patch.object(module, name, in_schema(getattr(module, name))))
+    return stack
+
+def same_drops(full: pd.DataFrame, windowed: pd.DataFrame) -> bool:
+    key, values = ["product_id", "ts_utc"], ["prev_price", "new_price", "drop_pct"]
+    a, b = (df.sort_values(key).reset_index(drop=True) for df in (full, windowed))
+    return len(a) == len(b) and a[key].equals(b[key]) and (a[values].astype(float) - b[values]).abs().max().max() < 1e-9
+
+
+def main():
+    products = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    snapshots = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    params = {"since": datetime.now(timezone.utc) - timedelta(hours=12), "min_drop_pct": 0}
+
+    with db.engine.begin() as conn:
+        start = time.perf_counter()
+        build(conn, products, snapshots)
+        print(f"built {products * snapshots:,} snapshots in {time.perf_counter() - start:.1f}s")
+    try:
+        with db.engine.connect() as conn, bench_schema_queries():
+            full_s, full = timed(lambda: pd.read_sql(text(in_schema(FULL_SCAN_SQL)), conn, params=params))
+            window_s, windowed = timed(lambda: alert_price_drops.history_drops(conn, **params))
+        same = same_drops(full, windowed)
+        print(f"full-history lag scan: {full_s * 1000:8.0f} ms ({len(full)} drops)")
+        print(f"windowed history_drops:{window_s * 1000:8.0f} ms ({len(windowed)} drops)")
+        print(f"speedup {full_s / window_s:.1f}x, identical results: {same}")
+    finally:
+        with db.engine.begin() as conn:
+            conn.execute(text(f"drop schema if exists {SCHEMA} cascade"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,372 @@
+"""End-to-end benchmark of the pipeline on synthetic data.
+
+Generates `--products` products, alternating between books.toscrape.com
+and webscraper.io, with `--days` days of history at two snapshots a day.
+Their pages are served by the local stub server from the parser
+fixtures, with each product's name and price swapped in. Requests reach
+the stub through HTTP_PROXY, so urls keep their real hostnames and the
+registry dispatches them as usual. Every fifth product's page shows a
+20% drop so alerts have work to do.
+
+Then it times, in order:
+
+    load       bulk insert of the synthetic products and history
+    ingest     one forced ingest run over every product (fetch p50/p99 per host)
+    dbt        dbt build (p50/p99 over node execution times)
+    dq         the full DQ suite, --repeats times
+    alerts     drop detection and delivery to the stub webhook, --repeats times
+    dashboard  each dashboard query, and a product's read through the price-series
+               cache cold and warm, --repeats times on sampled products
+
+Throughput and p50/p99 latency per stage go to a JSON file
+(bench_results/e2e-<commit>.json by default). `--compare OLD.json`
+prints the change against an earlier run.
+
+Drops and recreates the schemas in DATABASE_URL like reset.py, so point
+it at a scratch database; it refuses to if products already exist,
+unless given `--drop-data`.
+
+Usage: python -m pipeline.bench.e2e [--products N] [--days M] [--repeats R]
+           [--latency S] [--out FILE] [--compare FILE] [--drop-data]
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from urllib.parse import urlparse
+
+from sqlalchemy import text
+
+from pipeline.bench.stub_server import start_stub_server
+from pipeline.common import db
+from pipeline.ingest.metrics import percentile
+
+FIXTURES = Path(__file__).parent / "fixtures"
+RESULTS_DIR = Path("bench_results")
+SNAPSHOTS_PER_DAY = 2
+DROP_EVERY = 5
+DROP_FACTOR = 0.8
+PID_RE = re.compile(r"(\d+)(?:/index\.html)?$")
+
+
+@dataclass(frozen=True)
+class SiteTemplate:
+    """A fixture page and the name and price in it that are replaced per product."""
+
+    host: str
+    fixture: str
+    name: str
+    price: str
+    price_format: str
+    currency: str
+    url: str  # product url, with {pid}
+
+    def render(self, pid: int) -> str:
+        html = (FIXTURES / self.fixture).read_text(encoding="utf-8")
+        return html.replace(self.name, product_name(pid)).replace(self.price, self.price_format.format(page_price(pid)))
+
+
+# Product `pid` lives on TEMPLATES[pid % 2].
+TEMPLATES = [
+    SiteTemplate("books.toscrape.com", "books_to_scrape_product.html", "A Light in the Attic", "£51.77",
+                 "£{:.2f}", "GBP", "http://books.toscrape.com/catalogue/bench-book_{pid}/index.html"),
+    SiteTemplate("webscraper.io", "webscraper_io_product.html", "iPad Mini Retina", "$537.99",
+                 "${:.2f}", "USD", "http://webscraper.io/test-sites/e-commerce/allinone/product/{pid}"),
+]
+
+PRODUCTS_SQL = """
+    insert into public.product (product_id, site, url, name)
+    select p,
+           case when p % 2 = 0 then :host0 else :host1 end,
+           replace(case when p % 2 = 0 then :url0 else :url1 end, '{pid}', p::text),
+           'Bench product ' || p
+    from generate_series(1, :products) p
+"""
+
+# Snapshots in time order, ending a day ago so only the ingest run's drops fall
+# in the alert window; the last one for each product is at base_price().
+HISTORY_SQL = """
+    insert into public.price_history
+      (product_id, ts_utc, price_numeric, currency, in_stock_bool, on_sale_bool, source_hash)
+    select p,
+           now() - interval '1 day' - make_interval(hours => 24 / :per_day * (:snapshots - s)),
+           case when s = :snapshots then 10 + (p % 400) * 0.25
+                else round((10 + (p % 400) * 0.25) * (0.9 + (hashtext(p::text || ':' || s) & 255) / 1275.0), 2)
+           end,
+           case when p % 2 = 0 then :currency0 else :currency1 end,
+           true, false, 'bench'
+    from generate_series(1, :snapshots) s, generate_series(1, :products) p
+"""
+
+
+def product_name(pid: int) -> str:
+    return f"Bench product {pid}"
+
+def base_price(pid: int) -> float:
+    """Price in the last synthetic snapshot (as in HISTORY_SQL)."""
+    return 10 + (pid % 400) * 0.25
+
+def page_price(pid: int) -> float:
+    price = base_price(pid)
+    return round(price * DROP_FACTOR, 2) if pid % DROP_EVERY == 0 else price
+
+def serve_page(path: str):
+    """Stub route; `path` is the absolute url, as requests sends it to a proxy."""
+    url = urlparse(path)
+    match = PID_RE.search(url.path)
+    site = next((t for t in TEMPLATES if t.host == url.hostname), None)
+    if site is None or match is None:
+        return 404, {"Content-Type": "text/plain"}, "not found"
+    return 200, {"Content-Type": "text/html; charset=utf-8"}, site.render(int(match.group(1)))
+
+def check_templates():
+    """Fail early if the current parsers don't read the synthetic pages back."""
+    from pipeline.ingest.registry import parse_page
+
+    for pid, site in enumerate(TEMPLATES, start=DROP_EVERY * len(TEMPLATES)):
+        url = site.url.format(pid=pid)
+        got = parse_page(url, site.render(pid))
+        if (got["name"], got["price"], got["currency"]) != (product_name(pid), page_price(pid), site.currency):
+            sys.exit(f"{site.fixture} no longer parses as expected: {got}")
+
+
+def summarize(seconds: float, items: int, unit: str, samples: list[float] = (), **extra) -> dict:
+    samples = sorted(samples)
+    result = {
+        "seconds": round(seconds, 3),
+        "items": items,
+        "unit": unit,
+        "per_second": round(items / seconds, 1) if seconds else None,
+    }
+    if samples:
+        result["samples"] = len(samples)
+        result["p50_ms"] = round(percentile(samples, 50) * 1000, 2)
+        result["p99_ms"] = round(percentile(samples, 99) * 1000, 2)
+    return {**result, **extra}
+
+def timed(fn) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+def count(sql: str) -> int:
+    with db.engine.connect() as conn:
+        return conn.execute(text(sql)).scalar()
+
+
+def reset_database(drop_data: bool):
+    import reset
+
+    with db.engine.connect() as conn:
+        exists = conn.execute(text("select to_regclass('public.product') is not null")).scalar()
+        in_use = exists and conn.execute(text("select exists (select 1 from public.product)")).scalar()
+    if in_use and not drop_data:
+        sys.exit("DATABASE_URL already has products; pass --drop-data to wipe it for the benchmark.")
+    reset.drop_and_recreate_schemas()
+    reset.create_orm_tables()
+
+def bench_load(products: int, days: int) -> dict:
+    from pipeline.load.latest_price import BACKFILL_SQL
+
+    snapshots = days * SNAPSHOTS_PER_DAY
+    params = {"products": products, "snapshots": snapshots, "per_day": SNAPSHOTS_PER_DAY}
+    for i, site in enumerate(TEMPLATES):
+        params.update({f"host{i}": site.host, f"url{i}": site.url, f"currency{i}": site.currency})
+
+    def load():
+        with db.engine.begin() as conn:
+            conn.execute(text(PRODUCTS_SQL), params)
+            conn.execute(text("select setval(pg_get_serial_sequence('public.product', 'product_id'), :n)"),
+                         {"n": products})
+            conn.execute(text(HISTORY_SQL), params)
+            conn.execute(text(BACKFILL_SQL))
+            conn.execute(text("analyze"))
+
+    return summarize(timed(load), products * snapshots, "rows")
+
+def bench_ingest() -> dict[str, dict]:
+    from pipeline.ingest import fetch_and_parse
+
+    # Politeness delays are for real sites; the stub only adds --latency.
+    fetch_and_parse.HOST_LIMITS = {h: {**l, "delay": 0} for h, l in fetch_and_parse.HOST_LIMITS.items()}
+    run_id = None
+    def run():
+        nonlocal run_id
+        run_id = fetch_and_parse.main(force=True, resume=False, due=False)
+    seconds = timed(run)
+
+    with db.engine.connect() as conn:
+        written, metrics = conn.execute(
+            text("select written, metrics from public.ingest_run where run_id = :id"), {"id": run_id}
+        ).one()
+    parse = {name: round(p["seconds"] / p["pages"] * 1000, 3) for name, p in metrics["parsers"].items() if p["pages"]}
+    results = {"ingest": summarize(seconds, written, "products", parse_ms_per_page=parse)}
+    for host, h in metrics["hosts"].items():
+        results[f"ingest fetch {host}"] = {
+            "items": h["requests"], "unit": "requests",
+            "p50_ms": round(h["p50"] * 1000, 2), "p99_ms": round(h["p99"] * 1000, 2),
+        }
+    return results
+
+def bench_dbt(threads: int) -> dict:
+    import reset
+    from dbt.cli.main import dbtRunner
+
+    os.environ.update({k: str(v) for k, v in reset.parse_database_url_to_pg_env().items()})
+    args = ["build", "--project-dir", str(reset.DBT_DIR), "--profiles-dir", str(reset.PROFILES_DIR),
+            "--threads", str(threads), "--vars", '{"commit_lag_seconds": 0}']
+    result = None
+    def build():
+        nonlocal result
+        result = dbtRunner().invoke(args)
+    seconds = timed(build)
+    if not result.success:
+        raise RuntimeError(f"dbt build failed: {result.exception or 'see dbt output'}")
+    nodes = {r.node.name: r.execution_time for r in result.result.results}
+    slowest = sorted(nodes.items(), key=lambda kv: -kv[1])[:5]
+    return summarize(seconds, len(nodes), "nodes", list(nodes.values()),
+                     slowest={name: round(s, 3) for name, s in slowest})
+
+def bench_dq(repeats: int) -> dict:
+    from pipeline.dq.run_dq_checks import main as run_dq
+
+    rows = count("select count(*) from public.price_history")
+    times = [timed(lambda: run_dq(lag=0)) for _ in range(repeats)]
+    return summarize(sum(times), rows * repeats, "rows", times)
+
+def bench_alerts(repeats: int, posts: list) -> dict:
+    from pipeline.load.alert_price_drops import main as alert_drops
+
+    times, alerts = [], 0
+    for _ in range(repeats):
+        # forget earlier deliveries so every run posts the drops again
+        with db.engine.begin() as conn:
+            conn.execute(text("delete from public.alert_sent"))
+        times.append(timed(alert_drops))
+        alerts += count("select count(*) from public.alert_sent")
+    return summarize(sum(times), alerts, "alerts", times, messages=len(posts))
+
+def bench_dashboard(repeats: int, products: int, days: int) -> dict[str, dict]:
+    import pandas as pd
+    from streamlit_app.queries import (
+        HISTORY_BOUNDS_SQL, LATEST_SQL, PRICE_HISTORY_SQL, PRODUCTS_SQL as DASHBOARD_PRODUCTS_SQL, bucket_seconds,
+    )
+    from pipeline.load.price_series import PriceSeriesCache
+
+    end = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+    start = end - timedelta(days=days + 1)
+    queries = {
+        "latest": (LATEST_SQL, lambda pid: {}),
+        "products": (DASHBOARD_PRODUCTS_SQL, lambda pid: {}),
+        "history bounds": (HISTORY_BOUNDS_SQL, lambda pid: {"pid": pid}),
+        "price history": (PRICE_HISTORY_SQL, lambda pid: {
+            "pid": pid, "start": start, "end": end, "bucket": bucket_seconds(start, end),
+        }),
+    }
+    pids = random.Random(0).sample(range(1, products + 1), min(repeats, products))
+    results = {}
+    with db.engine.connect() as conn:
+        for name, (sql, params) in queries.items():
+            times = [timed(lambda: pd.read_sql(text(sql), conn, params=params(pid))) for pid in pids]
+            results[f"dashboard {name}"] = summarize(sum(times), len(times), "queries", times)
+        cache = PriceSeriesCache()
+        for name in ("cold", "warm"):
+            times = [timed(lambda: cache.get(conn, [pid])) for pid in pids]
+            results[f"dashboard series {name}"] = summarize(sum(times), len(times), "reads", times)
+    return results
+
+
+def git_commit() -> str:
+    try:
+        sha = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True)
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True)
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return sha.stdout.strip() + ("-dirty" if dirty.stdout.strip() else "")
+
+def print_report(stages: dict):
+    print(f"\n{'stage':<34} {'items':>14} {'per second':>12} {'p50 ms':>10} {'p99 ms':>10}")
+    for name, s in stages.items():
+        rate = f"{s['per_second']:.1f}" if s.get("per_second") else "-"
+        p50, p99 = (f"{s[k]:.1f}" if k in s else "-" for k in ("p50_ms", "p99_ms"))
+        print(f"{name:<34} {s['items']:>8} {s['unit']:<5} {rate:>12} {p50:>10} {p99:>10}")
+
+def compare(old: dict, new: dict):
+    print(f"\nChange against {old['commit']}:")
+    if old["params"] != new["params"]:
+        print(f"  (different parameters: {old['params']})")
+    for name, s in new["stages"].items():
+        before = old["stages"].get(name, {})
+        changes = [
+            f"{key} {before[key]:g} -> {s[key]:g} ({(s[key] / before[key] - 1) * 100:+.0f}%)"
+            for key in ("per_second", "p50_ms", "p99_ms")
+            if s.get(key) and before.get(key)
+        ]
+        if changes:
+            print(f"  {name:<32} {', '.join(changes)}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--products", type=int, default=1000)
+    ap.add_argument("--days", type=int, default=90, help="days of synthetic history per product")
+    ap.add_argument("--repeats", type=int, default=20, help="runs of DQ, alerts and each dashboard query")
+    ap.add_argument("--latency", type=float, default=0.02, help="stub response delay in seconds")
+    ap.add_argument("--threads", type=int, default=int(os.getenv("DBT_THREADS", "4")), help="dbt threads")
+    ap.add_argument("--out", type=Path, help="results file (default bench_results/e2e-<commit>.json)")
+    ap.add_argument("--compare", type=Path, help="earlier results file to compare against")
+    ap.add_argument("--drop-data", action="store_true", help="wipe DATABASE_URL even if it has products")
+    args = ap.parse_args()
+
+    posts = []
+    def on_post(path, body):
+        posts.append(body)
+        return 200, {"Content-Type": "text/plain"}, "ok"
+
+    server, base_url = start_stub_server(route=serve_page, latency=args.latency, on_post=on_post)
+    os.environ.update({
+        "HTTP_PROXY": base_url, "http_proxy": base_url, "NO_PROXY": "", "no_proxy": "",
+        "SLACK_WEBHOOK_URL": f"{base_url}/webhook",
+        "NOTIFY_MIN_INTERVAL_SECONDS": "0",
+    })
+    check_templates()
+    started = datetime.now(timezone.utc)
+    stages = {}
+    try:
+        reset_database(args.drop_data)
+        stages["load"] = bench_load(args.products, args.days)
+        stages.update(bench_ingest())
+        stages["dbt"] = bench_dbt(args.threads)
+        stages["dq"] = bench_dq(args.repeats)
+        stages["alerts"] = bench_alerts(args.repeats, posts)
+        stages.update(bench_dashboard(args.repeats, args.products, args.days))
+    finally:
+        server.shutdown()
+
+    report = {
+        "commit": git_commit(),
+        "started_utc": started.isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "params": {k: getattr(args, k) for k in ("products", "days", "repeats", "latency", "threads")},
+        "stages": stages,
+    }
+    out = args.out or RESULTS_DIR / f"e2e-{report['commit']}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, indent=2))
+    print_report(stages)
+    print(f"\nWrote {out}")
+    if args.compare:
+        compare(json.loads(args.compare.read_text()), report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+"""Benchmark fetcher throughput against a local stub server.
+
+Usage: python -m pipeline.bench.fetch_throughput [pages] [latency_seconds]
+"""
+
+import sys
+import time
+
+from pipeline.bench.stub_server import start_stub_server
+from pipeline.ingest.fetcher import Fetcher
+
+CONCURRENCY_LEVELS = [1, 4, 8, 16, 32]
+
+
+def run(pages: int, concurrency: int, base_url: str) -> float:
+    jobs = [(i, f"{base_url}/product/{i}", None) for i in range(pages)]
+    start = time.perf_counter()
+    with Fetcher(max_concurrency=concurrency, per_host=concurrency, delay=0) as fetcher:
+        for _, r in fetcher.fetch_all(jobs):
+            r.raise_for_status()
+    return pages / (time.perf_counter() - start)
+
+
+def main():
+    pages = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+    server, base_url = start_stub_server(latency=latency)
+    try:
+        print(f"{pages} pages, {latency * 1000:.0f} ms simulated latency")
+        for c in CONCURRENCY_LEVELS:
+            print(f"concurrency={c:>3}: {run(pages, c, base_url):8.1f} pages/s")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Check the cold-start import cost of every `python -m pipeline` command.
+
+Each command's module is imported in a fresh interpreter under
+`-X importtime` without DATABASE_URL set. A command fails if importing
+it takes longer than its budget (best of `repeats` runs, scaled by
+IMPORT_BUDGET_SCALE for slower machines) or pulls in a module that
+should only load on use: the database driver (the engine is created
+lazily), Great Expectations, BeautifulSoup (only the non-default parser
+backend uses it) or pandas outside the reporting jobs.
+
+Usage: python -m pipeline.bench.import_time [command ...]
+"""
+
+import os
+import subprocess
+import sys
+from collections import Counter
+
+from pipeline.__main__ import COMMANDS
+
+BUDGET_SCALE = float(os.getenv("IMPORT_BUDGET_SCALE", "1"))
+
+# command -> import budget in ms
+BUDGETS_MS = {
+    "init-db": 600,
+    "seed": 600,
+    "ingest": 800,
+    "discover": 800,
+    "replay": 800,
+    "partitions": 500,
+    "export": 900,
+    "dq": 700,
+    "alerts": 1400,
+    "summary": 700,
+    "reset": 600,
+}
+CLI_BUDGET_MS = 20
+
+ALWAYS_LAZY = ("psycopg", "great_expectations", "bs4")
+USES_PANDAS = ("alerts", "export")  # pyarrow.dataset imports pandas
+
+
+def import_profile(module: str) -> tuple[float, Counter, set[str], str]:
+    """(cumulative ms, self ms per top-level package, modules imported, error)."""
+    env = {k: v for k, v in os.environ.items() if k != "DATABASE_URL"}
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, env=env,
+    )
+    total, by_package, names = 0.0, Counter(), set()
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line.split(":", 1)[1].split("|")
+        name = name.strip()
+        names.add(name)
+        by_package[name.split(".")[0]] += int(self_us) / 1000
+        if name == module:
+            total = int(cumulative_us) / 1000
+    error = proc.stderr.strip().splitlines()[-1] if proc.returncode else ""
+    return total, by_package, names, error
+
+
+def check(command: str, module: str, budget: float, repeats: int = 3) -> bool:
+    runs = [import_profile(module) for _ in range(repeats)]
+    total, by_package, names, error = min(runs, key=lambda r: r[0])
+    if error:
+        print(f"{command:<11} FAIL import error: {error}")
+        return False
+    lazy = ALWAYS_LAZY if command in USES_PANDAS else ALWAYS_LAZY + ("pandas",)
+    eager = sorted(p for p in lazy if p in names)
+    over = total > budget
+    heaviest = ", ".join(f"{p} {ms:.0f}ms" for p, ms in by_package.most_common(3))
+    status = "FAIL" if over or eager else "ok  "
+    print(f"{command:<11} {status} {total:7.1f}ms / {budget:.0f}ms  ({heaviest})")
+    if eager:
+        print(f"{'':<11}      imported at module load: {', '.join(eager)}")
+    return not (over or eager)
+
+
+def main():
+    wanted = sys.argv[1:] or list(BUDGETS_MS)
+    ok = check("(cli)", "pipeline.__main__", CLI_BUDGET_MS * BUDGET_SCALE)
+    for command in wanted:
+        ok &= check(command, COMMANDS[command][0], BUDGETS_MS[command] * BUDGET_SCALE)
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Benchmark webhook delivery against a local stub that throttles and fails.
+
+Sends alert lines through `Notifier` to a stub webhook that answers every
+`fail_every`-th POST with a 429 (Retry-After: 0) or a 503, then checks
+that every line arrived exactly once and no message went over the size
+limit. A last run against a webhook that never answers in time shows
+how long a post takes to give up.
+
+Usage: python -m pipeline.bench.notify_delivery [lines] [fail_every] [latency_seconds]
+"""
+
+import json
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+from pipeline.bench.stub_server import start_stub_server
+from pipeline.load.notify import MAX_CHARS, Notifier
+
+LINE = re.compile(r"Product (\d+):")
+
+
+def flaky_webhook(fail_every: int):
+    """An `on_post` handler recording accepted messages; returns it with the list."""
+    received, lock = [], threading.Lock()
+    calls = Counter()
+
+    def on_post(path, body):
+        with lock:
+            calls["n"] += 1
+            n = calls["n"]
+        if fail_every and n % fail_every == 0:
+            if n % (2 * fail_every) == 0:
+                return 429, {"Retry-After": "0"}, "rate_limited"
+            return 503, {}, "unavailable"
+        with lock:
+            received.append(json.loads(body)["text"])
+        return 200, {"Content-Type": "text/plain"}, "ok"
+
+    return on_post, received
+
+
+def lines_for(count: int) -> list[str]:
+    return [
+        f"books.toscrape.com – Product {i}: {50 + i % 7:.2f} → {40 + i % 5:.2f} GBP ({i % 30 + 1:.2f}%)\n"
+        f"https://books.toscrape.com/catalogue/product_{i}/index.html"
+        for i in range(count)
+    ]
+
+
+def run(count: int, fail_every: int, latency: float, min_interval: float):
+    on_post, received = flaky_webhook(fail_every)
+    server, base_url = start_stub_server(latency=latency, on_post=on_post)
+    try:
+        start = time.perf_counter()
+        with Notifier(f"{base_url}/hook", backoff=0, min_interval=min_interval, echo=False) as notifier:
+            delivered = notifier.send(lines_for(count), header="Price drops detected:", sep="\n\n")
+        elapsed = time.perf_counter() - start
+    finally:
+        server.shutdown()
+    seen = Counter(int(m) for text in received for m in LINE.findall(text))
+    ok = len(delivered) == count and len(seen) == count and max(seen.values()) == 1
+    biggest = max(len(t) for t in received)
+    print(
+        f"min_interval={min_interval:<5} {notifier.sent} messages in {elapsed:.2f}s "
+        f"({notifier.sent / elapsed:.1f} msg/s, {count / elapsed:.0f} alerts/s), "
+        f"{notifier.retries} retries, {notifier.failed} failed, largest {biggest}/{MAX_CHARS} chars, "
+        f"{'all delivered once' if ok else 'MISSING OR DUPLICATED LINES'}"
+    )
+
+
+def run_hung(timeout: float):
+    server, base_url = start_stub_server(latency=timeout * 4)
+    try:
+        start = time.perf_counter()
+        with Notifier(f"{base_url}/hook", timeout=timeout, retries=1, backoff=0, min_interval=0, echo=False) as notifier:
+            ok = notifier.post("hello")
+        print(f"hung webhook: gave up after {time.perf_counter() - start:.2f}s (timeout {timeout}s, 1 retry), sent={ok}")
+    finally:
+        server.shutdown()
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    fail_every = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    latency = float(sys.argv[3]) if len(sys.argv) > 3 else 0.02
+    print(f"{count} alerts, 1 in {fail_every} POSTs fails, {latency * 1000:.0f} ms simulated latency")
+    for min_interval in (0.0, 0.1):
+        run(count, fail_every, latency, min_interval)
+    run_hung(0.2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""Benchmark parser lookup as the number of registered sites grows.
+
+Registers `sites` synthetic hosts next to the real ones and times
+`find_site` against the old linear `host in url` scan, for urls on the
+first and last registered host, a subdomain, and a url that only
+mentions a site in its query string (which the scan misroutes).
+
+Usage: python -m pipeline.bench.parser_lookup [sites] [lookups]
+"""
+
+import sys
+import time
+
+from pipeline.ingest.registry import SITES, find_site, register_site
+
+SITE_COUNTS = [2, 100, 1000]
+
+
+def linear_scan(url: str):
+    for host, site in SITES.items():
+        if host in url:
+            return site
+    return None
+
+
+def per_lookup_us(fn, urls: list[str], lookups: int) -> float:
+    start = time.perf_counter()
+    for i in range(lookups):
+        fn(urls[i % len(urls)])
+    return (time.perf_counter() - start) / lookups * 1e6
+
+
+def main():
+    counts = [int(sys.argv[1])] if len(sys.argv) > 1 else SITE_COUNTS
+    lookups = int(sys.argv[2]) if len(sys.argv) > 2 else 100_000
+    probe = "https://example.com/search?ref=webscraper.io"
+    wrong = linear_scan(probe)
+    print(f"query-string url {probe}: scan -> {wrong.host if wrong else None}, "
+          f"find_site -> {find_site(probe)}")
+
+    for count in counts:
+        for i in range(len(SITES), count):
+            register_site(f"shop{i}.example.net")
+        last = next(reversed(SITES))
+        urls = [
+            "https://books.toscrape.com/catalogue/a-light-in-the-attic_1000/index.html",
+            f"https://{last}/product/1",
+            f"https://www.{last}/product/2",
+        ]
+        assert all(find_site(u) is not None for u in urls)
+        print(
+            f"{len(SITES):>5} sites: find_site {per_lookup_us(find_site, urls, lookups):6.2f} us, "
+            f"linear scan {per_lookup_us(linear_scan, urls, lookups):8.2f} us per lookup"
+        )
+
+
+if __name__ == "__main__":
+    main()
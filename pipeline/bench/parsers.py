@@ -0,0 +1,56 @@
+"""Golden-file benchmark of the bs4 and lxml parser backends.
+
+Usage: python -m pipeline.bench.parsers [iterations]
+
+Every backend must reproduce fixtures/golden.json exactly before it is timed.
+"""
+
+import json
+import sys
+import time
+from pathlib import Path
+
+from pipeline.ingest.parsers import books_to_scrape, webscraper_io
+
+FIXTURES = Path(__file__).parent / "fixtures"
+
+# Product backends as registered by each parser module.
+BACKENDS = {
+    "books_to_scrape_product.html": books_to_scrape.SITE.parsers,
+    "webscraper_io_product.html": webscraper_io.SITE.parsers,
+    # Listing pages only have an lxml parser.
+    "books_to_scrape_listing.html": {"lxml": books_to_scrape.SITE.listing_parser},
+    "webscraper_io_listing.html": {"lxml": webscraper_io.SITE.listing_parser},
+}
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    golden = json.loads((FIXTURES / "golden.json").read_text())
+
+    failed = False
+    for fixture, case in golden.items():
+        html = (FIXTURES / fixture).read_text(encoding="utf-8")
+        timings = {}
+        for backend, parse in BACKENDS[fixture].items():
+            got = parse(html, case["url"])
+            if got != case["expected"]:
+                print(f"{fixture} [{backend}] does not match golden output: {got}")
+                failed = True
+                continue
+            start = time.perf_counter()
+            for _ in range(iterations):
+                parse(html, case["url"])
+            timings[backend] = (time.perf_counter() - start) / iterations
+
+        line = ", ".join(f"{b}={t * 1e6:.0f} us/page" for b, t in timings.items())
+        if len(timings) == 2:
+            line += f", speedup {timings['bs4'] / timings['lxml']:.1f}x"
+        print(f"{fixture}: {line}")
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Benchmark the ORM snapshot path against SnapshotWriter on a local Postgres.
+
+Usage: python -m pipeline.bench.snapshot_writer [rows] [batch_size]
+
+Writes synthetic products under site 'bench.invalid' and deletes them afterwards.
+"""
+
+import sys
+import time
+
+from sqlalchemy import delete, select
+
+from pipeline.common import db
+from pipeline.common.models import Product, PriceHistory, CrawlState
+from pipeline.load.upsert import SnapshotWriter, get_or_create_product, write_price_snapshot
+
+SITE = "bench.invalid"
+
+
+def records(n: int, run: int):
+    for i in range(n):
+        yield {
+            "site": SITE,
+            "url": f"https://{SITE}/product/{i}",
+            "name": f"Bench product {i}",
+            "price": 10 + (i + run) % 50,
+            "currency": "GBP",
+            "in_stock": True,
+            "on_sale": False,
+        }
+
+
+def orm_path(n: int, run: int):
+    with db.SessionLocal() as session:
+        for r in records(n, run):
+            pid = get_or_create_product(session, r["site"], r["url"], r["name"])
+            write_price_snapshot(session, pid, r["price"], r["currency"], r["in_stock"], r["on_sale"], "bench")
+        session.commit()
+
+
+def bulk_path(n: int, run: int, batch_size: int):
+    with db.SessionLocal() as session, SnapshotWriter(session, batch_size=batch_size) as writer:
+        for r in records(n, run):
+            writer.add(r, source_hash="bench")
+
+
+def cleanup():
+    with db.SessionLocal() as session:
+        ids = select(Product.product_id).where(Product.site == SITE)
+        session.execute(delete(CrawlState).where(CrawlState.product_id.in_(ids)))
+        session.execute(delete(PriceHistory).where(PriceHistory.product_id.in_(ids)))
+        session.execute(delete(Product).where(Product.site == SITE))
+        session.commit()
+
+
+def timed(label: str, n: int, fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {n / elapsed:10.0f} rows/s ({elapsed:.2f}s)")
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    cleanup()
+    try:
+        # first pass inserts products, second pass reuses them
+        timed("orm, new products", n, orm_path, n, 0)
+        timed("orm, existing products", n, orm_path, n, 1)
+        cleanup()
+        timed(f"bulk({batch_size}), new products", n, bulk_path, n, 0, batch_size)
+        timed(f"bulk({batch_size}), existing", n, bulk_path, n, 1, batch_size)
+    finally:
+        cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Local HTTP stub server for offline benchmarks."""
+
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_BODY = (
+    "<html><body><div class='product_main'><h1>Stub Book</h1>"
+    "<p class='price_color'>£10.00</p>"
+    "<p class='availability'>In stock</p></div></body></html>"
+)
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+
+def start_stub_server(route=None, latency: float = 0.0, port: int = 0, on_post=None):
+    """Serve `route(path) -> (status, headers, body)` on localhost in a thread.
+
+    POSTs go to `on_post(path, body_bytes)`, which returns the same tuple
+    (default: 200 "ok", like a Slack webhook). Each response is delayed by
+    `latency` seconds to mimic a remote host. Returns the server and its
+    base url; call `server.shutdown()` when done.
+    """
+    if route is None:
+        route = lambda path: (200, {"Content-Type": "text/html; charset=utf-8"}, DEFAULT_BODY)
+    if on_post is None:
+        on_post = lambda path, body: (200, {"Content-Type": "text/plain"}, "ok")
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            if latency:
+                time.sleep(latency)
+            self._respond(*route(self.path))
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if latency:
+                time.sleep(latency)
+            self._respond(*on_post(self.path, body))
+
+        def _respond(self, status, headers, body):
+            payload = body.encode("utf-8") if isinstance(body, str) else body
+            self.send_response(status)
+            for k, v in headers.items():
+                self.send_header(k, v)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = _Server(("127.0.0.1", port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
@@ -5,8 +5,16 @@ import os
 
 load_dotenv()
 
-DATABASE_URL = os.getenv("DATABASE_URL")
-if not DATABASE_URL:
-    raise RuntimeError(
-        "DATABASE_URL is not set. Create a .env from .env.example and fill it in."
-    )
+def database_url() -> str:
+    url = os.getenv("DATABASE_URL")
+    if not url:
+        raise RuntimeError(
+            "DATABASE_URL is not set. Create a .env from .env.example and fill it in."
+        )
+    return url
+
+def __getattr__(name):
+    # DATABASE_URL is checked when first used, not when this module is imported
+    if name == "DATABASE_URL":
+        return database_url()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,11 +1,121 @@
-"""Initializes the database engine and session management using SQLAlchemy."""
+"""Initializes the database engine and session management using SQLAlchemy.
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, DeclarativeBase
-from .config import DATABASE_URL
+`engine` and `SessionLocal` are created on first use, so importing models
+(or any module that imports them) needs neither DATABASE_URL nor the
+database driver. Import the module (`from pipeline.common import db`) and
+use `db.engine` / `db.SessionLocal` inside functions to keep it that way.
 
-engine = create_engine(DATABASE_URL, future=True)
-SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
+Every job shares the one pooled `engine`, so jobs run back to back in a
+process (as `reset.py` does) reuse connections instead of reconnecting
+to Neon. `make_engine` builds an engine with the same settings for
+callers that need their own (the dashboard). The time spent waiting for
+a pooled connection is recorded in `acquire_times`.
+"""
+
+import os
+import threading
+import time
+from collections import deque
+
+from sqlalchemy.orm import DeclarativeBase
+
+from .config import database_url
+
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "5"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Recycle before Neon's proxy drops idle connections.
+POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# Per-statement limit in ms (0 = none), so a hung query fails the job.
+STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "600000"))
+# Rows per fetch from a server-side cursor (see `streaming`).
+STREAM_ROWS = int(os.getenv("DB_STREAM_ROWS", "10000"))
 
 class Base(DeclarativeBase):
     pass
+
+
+class AcquireTimes:
+    """Seconds spent in each pool checkout, including connecting and pre-ping."""
+
+    def __init__(self, keep: int = 100_000):
+        self._lock = threading.Lock()
+        self._times: deque[float] = deque(maxlen=keep)
+        self.count = 0
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self._times.append(seconds)
+            self.count += 1
+
+    def mark(self) -> int:
+        return self.count
+
+    def since(self, mark: int = 0) -> list[float]:
+        """Checkout times after `mark` (the most recent `keep` at most)."""
+        with self._lock:
+            n = min(self.count - mark, len(self._times))
+            return list(self._times)[len(self._times) - n:]
+
+acquire_times = AcquireTimes()
+
+
+def make_engine(
+    url: str | None = None,
+    pool_size: int = POOL_SIZE,
+    max_overflow: int = MAX_OVERFLOW,
+    pool_timeout: float = POOL_TIMEOUT,
+    statement_timeout_ms: int = STATEMENT_TIMEOUT_MS,
+):
+    """A pooled engine with pre-ping, recycling, a statement timeout and checkout timing."""
+    from sqlalchemy import create_engine, event
+    from sqlalchemy.pool import QueuePool
+
+    class TimedQueuePool(QueuePool):
+        def connect(self):
+            start = time.perf_counter()
+            try:
+                return super().connect()
+            finally:
+                acquire_times.observe(time.perf_counter() - start)
+
+    engine = create_engine(
+        url or database_url(),
+        future=True,
+        poolclass=TimedQueuePool,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_timeout=pool_timeout,
+        pool_recycle=POOL_RECYCLE,
+        pool_pre_ping=True,
+    )
+    if statement_timeout_ms:
+        @event.listens_for(engine, "connect")
+        def set_statement_timeout(dbapi_conn, record):
+            with dbapi_conn.cursor() as cur:
+                cur.execute(f"set statement_timeout = {int(statement_timeout_ms)}")
+            dbapi_conn.commit()
+    return engine
+
+
+def streaming(conn, rows: int = STREAM_ROWS):
+    """`conn` reading results through a server-side cursor, `rows` at a time."""
+    return conn.execution_options(stream_results=True, yield_per=rows)
+
+
+_lock = threading.RLock()
+
+def _create(name):
+    from sqlalchemy.orm import sessionmaker
+
+    if name == "engine":
+        return make_engine()
+    return sessionmaker(bind=__getattr__("engine"), autoflush=False, autocommit=False, future=True)
+
+def __getattr__(name):
+    if name not in ("engine", "SessionLocal"):
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    with _lock:
+        if name not in globals():
+            globals()[name] = _create(name)
+    return globals()[name]
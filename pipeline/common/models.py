@@ -1,11 +1,11 @@
 """Defines SQLAlchemy ORM models for the core database tables."""
 
 from sqlalchemy import (
-    Integer, BigInteger, Text, Boolean, Numeric, ForeignKey,
-    UniqueConstraint, func
+    Integer, BigInteger, Text, Boolean, Numeric, Float, Date, LargeBinary, ForeignKey,
+    UniqueConstraint, Index, func
 )
 from sqlalchemy.orm import Mapped, mapped_column, relationship
-from sqlalchemy.dialects.postgresql import TIMESTAMP
+from sqlalchemy.dialects.postgresql import TIMESTAMP, JSONB
 from .db import Base
 
 class Product(Base):
@@ -22,12 +22,124 @@ class Product(Base):
 class PriceHistory(Base):
     __tablename__ = "price_history"
     id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
-    product_id: Mapped[int] = mapped_column(ForeignKey("product.product_id"), index=True, nullable=False)
+    product_id: Mapped[int] = mapped_column(ForeignKey("product.product_id"), nullable=False)
     ts_utc: Mapped[object] = mapped_column(TIMESTAMP(timezone=True), server_default=func.now(), index=True)
     price_numeric: Mapped[float | None] = mapped_column(Numeric(12, 2))
     currency: Mapped[str | None] = mapped_column(Text)
     in_stock_bool: Mapped[bool | None] = mapped_column(Boolean)
     on_sale_bool: Mapped[bool | None] = mapped_column(Boolean)
     source_hash: Mapped[str | None] = mapped_column(Text)
+    __table_args__ = (Index("ix_price_history_product_ts", "product_id", "ts_utc"),)
 
     product: Mapped["Product"] = relationship(back_populates="prices")
+
+class CrawlState(Base):
+    __tablename__ = "crawl_state"
+    product_id: Mapped[int] = mapped_column(ForeignKey("product.product_id"), primary_key=True)
+    etag: Mapped[str | None] = mapped_column(Text)
+    last_modified: Mapped[str | None] = mapped_column(Text)
+    last_hash: Mapped[str | None] = mapped_column(Text)
+    last_checked_utc: Mapped[object] = mapped_column(TIMESTAMP(timezone=True), nullable=True)
+    last_changed_utc: Mapped[object] = mapped_column(TIMESTAMP(timezone=True), nullable=True)
+    unchanged_runs: Mapped[int] = mapped_column(Integer, nullable=False, server_default="0")
+    lease_owner: Mapped[str | None] = mapped_column(Text)
+    interval_seconds: Mapped[int | None] = mapped_column(Integer)
+    next_due_utc: Mapped[object] = mapped_column(TIMESTAMP(timezone=True), nullable=True, index=True)
+    lease_expires_utc: Mapped[object] = mapped_column(TIMESTAMP(timezone=True), nullable=True)
+
+class ProductLatestPrice(Base):
+    __tablename__ = "product_latest_price"
+    product_id: Mapped[int] = mapped_column(ForeignKey("product.product_id"), primary_key=True)
+    price_history_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    last_price: Mapped[float | None] = mapped_column(Numeric(12, 2))
+    prev_price: Mapped[float | None] = mapped_column(Numeric(12, 2))
+    currency: Mapped[str | None] = mapped_column(Text)
+    in_stock_bool: Mapped[bool | None] = mapped_column(Boolean)
+    prev_in_stock_bool: Mapped[bool | None] = mapped_column(Boolean)
+    last_seen_utc: Mapped[object] = mapped_column(TIMESTAMP(timezone=True), nullable=False)
+    price_changed_utc: Mapped[object] = mapped_column(TIMESTAMP(timezone=True), nullable=False)
+    stock_changed_utc: Mapped[object] = mapped_column(TIMESTAMP(timezone=True), nullable=True)
+
+class PriceHistoryDaily(Base):
+    """Daily min/max/last rollup of price_history partitions past retention."""
+    __tablename__ = "price_history_daily"
+    product_id: Mapped[int] = mapped_column(ForeignKey("product.product_id"), primary_key=True)
+    day: Mapped[object] = mapped_column(Date, primary_key=True)
+    min_price: Mapped[float | None] = mapped_column(Numeric(12, 2))
+    max_price: Mapped[float | None] = mapped_column(Numeric(12, 2))
+    last_price: Mapped[float | None] = mapped_column(Numeric(12, 2))
+    currency: Mapped[str | None] = mapped_column(Text)
+    last_in_stock: Mapped[bool | None] = mapped_column(Boolean)
+    snapshots: Mapped[int] = mapped_column(Integer, nullable=False)
+
+class IngestRun(Base):
+    """One fetch_and_parse run: counts, stage timings and per-host/parser metrics."""
+    __tablename__ = "ingest_run"
+    run_id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    started_utc: Mapped[object] = mapped_column(TIMESTAMP(timezone=True), nullable=False, index=True)
+    finished_utc: Mapped[object] = mapped_column(TIMESTAMP(timezone=True), nullable=True)
+    status: Mapped[str] = mapped_column(Text, nullable=False)
+    mode: Mapped[str | None] = mapped_column(Text)
+    worker: Mapped[str | None] = mapped_column(Text)
+    targets: Mapped[int | None] = mapped_column(Integer)
+    fetched: Mapped[int | None] = mapped_column(Integer)
+    written: Mapped[int | None] = mapped_column(Integer)
+    unchanged: Mapped[int | None] = mapped_column(Integer)
+    errors: Mapped[int | None] = mapped_column(Integer)
+    bytes_downloaded: Mapped[int | None] = mapped_column(BigInteger)
+    fetch_seconds: Mapped[float | None] = mapped_column(Float)
+    parse_seconds: Mapped[float | None] = mapped_column(Float)
+    write_seconds: Mapped[float | None] = mapped_column(Float)
+    wall_seconds: Mapped[float | None] = mapped_column(Float)
+    metrics: Mapped[dict | None] = mapped_column(JSONB)
+
+class PageArchive(Base):
+    """zstd-compressed page bodies keyed by the sha256 in price_history.source_hash."""
+    __tablename__ = "page_archive"
+    sha256: Mapped[str] = mapped_column(Text, primary_key=True)
+    kind: Mapped[str] = mapped_column(Text, nullable=False)
+    url: Mapped[str] = mapped_column(Text, nullable=False)
+    size: Mapped[int] = mapped_column(Integer, nullable=False)
+    body: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+    archived_utc: Mapped[object] = mapped_column(TIMESTAMP(timezone=True), server_default=func.now())
+
+class DqRun(Base):
+    """One run_dq_checks run over price_history ids in (from_id, to_id]."""
+    __tablename__ = "dq_run"
+    run_id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    started_utc: Mapped[object] = mapped_column(TIMESTAMP(timezone=True), server_default=func.now())
+    mode: Mapped[str] = mapped_column(Text, nullable=False)
+    from_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    to_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    rows: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    passed: Mapped[bool] = mapped_column(Boolean, nullable=False)
+    seconds: Mapped[float | None] = mapped_column(Float)
+    results: Mapped[list | None] = mapped_column(JSONB)
+
+class AlertSent(Base):
+    """Price-drop alerts already delivered, keyed by the snapshot time of the drop."""
+    __tablename__ = "alert_sent"
+    product_id: Mapped[int] = mapped_column(ForeignKey("product.product_id"), primary_key=True)
+    event_utc: Mapped[object] = mapped_column(TIMESTAMP(timezone=True), primary_key=True)
+    new_price: Mapped[float | None] = mapped_column(Numeric(12, 2))
+    sent_utc: Mapped[object] = mapped_column(TIMESTAMP(timezone=True), server_default=func.now())
+
+class StageRun(Base):
+    """Inputs of each reset.py stage's last successful run, used to skip unchanged stages."""
+    __tablename__ = "stage_run"
+    stage: Mapped[str] = mapped_column(Text, primary_key=True)
+    fingerprint: Mapped[dict] = mapped_column(JSONB, nullable=False)
+    finished_utc: Mapped[object] = mapped_column(TIMESTAMP(timezone=True), server_default=func.now())
+    seconds: Mapped[float | None] = mapped_column(Float)
+
+class FetchDeadLetter(Base):
+    """Urls whose last fetch failed, kept until a later fetch succeeds (see pipeline.load.dead_letter)."""
+    __tablename__ = "fetch_dead_letter"
+    url: Mapped[str] = mapped_column(Text, primary_key=True)
+    kind: Mapped[str] = mapped_column(Text, nullable=False)
+    product_id: Mapped[int | None] = mapped_column(ForeignKey("product.product_id", ondelete="CASCADE"), index=True)
+    error: Mapped[str] = mapped_column(Text, nullable=False)
+    status: Mapped[int | None] = mapped_column(Integer)
+    failures: Mapped[int] = mapped_column(Integer, nullable=False, server_default="1")
+    first_failed_utc: Mapped[object] = mapped_column(TIMESTAMP(timezone=True), server_default=func.now())
+    last_failed_utc: Mapped[object] = mapped_column(TIMESTAMP(timezone=True), server_default=func.now())
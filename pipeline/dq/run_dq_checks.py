@@ -1,39 +1,172 @@
-"""Run basic Great Expectations checks on price_history table."""
+"""Run the dq_suite.json expectations against the price_history table.
 
+Expectations with a SQL translation in `PUSHDOWN` run as one aggregate
+query each, so only counts leave the database. Any other column-map
+expectation is evaluated by Great Expectations over `DQ_CHUNK_SIZE`-row
+batches of that column, streamed from a server-side cursor, with the
+per-batch counts added up. Memory stays flat however long history gets.
+
+With `--incremental` only rows with ids above the last passing run's
+checkpoint are checked. Rows younger than DQ_LAG_SECONDS are left for
+the next run, so a write transaction still in flight can't commit a
+lower id behind the checkpoint. Every run is recorded in dq_run with
+its id range and per-expectation violation counts and timings.
+
+Usage: python -m pipeline.dq.run_dq_checks [--incremental]
+"""
+
+import argparse
+import json
 import os
 import sys
-import pandas as pd
-from sqlalchemy import create_engine
-import json
-from great_expectations.dataset import PandasDataset
+import time
+
+from sqlalchemy import func, insert, or_, select
+
+from pipeline.common import db
+from pipeline.common.models import DqRun, PriceHistory
+
+CHUNK_SIZE = int(os.getenv("DQ_CHUNK_SIZE", "50000"))
+LAG_SECONDS = int(os.getenv("DQ_LAG_SECONDS", "300"))
+
+TABLE = PriceHistory.__table__
+
+
+def _not_null(col):
+    return col.is_(None), None
+
+def _between(col, min_value=None, max_value=None, strict_min=False, strict_max=False):
+    bounds = []
+    if min_value is not None:
+        bounds.append(col <= min_value if strict_min else col < min_value)
+    if max_value is not None:
+        bounds.append(col >= max_value if strict_max else col > max_value)
+    return or_(*bounds), col.is_not(None)
+
+def _in_set(col, value_set):
+    return col.not_in([v for v in value_set if v is not None]), col.is_not(None)
+
+# expectation type -> fn(column, **kwargs) returning (violation, domain)
+# conditions; a None domain means every row. Nulls are outside the domain
+# of everything but not-null checks, as in Great Expectations.
+PUSHDOWN = {
+    "expect_column_values_to_not_be_null": _not_null,
+    "expect_column_values_to_be_between": _between,
+    "expect_column_values_to_be_in_set": _in_set,
+}
 
-def main():
-    db_url = os.getenv("DATABASE_URL")
-    if not db_url:
-        print("DATABASE_URL not set.")
-        sys.exit(1)
 
+def pushdown_counts(conn, etype: str, kwargs: dict, from_id: int, to_id: int) -> tuple[int, int]:
+    """(unexpected, domain) counts from one aggregate query."""
+    col = TABLE.c[kwargs["column"]]
+    violation, domain = PUSHDOWN[etype](col, **{k: v for k, v in kwargs.items() if k != "column"})
+    stmt = select(
+        func.count().filter(violation),
+        func.count().filter(domain) if domain is not None else func.count(),
+    ).where(TABLE.c.id > from_id, TABLE.c.id <= to_id)
+    unexpected, total = conn.execute(stmt).one()
+    return unexpected, total
+
+
+def chunked_counts(conn, etype: str, kwargs: dict, from_id: int, to_id: int) -> tuple[int, int]:
+    """(unexpected, domain) counts summed over streamed batches of the column."""
+    import pandas as pd
+    from great_expectations.dataset import PandasDataset
+
+    if not hasattr(PandasDataset, etype):
+        raise ValueError(f"Unknown expectation: {etype}")
+    if "column" not in kwargs:
+        raise ValueError(f"{etype} is not a column expectation")
+    col = TABLE.c[kwargs["column"]]
+    stmt = select(col).where(TABLE.c.id > from_id, TABLE.c.id <= to_id)
+    unexpected = total = 0
+    for chunk in pd.read_sql(stmt, db.streaming(conn, CHUNK_SIZE), chunksize=CHUNK_SIZE):
+        result = getattr(PandasDataset(chunk), etype)(**kwargs).result
+        if "unexpected_count" not in result:
+            raise ValueError(f"{etype} can't be evaluated in batches")
+        unexpected += result["unexpected_count"]
+        total += result["element_count"] - result.get("missing_count", 0)
+    return unexpected, total
+
+
+def check(conn, exp: dict, from_id: int, to_id: int) -> dict:
+    etype = exp["expectation_type"]
+    kwargs = dict(exp["kwargs"])
+    mostly = kwargs.pop("mostly", 1.0)
+    start = time.perf_counter()
+    if etype in PUSHDOWN:
+        method = "sql"
+        unexpected, total = pushdown_counts(conn, etype, kwargs, from_id, to_id)
+    else:
+        method = "chunked"
+        unexpected, total = chunked_counts(conn, etype, kwargs, from_id, to_id)
+    success = total == 0 or (total - unexpected) / total >= mostly
+    return {
+        "expectation_type": etype,
+        "kwargs": exp["kwargs"],
+        "method": method,
+        "unexpected": unexpected,
+        "total": total,
+        "success": success,
+        "seconds": round(time.perf_counter() - start, 4),
+    }
+
+
+def last_checkpoint(conn) -> int:
+    return conn.execute(select(func.max(DqRun.to_id)).where(DqRun.passed)).scalar() or 0
+
+
+def upper_id(conn, lag: int) -> int:
+    """Highest id whose rows all belong to committed transactions (as in export_parquet)."""
+    return conn.execute(
+        select(func.coalesce(func.max(TABLE.c.id), 0))
+        .where(TABLE.c.ts_utc < func.now() - func.make_interval(0, 0, 0, 0, 0, 0, lag))
+    ).scalar()
+
+
+def main(incremental: bool = False, lag: int | None = None):
+    lag = LAG_SECONDS if lag is None else lag
     suite_path = os.path.join(os.path.dirname(__file__), "dq_suite.json")
     with open(suite_path, "r") as f:
         suite = json.load(f)
 
-    engine = create_engine(db_url)
-    df = pd.read_sql("select * from price_history", engine)
-    dataset = PandasDataset(df)
-
-    all_passed = True
-    for exp in suite["expectations"]:
-        etype = exp["expectation_type"]
-        kwargs = exp["kwargs"]
-        func = getattr(dataset, etype, None)
-        if not func:
-            print(f"Unknown expectation: {etype}")
-            continue
-        result = func(**kwargs)
-        success = result.get("success", False)
-        print(f"{etype} ({kwargs}) -> {'PASS' if success else 'FAIL'}")
-        if not success:
-            all_passed = False
+    started = time.perf_counter()
+    with db.engine.connect() as conn:
+        from_id = last_checkpoint(conn) if incremental else 0
+        to_id = max(upper_id(conn, lag), from_id)
+        rows = conn.execute(
+            select(func.count()).where(TABLE.c.id > from_id, TABLE.c.id <= to_id)
+        ).scalar()
+        print(f"Checking {rows} price_history rows with ids in ({from_id}, {to_id}]")
+
+        results = []
+        all_passed = True
+        if rows:
+            for exp in suite["expectations"]:
+                try:
+                    r = check(conn, exp, from_id, to_id)
+                except ValueError as e:
+                    print(e)
+                    continue
+                results.append(r)
+                print(
+                    f"{r['expectation_type']} ({r['kwargs']}) -> {'PASS' if r['success'] else 'FAIL'}: "
+                    f"{r['unexpected']}/{r['total']} unexpected [{r['method']}, {r['seconds'] * 1000:.0f}ms]"
+                )
+                all_passed = all_passed and r["success"]
+
+    seconds = time.perf_counter() - started
+    with db.engine.begin() as conn:
+        conn.execute(insert(DqRun).values(
+            mode="incremental" if incremental else "full",
+            from_id=from_id,
+            to_id=to_id,
+            rows=rows,
+            passed=all_passed,
+            seconds=seconds,
+            results=results,
+        ))
+    print(f"Checked in {seconds:.2f}s")
 
     if not all_passed:
         print("Data quality checks failed.")
@@ -42,4 +175,6 @@ def main():
         print("All data quality checks passed.")
 
 if __name__ == "__main__":
-    main()
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--incremental", action="store_true", help="only rows after the last passing run")
+    main(incremental=ap.parse_args().incremental)
@@ -0,0 +1,195 @@
+"""Crawl category listing pages and snapshot every product listed on them.
+
+One listing page carries name, price and stock for ~20 products, so a
+category costs a few requests instead of one per product. Products not
+yet in `product` are registered as they are written; an entry whose
+listing lacks a field gets its product page fetched instead. Entries
+whose price and stock match product_latest_price only bump crawl_state.
+Snapshots taken from a listing carry the listing page's hash as their
+source_hash, and the page is archived like product pages are.
+
+Usage: python -m pipeline.ingest.discover [category_url ...]
+"""
+
+import sys
+import time
+
+from loguru import logger
+from sqlalchemy import select
+
+from pipeline.common import db
+from pipeline.common.models import Product, ProductLatestPrice
+from pipeline.ingest.fetch_and_parse import HOST_LIMITS
+from pipeline.ingest.fetcher import Fetcher
+from pipeline.ingest.metrics import RunMetrics, finish_run, start_run
+from pipeline.ingest.registry import find_site, parse_listing, parse_page, response_encoding
+from pipeline.ingest.stages import StageStats
+from pipeline.load.archive import archive_row, body_hash
+from pipeline.load.dead_letter import fetch_failure
+from pipeline.load.partitions import ensure_partitions
+from pipeline.load.seed_products import CATEGORIES
+from pipeline.load.upsert import SnapshotWriter, crawl_state_row
+from pipeline.load.work_queue import worker_id
+
+REQUIRED_FIELDS = ("name", "price", "in_stock")
+
+
+def load_known(session) -> dict[tuple[str, str], tuple]:
+    """Map (site, url) to (product_id, last_price, in_stock) for tracked products."""
+    rows = session.execute(
+        select(
+            Product.site,
+            Product.url,
+            Product.product_id,
+            ProductLatestPrice.last_price,
+            ProductLatestPrice.in_stock_bool,
+        ).outerjoin(ProductLatestPrice, ProductLatestPrice.product_id == Product.product_id)
+    )
+    return {(site, url): (pid, price, stock) for site, url, pid, price, stock in rows}
+
+
+def fetch_text(fetcher, jobs, metrics: RunMetrics, writer: SnapshotWriter, kind: str):
+    """Fetch `(url, url, headers)` jobs, yielding `(url, response)` for good
+    responses; failures are dead-lettered through `writer`."""
+    for url, r in fetcher.fetch_all(jobs, return_errors=True):
+        if isinstance(r, Exception) or r.status_code >= 400:
+            failure = fetch_failure(url, kind, r)
+            if failure.status:
+                metrics.error(failure.error)
+            logger.warning(f"Failed {url}: {failure.error}")
+            writer.fail(failure)
+            continue
+        writer.fetched(url)
+        r.encoding = response_encoding(r.url) or r.encoding
+        yield url, r
+
+
+def listable(urls):
+    """Category urls whose site has a listing parser; others are skipped."""
+    for url in urls:
+        site = find_site(url)
+        if site is None or site.listing_parser is None:
+            logger.warning(f"Skipping category without a listing parser: {url}")
+            continue
+        yield url
+
+
+def crawl_listings(fetcher, urls, metrics: RunMetrics, stats: dict, writer: SnapshotWriter):
+    """Yield `(url, listing, sha256, page)` for each category page, following
+    next links; `page` is the page_archive row (None with archiving off).
+
+    Every round fetches one page of each category still going, so
+    categories are crawled in parallel while each is paged in order. A
+    page that fails is dead-lettered and its category stops there.
+    """
+    frontier, seen = list(urls), set()
+    while frontier:
+        jobs = [(u, u, None) for u in dict.fromkeys(frontier) if u not in seen]
+        seen.update(frontier)
+        frontier = []
+        for url, r in fetch_text(fetcher, jobs, metrics, writer, "listing"):
+            stats["fetch"].items += 1
+            stats["fetch"].bytes += len(r.content)
+            start = time.perf_counter()
+            listing = parse_listing(url, r.text)
+            elapsed = time.perf_counter() - start
+            stats["parse"].busy += elapsed
+            stats["parse"].items += 1
+            if listing["products"]:
+                metrics.observe_parse(listing["products"][0]["site"] + " listing", elapsed)
+            if listing["next_url"]:
+                frontier.append(listing["next_url"])
+            sha256 = body_hash(r.text)
+            yield url, listing, sha256, archive_row(sha256, url, "listing", r.text)
+
+
+def main(categories=CATEGORIES):
+    with db.engine.begin() as conn:
+        ensure_partitions(conn)
+
+    with db.SessionLocal() as session:
+        run = start_run(session, None, mode="discover", worker=worker_id())
+        run_id = run.run_id
+        known = load_known(session)
+        metrics = RunMetrics()
+        stats = {name: StageStats(name) for name in ("fetch", "parse", "write")}
+        started = time.perf_counter()
+        seen, incomplete = set(), []
+        new = unchanged = 0
+        writer = None
+
+        def timed_write(fn, *args, **kwargs):
+            start = time.perf_counter()
+            fn(*args, **kwargs)
+            stats["write"].busy += time.perf_counter() - start
+            stats["write"].items += 1
+
+        try:
+            with Fetcher(host_limits=HOST_LIMITS, metrics=metrics) as fetcher, SnapshotWriter(session) as writer:
+                for url, listing, sha256, page in crawl_listings(fetcher, listable(categories), metrics, stats, writer):
+                    logger.info(f"Listed {len(listing['products'])} products on {url}")
+                    archived = False
+                    for record in listing["products"]:
+                        key = (record["site"], record["url"])
+                        if key in seen:
+                            continue
+                        seen.add(key)
+                        pid, last_price, last_stock = known.get(key, (None, None, None))
+                        new += pid is None
+                        if any(record[f] is None for f in REQUIRED_FIELDS):
+                            incomplete.append(record["url"])
+                            continue
+                        same = last_price is not None and float(last_price) == record["price"]
+                        if pid is not None and same and last_stock == record["in_stock"]:
+                            unchanged += 1
+                            timed_write(writer.touch, crawl_state_row(pid, changed=False))
+                            continue
+                        if page and not archived:
+                            writer.archive(page)
+                            archived = True
+                        # crawl_state.last_hash stays the product page's hash
+                        timed_write(writer.add, record, source_hash=sha256, state=crawl_state_row(pid, True))
+
+                if incomplete:
+                    logger.info(f"Fetching {len(incomplete)} product pages for fields missing from listings")
+                jobs = [(u, u, None) for u in incomplete]
+                for url, r in fetch_text(fetcher, jobs, metrics, writer, "product"):
+                    stats["fetch"].items += 1
+                    stats["fetch"].bytes += len(r.content)
+                    start = time.perf_counter()
+                    result = parse_page(url, r.text)
+                    stats["parse"].busy += time.perf_counter() - start
+                    stats["parse"].items += 1
+                    sha256 = body_hash(r.text)
+                    state = crawl_state_row(
+                        known.get((result["site"], url), (None,))[0], True,
+                        r.headers.get("ETag"), r.headers.get("Last-Modified"), sha256,
+                    )
+                    page = archive_row(sha256, url, "product", r.text)
+                    if page:
+                        writer.archive(page)
+                    timed_write(writer.add, result, source_hash=sha256, state=state)
+        except BaseException as e:
+            metrics.failure = f"{type(e).__name__}: {e}"
+            metrics.wall = time.perf_counter() - started
+            finish_run(session, run_id, metrics, "failed", writer.written if writer else 0, unchanged)
+            raise
+
+        wall = time.perf_counter() - started
+        metrics.finish(stats, wall)
+        finish_run(session, run_id, metrics, "ok", writer.written, unchanged)
+        requests_made = stats["fetch"].items
+        logger.info(
+            f"Discovered {len(seen)} products ({new} new) from {requests_made} requests "
+            f"({requests_made / max(len(seen), 1):.2f} per product): "
+            f"{writer.written} snapshots, {unchanged} unchanged in {wall:.2f}s"
+        )
+        if writer.failed:
+            logger.warning(f"{writer.failed} fetches failed, {writer.dead_letters} urls in the dead-letter queue")
+        if metrics.errors:
+            logger.warning(f"Errors: {dict(metrics.errors)}")
+        return run_id
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:] or CATEGORIES)
@@ -1,67 +1,290 @@
 """Fetch a product page, parse fields, and write a price snapshot."""
 
 from loguru import logger
-import requests
-import hashlib
+import argparse
+import time
 
-from pipeline.ingest.parsers.books_to_scrape import parse_product_page
-from pipeline.load.upsert import get_or_create_product, write_price_snapshot
-from pipeline.common.db import SessionLocal
+from pipeline.load.upsert import SnapshotWriter, crawl_state_row
+from pipeline.load.archive import archive_row, body_hash, same_body
+from pipeline.load.dead_letter import FetchFailure, fetch_failure
+from pipeline.common import db
+from pipeline.load.partitions import ensure_partitions
+from pipeline.ingest.fetcher import Fetcher
+from pipeline.ingest.metrics import RunMetrics, start_run, finish_run, resume_point, mark_resumed
+from pipeline.load.work_queue import LEASE_BATCH, claim_products, ensure_crawl_state_rows, release_products, worker_id
+from pipeline.load.schedule import is_due, site_rank, site_budget
+from pipeline.ingest.registry import get_parser, host_limits, parse_page, response_encoding, site_budgets
+from pipeline.ingest.stages import PARSE_WORKERS, ParseFailed, ParseTask, Parsed, run_pipeline
 
-from pipeline.ingest.parsers import books_to_scrape, webscraper_io
+from sqlalchemy import select, or_
+from pipeline.common.models import Product, CrawlState
 
-from sqlalchemy import select
-from pipeline.common.models import Product
 
-
-PARSERS = {
-    "books.toscrape.com": books_to_scrape.parse_product_page,
-    "webscraper.io": webscraper_io.parse_product_page,
-}
+# Per-host fetcher overrides and per-site budgets of due products per run
+# (others default to CRAWL_SITE_BUDGET), as declared by each parser module.
+HOST_LIMITS = host_limits()
+SITE_BUDGETS = site_budgets()
 
 def load_urls_from_db(session):
     rows = session.execute(select(Product.site, Product.url)).all()
     return [(r[0], r[1]) for r in rows]
 
-def get_parser(url: str):
-    for host, fn in PARSERS.items():
-        if host in url:
-            return fn
-    raise ValueError(f"No parser registered for: {url}")
-
-def main():
-    with SessionLocal() as session:
-        targets = load_urls_from_db(session)
-        for site, url in targets:
-            try:
-                parse_product_page = get_parser(url)
-            except ValueError:
-                logger.warning(f"Skipping unsupported host for url={url}")
-                continue
-
-            r = requests.get(url, timeout=20, headers={"User-Agent": "its-on-sale-tracker/0.1"})
-            r.encoding = "utf-8"
-            r.raise_for_status()
-            logger.info(f"Fetched {url} with status {r.status_code}")
-
-            parsed = parse_product_page(r.text, url)
-            body_hash = hashlib.sha256(r.text.encode("utf-8")).hexdigest()[:16]
-
-            pid = get_or_create_product(session, site=parsed["site"], url=url, name=parsed["name"])
-            write_price_snapshot(
-                session,
-                product_id=pid,
-                price=parsed["price"],
-                currency=parsed["currency"],
-                in_stock=parsed["in_stock"],
-                on_sale=parsed["on_sale"],
-                source_hash=body_hash,
-            )
+def parse_shard(spec: str) -> tuple[int, int]:
+    """Parse `i/n` (0-based shard i of n)."""
+    i, n = (int(x) for x in spec.split("/"))
+    if not 0 <= i < n:
+        raise ValueError(f"Bad shard {spec!r}: need 0 <= i < n")
+    return i, n
+
+def load_targets(
+    session,
+    shard: tuple[int, int] | None = None,
+    checked_before=None,
+    product_ids=None,
+    due: bool = False,
+    budgets: dict[str, int] | None = None,
+):
+    """Return products joined with their last ETag, Last-Modified and body hash.
+
+    `shard=(i, n)` keeps products whose id is i mod n; `checked_before`
+    skips products already checked since then (used to resume a run).
+    With `due`, only products whose next_due_utc has passed are returned,
+    at most `budgets[site]` per site, most overdue first.
+    """
+    stmt = select(
+        Product.product_id,
+        Product.url,
+        CrawlState.etag,
+        CrawlState.last_modified,
+        CrawlState.last_hash,
+    ).outerjoin(CrawlState, CrawlState.product_id == Product.product_id)
+    if shard:
+        i, n = shard
+        stmt = stmt.where(Product.product_id % n == i)
+    if checked_before is not None:
+        stmt = stmt.where(
+            or_(CrawlState.last_checked_utc.is_(None), CrawlState.last_checked_utc < checked_before)
+        )
+    if product_ids is not None:
+        stmt = stmt.where(Product.product_id.in_(product_ids))
+    if due:
+        ranked = stmt.where(is_due()).add_columns(Product.site, site_rank().label("site_rank")).subquery()
+        stmt = select(
+            ranked.c.product_id, ranked.c.url, ranked.c.etag, ranked.c.last_modified, ranked.c.last_hash
+        ).where(ranked.c.site_rank <= site_budget(ranked.c.site, budgets or {}))
+        return session.execute(stmt.order_by(ranked.c.product_id)).all()
+    return session.execute(stmt.order_by(Product.product_id)).all()
+
+def leased_targets(owner: str, checked_before, batch: int = LEASE_BATCH, due: bool = True):
+    """Yield targets leased a batch at a time until no unleased work is left.
+
+    Leases on unsupported urls are released straight away. Runs on the
+    fetch thread, so it uses its own sessions.
+    """
+    while True:
+        with db.SessionLocal() as session:
+            ids = claim_products(session.connection(), owner, checked_before, batch, due=due)
+            session.commit()
+            if not ids:
+                return
+            targets = load_targets(session, product_ids=ids)
+            skipped = [t.product_id for t in targets if not supported(t.url)]
+            if skipped:
+                release_products(session.connection(), owner, skipped)
+                session.commit()
+        logger.info(f"Leased {len(ids)} products")
+        yield from (t for t in targets if t.product_id not in skipped)
+
+def supported(url: str) -> bool:
+    try:
+        get_parser(url)
+    except ValueError:
+        logger.warning(f"Skipping unsupported host for url={url}")
+        return False
+    return True
+
+def build_jobs(targets, force: bool):
+    for t in targets:
+        if supported(t.url):
+            yield t, t.url, None if force else conditional_headers(t)
+
+def conditional_headers(target) -> dict:
+    headers = {}
+    if target.etag:
+        headers["If-None-Match"] = target.etag
+    if target.last_modified:
+        headers["If-Modified-Since"] = target.last_modified
+    return headers
+
+def fetch_stage(fetcher, jobs, force: bool, metrics: RunMetrics | None = None):
+    """Fetch jobs, yielding crawl-state heartbeats for unchanged pages,
+    `FetchFailure`s for failed fetches and `ParseTask`s for everything
+    else, with `(state, page_archive row)` as their context."""
+    for t, r in fetcher.fetch_all(jobs, return_errors=True):
+        url = t.url
+        if isinstance(r, Exception):
+            logger.warning(f"Failed {url}: {type(r).__name__}: {r}")
+            yield fetch_failure(url, "product", r, t.product_id)
+            continue
+        if r.status_code == 304:
+            logger.info(f"Not modified {url}")
+            yield crawl_state_row(t.product_id, changed=False)
+            continue
+
+        if r.status_code >= 400:
+            logger.warning(f"Failed {url} with status {r.status_code}")
+            if metrics:
+                metrics.error(f"HTTP {r.status_code}")
+            yield fetch_failure(url, "product", r, t.product_id)
+            continue
+        r.encoding = response_encoding(url) or r.encoding
+        logger.info(f"Fetched {url} with status {r.status_code}")
+
+        sha256 = body_hash(r.text)
+        etag = r.headers.get("ETag")
+        last_modified = r.headers.get("Last-Modified")
+        if not force and same_body(sha256, t.last_hash):
+            yield crawl_state_row(t.product_id, False, etag, last_modified, sha256)
+            continue
 
-        session.commit()
-        logger.info(f"Wrote snapshots for {len(targets)} products")
+        state = crawl_state_row(t.product_id, True, etag, last_modified, sha256)
+        page = archive_row(sha256, url, "product", r.text)
+        yield ParseTask(url, r.text, context=(state, page), size=len(r.content))
 
+def main(
+    force: bool = False,
+    parse_workers: int = PARSE_WORKERS,
+    shard: tuple[int, int] | None = None,
+    lease: bool = False,
+    resume: bool = True,
+    due: bool = True,
+):
+    """Snapshot due products; with `force`, ignore ETags and body hashes.
+
+    Fetching, parsing (in `parse_workers` processes, 0 for inline) and
+    writing run as separate pipelined stages. Each run is recorded in
+    `ingest_run` with its metrics (see `pipeline.ingest.metrics`).
+
+    Work can be split across workers either by `shard=(i, n)` or by
+    `lease`, where workers pull batches from crawl_state until none are
+    left. Snapshots are committed in small batches as they complete, and
+    with `resume` a run picks up the round of an unfinished run of the
+    same mode, skipping products that run already checked.
+
+    With `due` (the default) only products the adaptive schedule marks
+    as due are fetched, within per-site `SITE_BUDGETS`; pass `due=False`
+    to fetch everything (see `pipeline.load.schedule`). Lease mode
+    honours the schedule but not the budgets.
+
+    A url that fails after the fetcher's retries, or whose page the
+    parser can't handle, is dead-lettered (see
+    `pipeline.load.dead_letter`) rather than failing the run; its
+    product stays due, so the next run tries it again. In lease mode its
+    lease, and that of any unsupported url, is released at once.
+    """
+    mode = "lease" if lease else f"shard {shard[0]}/{shard[1]}" if shard else "all"
+    owner = worker_id()
+    with db.engine.begin() as conn:
+        ensure_partitions(conn)
+        if lease:
+            ensure_crawl_state_rows(conn)
+
+    with db.SessionLocal() as session:
+        run = start_run(session, None, mode=mode, worker=owner)
+        run_id = run.run_id
+        since = resume_point(session, run) if resume else run.started_utc
+        if since != run.started_utc:
+            logger.info(f"Resuming {mode} round started at {since}")
+
+        if lease:
+            jobs = build_jobs(leased_targets(owner, since, due=due), force)
+        else:
+            checked_before = since if since != run.started_utc else None
+            targets = load_targets(session, shard, checked_before, due=due, budgets=SITE_BUDGETS)
+            jobs = list(build_jobs(targets, force))
+            run.targets = len(jobs)
+            session.commit()
+
+        metrics = RunMetrics()
+        started = time.perf_counter()
+        writer = None
+        try:
+            with (
+                Fetcher(host_limits=HOST_LIMITS, metrics=metrics) as fetcher,
+                SnapshotWriter(session, lease_owner=owner if lease else None) as writer,
+            ):
+                if writer.dead_letters:
+                    logger.info(f"{writer.dead_letters} urls in the dead-letter queue from earlier runs")
+
+                def write(item):
+                    if isinstance(item, Parsed):
+                        metrics.observe_parse(item.result["site"], item.seconds)
+                        state, page = item.context
+                        if page:
+                            writer.archive(page)
+                        writer.add(item.result, source_hash=state["last_hash"], state=state)
+                    elif isinstance(item, FetchFailure):
+                        writer.fail(item)
+                    elif isinstance(item, ParseFailed):
+                        logger.warning(f"Failed to parse {item.url}: {item.error}")
+                        metrics.error("ParseError")
+                        state, _ = item.context
+                        writer.fail(FetchFailure(item.url, "product", item.error, None, state["product_id"]))
+                    else:
+                        writer.touch(item)
+
+                stats, wall = run_pipeline(
+                    fetch_stage(fetcher, jobs, force, metrics), parse_page, write, parse_workers
+                )
+        except BaseException as e:
+            metrics.failure = f"{type(e).__name__}: {e}"
+            metrics.wall = time.perf_counter() - started
+            finish_run(
+                session, run_id, metrics, "failed", writer.written if writer else 0, writer.touched if writer else 0
+            )
+            raise
+
+        metrics.finish(stats, wall)
+        # pages fetched but neither parsed nor dead-lettered
+        unchanged = writer.touched
+        finish_run(session, run_id, metrics, "ok", writer.written, unchanged)
+        mark_resumed(session, run, since)
+        logger.info(f"Wrote snapshots for {writer.written} products, {unchanged} unchanged in {wall:.2f}s")
+        if writer.failed:
+            logger.warning(f"{writer.failed} fetches failed, {writer.dead_letters} urls in the dead-letter queue")
+        for s in stats.values():
+            logger.info(s.summary(wall))
+        for host, h in metrics.host_summary().items():
+            logger.info(
+                f"{host}: {h['requests']} requests, p50 {h['p50'] * 1000:.0f}ms, "
+                f"p90 {h['p90'] * 1000:.0f}ms, p99 {h['p99'] * 1000:.0f}ms, "
+                f"queued {h['wait_seconds']:.2f}s"
+            )
+        a = metrics.acquire_summary()
+        logger.info(
+            f"db: {a['acquired']} connection checkouts, p50 {a['p50'] * 1000:.1f}ms, "
+            f"p99 {a['p99'] * 1000:.1f}ms, max {a['max'] * 1000:.1f}ms"
+        )
+        if metrics.errors:
+            logger.warning(f"Errors: {dict(metrics.errors)}")
+        return run_id
 
 
 if __name__ == "__main__":
-    main()
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--force", action="store_true", help="ignore ETags and body hashes")
+    ap.add_argument("--workers", type=int, default=PARSE_WORKERS, help="parse processes (0 = inline)")
+    split = ap.add_mutually_exclusive_group()
+    split.add_argument("--shard", type=parse_shard, metavar="I/N", help="only products with id %% N == I")
+    split.add_argument("--lease", action="store_true", help="pull work from crawl_state with SKIP LOCKED")
+    ap.add_argument("--no-resume", dest="resume", action="store_false", help="start a new round")
+    ap.add_argument("--all", dest="due", action="store_false", help="ignore the crawl schedule")
+    args = ap.parse_args()
+    main(
+        force=args.force,
+        parse_workers=args.workers,
+        shard=args.shard,
+        lease=args.lease,
+        resume=args.resume,
+        due=args.due,
+    )
@@ -0,0 +1,305 @@
+"""Fetch pages concurrently with a global limit and per-host limits.
+
+Each host gets its own keep-alive session. Connection errors, timeouts,
+429 and 5xx responses are retried with jittered exponential backoff
+(`FETCH_RETRIES`, `FETCH_BACKOFF_SECONDS`), honouring Retry-After up to
+`FETCH_BACKOFF_MAX_SECONDS`. After `FETCH_BREAKER_FAILURES` consecutive
+failed requests a host's circuit breaker opens: its queued and new
+requests fail at once with `HostUnavailable` for
+`FETCH_BREAKER_COOLDOWN_SECONDS`, then a single probe request decides
+whether it closes again.
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from urllib.parse import urlparse
+
+import requests
+from loguru import logger
+from requests.adapters import HTTPAdapter
+from urllib3.util.request import ACCEPT_ENCODING
+from urllib3.util.retry import Retry
+
+USER_AGENT = "its-on-sale-tracker/0.1"
+TIMEOUT = 20
+
+MAX_CONCURRENCY = int(os.getenv("FETCH_CONCURRENCY", "16"))
+PER_HOST_CONCURRENCY = int(os.getenv("FETCH_PER_HOST", "4"))
+POLITENESS_DELAY = float(os.getenv("FETCH_DELAY_SECONDS", "0.25"))
+RETRIES = int(os.getenv("FETCH_RETRIES", "3"))
+BACKOFF = float(os.getenv("FETCH_BACKOFF_SECONDS", "0.5"))
+BACKOFF_MAX = float(os.getenv("FETCH_BACKOFF_MAX_SECONDS", "30"))
+BREAKER_FAILURES = int(os.getenv("FETCH_BREAKER_FAILURES", "5"))
+BREAKER_COOLDOWN = float(os.getenv("FETCH_BREAKER_COOLDOWN_SECONDS", "60"))
+
+# Statuses worth retrying, and that count against a host's circuit breaker.
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class HostUnavailable(requests.ConnectionError):
+    """A request not sent because its host's circuit breaker is open."""
+
+
+class _Retry(Retry):
+    # A long Retry-After would park a fetch thread (and a host slot) for its duration.
+    def get_retry_after(self, response):
+        seconds = super().get_retry_after(response)
+        return None if seconds is None else min(seconds, BACKOFF_MAX)
+
+
+def host_key(url: str, hosts) -> str:
+    """Return the configured host a url belongs to (the hostname or its
+    nearest parent domain in `hosts`), or its bare hostname."""
+    hostname = (urlparse(url).hostname or "").lower()
+    host = hostname
+    while host:
+        if host in hosts:
+            return host
+        host = host.partition(".")[2]
+    return hostname
+
+
+class CircuitBreaker:
+    """Opens after `threshold` consecutive failures (0 never opens).
+
+    While open, `allow` refuses requests; once `cooldown` seconds have
+    passed it lets one probe through, and the probe's outcome closes
+    the breaker or opens it for another cooldown.
+    """
+
+    def __init__(self, threshold: int = BREAKER_FAILURES, cooldown: float = BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: float | None = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self._probing or time.monotonic() - self.opened_at < self.cooldown:
+                return False
+            self._probing = True
+            return True
+
+    def cancel(self):
+        """Give back a probe that ended without an outcome, so another can go."""
+        with self._lock:
+            self._probing = False
+
+    def record(self, ok: bool) -> bool:
+        """Record a request's outcome; True if this opened the breaker."""
+        with self._lock:
+            self._probing = False
+            if ok:
+                self.failures, self.opened_at = 0, None
+                return False
+            self.failures += 1
+            if not self.threshold or self.failures < self.threshold:
+                return False
+            was_closed = self.opened_at is None
+            self.opened_at = time.monotonic()
+            return was_closed
+
+
+class HostSlot:
+    """Concurrency limit, politeness delay, circuit breaker and keep-alive
+    connection pool for one host."""
+
+    def __init__(self, concurrency: int, delay: float, retries: int = RETRIES, backoff: float = BACKOFF):
+        self.concurrency = concurrency
+        self.semaphore = threading.BoundedSemaphore(concurrency)
+        self.delay = delay
+        self.breaker = CircuitBreaker()
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = USER_AGENT
+        # every encoding urllib3 can decode here (zstd and br when their packages are installed)
+        self.session.headers["Accept-Encoding"] = ACCEPT_ENCODING
+        retry = _Retry(
+            total=retries,
+            backoff_factor=backoff,
+            backoff_max=BACKOFF_MAX,
+            backoff_jitter=backoff,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=frozenset({"GET"}),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._lock = threading.Lock()
+        self._next_start = 0.0
+
+    def wait_turn(self):
+        """Space request starts at least `delay` seconds apart."""
+        if self.delay <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_start)
+            self._next_start = start + self.delay
+        if start > now:
+            time.sleep(start - now)
+
+
+class Fetcher:
+    """Thread-pool fetcher bounded globally and per host.
+
+    `host_limits` maps a host (e.g. a registered site) to optional
+    `concurrency` and `delay` overrides; unknown hosts get the defaults.
+    When `metrics` (a `RunMetrics`) is given, every request's latency,
+    queueing time, size and status or exception type is recorded.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = MAX_CONCURRENCY,
+        per_host: int = PER_HOST_CONCURRENCY,
+        delay: float = POLITENESS_DELAY,
+        host_limits: dict[str, dict] | None = None,
+        timeout: float = TIMEOUT,
+        metrics=None,
+    ):
+        self.max_concurrency = max_concurrency
+        self.per_host = per_host
+        self.delay = delay
+        self.host_limits = host_limits or {}
+        self.timeout = timeout
+        self.metrics = metrics
+        self._slots: dict[str, HostSlot] = {}
+        self._slots_lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="fetch")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._pool.shutdown(wait=True, cancel_futures=True)
+        for slot in self._slots.values():
+            slot.session.close()
+
+    def _slot(self, url: str) -> tuple[str, HostSlot]:
+        key = host_key(url, self.host_limits)
+        with self._slots_lock:
+            slot = self._slots.get(key)
+            if slot is None:
+                limits = self.host_limits.get(key, {})
+                slot = HostSlot(
+                    concurrency=limits.get("concurrency", self.per_host),
+                    delay=limits.get("delay", self.delay),
+                )
+                self._slots[key] = slot
+            return key, slot
+
+    def _record(self, host: str, slot: HostSlot, ok: bool):
+        if slot.breaker.record(ok):
+            logger.warning(
+                f"{host}: circuit breaker open after {slot.breaker.failures} failed requests, "
+                f"pausing it for {slot.breaker.cooldown:g}s"
+            )
+            if self.metrics:
+                self.metrics.error("circuit opened")
+
+    def fetch(self, url: str, headers: dict | None = None) -> requests.Response:
+        """GET `url` (with retries); raises `requests.RequestException` on failure,
+        including `HostUnavailable` while its host's breaker is open."""
+        host, slot = self._slot(url)
+        queued = time.perf_counter()
+        with slot.semaphore:
+            # checked after queueing too, so a host's backlog fails fast once it trips
+            if not slot.breaker.allow():
+                if self.metrics:
+                    self.metrics.error("HostUnavailable")
+                raise HostUnavailable(f"{host}: circuit breaker open")
+            try:
+                slot.wait_turn()
+                start = time.perf_counter()
+                r = slot.session.get(url, timeout=self.timeout, headers=headers)
+            except BaseException as e:
+                if isinstance(e, requests.RequestException):
+                    self._record(host, slot, ok=False)
+                else:
+                    # not the host's fault, but a probe must not stay in flight forever
+                    slot.breaker.cancel()
+                if self.metrics:
+                    self.metrics.error(type(e).__name__)
+                raise
+            self._record(host, slot, ok=r.status_code not in RETRY_STATUSES)
+        if self.metrics:
+            retries = len(r.raw.retries.history) if r.raw.retries is not None else 0
+            self.metrics.observe_fetch(
+                host, time.perf_counter() - start, start - queued, len(r.content), r.status_code, retries
+            )
+        return r
+
+    def fetch_all(self, jobs, return_errors: bool = False):
+        """Fetch `(tag, url, headers)` jobs, yielding `(tag, response)` as they complete.
+
+        With `return_errors`, a `requests.RequestException` (after retries,
+        or from an open breaker) is yielded in place of the response
+        instead of being raised, so one failed url doesn't end the run.
+
+        Jobs wait in per-host queues and reach the pool only while their
+        host has a free slot, so a host that is backing off or honouring
+        Retry-After holds its own slots but never a worker another host
+        could use. Jobs are read ahead only while a worker is idle, at most
+        `backlog` of them queued, and at most the global limit is in
+        flight, so a slow consumer holds back new requests instead of
+        buffering every response.
+        """
+        jobs = iter(jobs)
+        backlog = self.max_concurrency * 8
+        queues: dict[str, deque] = {}
+        busy: dict[str, int] = {}
+        pending = {}
+        queued = 0
+        exhausted = False
+
+        def dispatch():
+            nonlocal queued, exhausted
+            while len(pending) < self.max_concurrency:
+                for host, queue in queues.items():
+                    if queue and busy[host] < self._slots[host].concurrency:
+                        break
+                else:
+                    # every queued job's host is at its limit: read further ahead
+                    if exhausted or queued >= backlog:
+                        return
+                    job = next(jobs, None)
+                    if job is None:
+                        exhausted = True
+                        return
+                    host, _ = self._slot(job[1])
+                    queues.setdefault(host, deque()).append(job)
+                    busy.setdefault(host, 0)
+                    queued += 1
+                    continue
+                tag, url, headers = queue.popleft()
+                queued -= 1
+                busy[host] += 1
+                pending[self._pool.submit(self.fetch, url, headers)] = host, tag
+
+        dispatch()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            finished = []
+            for fut in done:
+                host, tag = pending.pop(fut)
+                busy[host] -= 1
+                finished.append((tag, fut))
+            dispatch()
+            for tag, fut in finished:
+                error = fut.exception()
+                if return_errors and isinstance(error, requests.RequestException):
+                    yield tag, error
+                else:
+                    yield tag, fut.result()
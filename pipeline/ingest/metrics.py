@@ -0,0 +1,261 @@
+"""Per-run ingest metrics: fetch latency per host, parse time per parser,
+database connection checkout time, errors.
+
+`RunMetrics` is filled in by the fetcher threads and the writer, then
+saved to the `ingest_run` table and, when INGEST_METRICS_TEXTFILE is
+set, written as a Prometheus textfile (for node_exporter's textfile
+collector).
+"""
+
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+from dataclasses import asdict
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import update, select, func
+
+from pipeline.common import db
+from pipeline.common.models import IngestRun
+
+METRICS_TEXTFILE = os.getenv("INGEST_METRICS_TEXTFILE")
+# Unfinished runs younger than this are resumed rather than started over.
+RESUME_HOURS = float(os.getenv("INGEST_RESUME_HOURS", "12"))
+
+# Prometheus histogram buckets for fetch latency, in seconds.
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0)
+
+
+def percentile(sorted_values: list[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, round(pct / 100 * len(sorted_values) + 0.5))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class RunMetrics:
+    """Thread-safe counters for one ingest run."""
+
+    def __init__(self):
+        self.started = datetime.now(timezone.utc)
+        self._lock = threading.Lock()
+        self.fetch_latency: dict[str, list[float]] = defaultdict(list)
+        self.fetch_wait: dict[str, float] = defaultdict(float)
+        self.fetch_bytes: dict[str, int] = defaultdict(int)
+        self.statuses: dict[str, Counter] = defaultdict(Counter)
+        self.fetch_retries: Counter = Counter()
+        self.parse_seconds: dict[str, float] = defaultdict(float)
+        self.parse_pages: Counter = Counter()
+        self.errors: Counter = Counter()
+        self.stages: dict = {}
+        self.wall = 0.0
+        self.failure: str | None = None
+        self._acquire_mark = db.acquire_times.mark()
+
+    def observe_fetch(self, host: str, seconds: float, wait: float, nbytes: int, status: int, retries: int = 0):
+        """Record one response; `wait` is time queued behind host limits and delays,
+        `seconds` includes the `retries` it took."""
+        with self._lock:
+            self.fetch_latency[host].append(seconds)
+            self.fetch_wait[host] += wait
+            self.fetch_bytes[host] += nbytes
+            self.statuses[host][status] += 1
+            self.fetch_retries[host] += retries
+
+    def observe_parse(self, parser: str, seconds: float):
+        self.parse_seconds[parser] += seconds
+        self.parse_pages[parser] += 1
+
+    def error(self, kind: str):
+        with self._lock:
+            self.errors[kind] += 1
+
+    def finish(self, stats: dict, wall: float):
+        """Attach the pipeline's per-stage stats (see `stages.run_pipeline`)."""
+        self.stages = {name: asdict(s) for name, s in stats.items()}
+        self.wall = wall
+
+    @property
+    def bytes_downloaded(self) -> int:
+        return sum(self.fetch_bytes.values())
+
+    def host_summary(self) -> dict:
+        out = {}
+        with self._lock:
+            for host, values in self.fetch_latency.items():
+                values = sorted(values)
+                out[host] = {
+                    "requests": len(values),
+                    "bytes": self.fetch_bytes[host],
+                    "p50": round(percentile(values, 50), 4),
+                    "p90": round(percentile(values, 90), 4),
+                    "p99": round(percentile(values, 99), 4),
+                    "max": round(values[-1], 4),
+                    "wait_seconds": round(self.fetch_wait[host], 3),
+                    "retries": self.fetch_retries[host],
+                    "status": {str(k): v for k, v in self.statuses[host].items()},
+                }
+        return out
+
+    def acquire_summary(self) -> dict:
+        """Pool checkout latency during this run; high values mean pool contention."""
+        values = sorted(db.acquire_times.since(self._acquire_mark))
+        return {
+            "acquired": len(values),
+            "seconds": round(sum(values), 4),
+            "p50": round(percentile(values, 50), 4),
+            "p99": round(percentile(values, 99), 4),
+            "max": round(values[-1], 4) if values else 0.0,
+        }
+
+    def as_dict(self) -> dict:
+        return {
+            "hosts": self.host_summary(),
+            "db_acquire": self.acquire_summary(),
+            "parsers": {
+                name: {"pages": self.parse_pages[name], "seconds": round(secs, 4)}
+                for name, secs in self.parse_seconds.items()
+            },
+            "errors": dict(self.errors),
+            "stages": self.stages,
+            "failure": self.failure,
+        }
+
+    def prometheus_text(self) -> str:
+        lines = [
+            "# HELP its_ingest_fetch_seconds Fetch latency per host in the last run.",
+            "# TYPE its_ingest_fetch_seconds histogram",
+        ]
+        with self._lock:
+            for host, values in sorted(self.fetch_latency.items()):
+                for le in LATENCY_BUCKETS:
+                    count = sum(1 for v in values if v <= le)
+                    lines.append(f'its_ingest_fetch_seconds_bucket{{host="{host}",le="{le}"}} {count}')
+                lines.append(f'its_ingest_fetch_seconds_bucket{{host="{host}",le="+Inf"}} {len(values)}')
+                lines.append(f'its_ingest_fetch_seconds_sum{{host="{host}"}} {sum(values):.6f}')
+                lines.append(f'its_ingest_fetch_seconds_count{{host="{host}"}} {len(values)}')
+            lines.append("# TYPE its_ingest_fetch_bytes gauge")
+            for host, nbytes in sorted(self.fetch_bytes.items()):
+                lines.append(f'its_ingest_fetch_bytes{{host="{host}"}} {nbytes}')
+            lines.append("# TYPE its_ingest_fetch_wait_seconds gauge")
+            for host, wait in sorted(self.fetch_wait.items()):
+                lines.append(f'its_ingest_fetch_wait_seconds{{host="{host}"}} {wait:.6f}')
+            lines.append("# TYPE its_ingest_fetch_retries gauge")
+            for host, retries in sorted(self.fetch_retries.items()):
+                lines.append(f'its_ingest_fetch_retries{{host="{host}"}} {retries}')
+            lines.append("# TYPE its_ingest_errors gauge")
+            for kind, count in sorted(self.errors.items()):
+                lines.append(f'its_ingest_errors{{type="{kind}"}} {count}')
+        lines.append("# TYPE its_ingest_parse_seconds gauge")
+        for name, secs in sorted(self.parse_seconds.items()):
+            lines.append(f'its_ingest_parse_seconds{{parser="{name}"}} {secs:.6f}')
+        acquire = self.acquire_summary()
+        lines += [
+            "# TYPE its_ingest_db_acquire_seconds gauge",
+            f"its_ingest_db_acquire_seconds {acquire['seconds']:.6f}",
+            "# TYPE its_ingest_db_acquire_max_seconds gauge",
+            f"its_ingest_db_acquire_max_seconds {acquire['max']:.6f}",
+            "# TYPE its_ingest_db_acquires gauge",
+            f"its_ingest_db_acquires {acquire['acquired']}",
+        ]
+        lines.append("# TYPE its_ingest_stage_busy_seconds gauge")
+        for name, s in self.stages.items():
+            lines.append(f'its_ingest_stage_busy_seconds{{stage="{name}"}} {s["busy"]:.6f}')
+        lines += [
+            "# TYPE its_ingest_run_seconds gauge",
+            f"its_ingest_run_seconds {self.wall:.6f}",
+            "# TYPE its_ingest_last_run_timestamp_seconds gauge",
+            f"its_ingest_last_run_timestamp_seconds {time.time():.0f}",
+        ]
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path: str):
+        """Write atomically so the collector never reads a half-written file."""
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp, path)
+
+
+def start_run(session, targets: int | None, mode: str = "all", worker: str | None = None) -> IngestRun:
+    """Insert a `running` ingest_run row (timestamped by the database clock)."""
+    run = IngestRun(started_utc=func.now(), status="running", mode=mode, worker=worker, targets=targets)
+    session.add(run)
+    session.commit()
+    return run
+
+
+def resume_point(session, run: IngestRun, hours: float = RESUME_HOURS):
+    """Start of the crawl round `run` belongs to.
+
+    That is the earliest other run of the same mode that is still running
+    or failed within the last `hours`; products checked since then are
+    done. With none, the round starts with `run` itself.
+    """
+    earlier = session.execute(
+        select(func.min(IngestRun.started_utc)).where(
+            IngestRun.mode == run.mode,
+            IngestRun.run_id != run.run_id,
+            IngestRun.status.in_(("running", "failed")),
+            IngestRun.started_utc > func.now() - timedelta(hours=hours),
+        )
+    ).scalar()
+    return earlier or run.started_utc
+
+
+def mark_resumed(session, run: IngestRun, since):
+    """Close out the round `run` just completed.
+
+    Failed and crashed (still `running`) runs of the round are marked
+    `resumed`; a lease worker that is in fact still busy overwrites this
+    with its own status when it finishes.
+    """
+    session.execute(
+        update(IngestRun)
+        .where(
+            IngestRun.mode == run.mode,
+            IngestRun.run_id != run.run_id,
+            IngestRun.status.in_(("running", "failed")),
+            IngestRun.started_utc >= since,
+        )
+        .values(status="resumed")
+    )
+    session.commit()
+
+
+def finish_run(
+    session, run_id: int, metrics: RunMetrics, status: str, written: int = 0, unchanged: int | None = None
+):
+    """Record the outcome of a run; also writes the Prometheus textfile if configured.
+
+    `unchanged` defaults to pages fetched but not parsed.
+    """
+    stages = metrics.stages
+    fetched = stages.get("fetch", {}).get("items", 0)
+    parsed = stages.get("parse", {}).get("items", 0)
+    if unchanged is None:
+        unchanged = fetched - parsed
+    session.rollback()
+    session.execute(
+        update(IngestRun)
+        .where(IngestRun.run_id == run_id)
+        .values(
+            finished_utc=datetime.now(timezone.utc),
+            status=status,
+            fetched=fetched,
+            written=written,
+            unchanged=unchanged,
+            errors=sum(metrics.errors.values()),
+            bytes_downloaded=metrics.bytes_downloaded,
+            fetch_seconds=stages.get("fetch", {}).get("busy"),
+            parse_seconds=stages.get("parse", {}).get("busy"),
+            write_seconds=stages.get("write", {}).get("busy"),
+            wall_seconds=metrics.wall,
+            metrics=metrics.as_dict(),
+        )
+    )
+    session.commit()
+    if METRICS_TEXTFILE:
+        metrics.write_textfile(METRICS_TEXTFILE)
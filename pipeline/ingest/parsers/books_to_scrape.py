@@ -1,16 +1,27 @@
-"""Parse a Books to Scrape product page into structured fields."""
+"""Parse Books to Scrape product and category listing pages into structured fields."""
 
-from bs4 import BeautifulSoup
+from urllib.parse import urljoin
 
-def parse_product_page(html: str, url: str) -> dict:
-    soup = BeautifulSoup(html, "lxml")
+from lxml import etree
 
-    name_el = soup.select_one(".product_main h1")
-    price_el = soup.select_one(".product_main .price_color")
-    stock_el = soup.select_one(".product_main .availability")
+from pipeline.ingest.parsers.lxml_helpers import document, first, has_class, text_of
+from pipeline.ingest.registry import register_site
 
-    name = name_el.get_text(strip=True) if name_el else None
-    raw_price = price_el.get_text(strip=True) if price_el else None
+SITE = register_site("books.toscrape.com", concurrency=4, delay=0.25, budget=1000)
+
+_MAIN = f"//*[{has_class('product_main')}]"
+NAME_XPATH = etree.XPath(f"{_MAIN}//h1")
+PRICE_XPATH = etree.XPath(f"{_MAIN}//*[{has_class('price_color')}]")
+STOCK_XPATH = etree.XPath(f"{_MAIN}//*[{has_class('availability')}]")
+
+# Listing pages: one article.product_pod per book, 20 to a page.
+POD_XPATH = etree.XPath(f"//article[{has_class('product_pod')}]")
+POD_LINK_XPATH = etree.XPath(".//h3/a")
+POD_PRICE_XPATH = etree.XPath(f".//*[{has_class('price_color')}]")
+POD_STOCK_XPATH = etree.XPath(f".//*[{has_class('availability')}]")
+NEXT_XPATH = etree.XPath(f"//li[{has_class('next')}]/a/@href")
+
+def to_record(url: str, name: str | None, raw_price: str | None, stock_text: str | None) -> dict:
     currency = "GBP"
     price = None
     if raw_price:
@@ -21,9 +32,8 @@ def parse_product_page(html: str, url: str) -> dict:
             price = None
 
     in_stock = None
-    if stock_el:
-        txt = stock_el.get_text(strip=True).lower()
-        in_stock = "in stock" in txt
+    if stock_text is not None:
+        in_stock = "in stock" in stock_text.lower()
 
     return {
         "site": "books.toscrape.com",
@@ -33,4 +43,53 @@ def parse_product_page(html: str, url: str) -> dict:
         "currency": currency,
         "in_stock": in_stock,
         "on_sale": False,
-    }
\ No newline at end of file
+    }
+
+@SITE.product("bs4")
+def parse_product_page(html: str, url: str) -> dict:
+    from bs4 import BeautifulSoup  # bs4 backend only; keeps it off the default import path
+
+    soup = BeautifulSoup(html, "lxml")
+
+    name_el = soup.select_one(".product_main h1")
+    price_el = soup.select_one(".product_main .price_color")
+    stock_el = soup.select_one(".product_main .availability")
+
+    return to_record(
+        url,
+        name_el.get_text(strip=True) if name_el else None,
+        price_el.get_text(strip=True) if price_el else None,
+        stock_el.get_text(strip=True) if stock_el else None,
+    )
+
+@SITE.product("lxml")
+def parse_product_page_lxml(html: str, url: str) -> dict:
+    """Same output as `parse_product_page`, using compiled XPath on the raw lxml tree."""
+    root = document(html)
+    return to_record(
+        url,
+        text_of(first(NAME_XPATH, root)),
+        text_of(first(PRICE_XPATH, root)),
+        text_of(first(STOCK_XPATH, root)),
+    )
+
+@SITE.listing
+def parse_listing_page(html: str, url: str) -> dict:
+    """Parse a category or catalogue page into product records plus the next page's url.
+
+    The link title carries the full name (the link text is truncated).
+    """
+    root = document(html)
+    products = []
+    for pod in POD_XPATH(root) if root is not None else []:
+        link = first(POD_LINK_XPATH, pod)
+        if link is None or not link.get("href"):
+            continue
+        products.append(to_record(
+            urljoin(url, link.get("href")),
+            link.get("title") or text_of(link),
+            text_of(first(POD_PRICE_XPATH, pod)),
+            text_of(first(POD_STOCK_XPATH, pod)),
+        ))
+    next_href = first(NEXT_XPATH, root)
+    return {"products": products, "next_url": urljoin(url, next_href) if next_href else None}
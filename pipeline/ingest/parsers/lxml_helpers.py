@@ -0,0 +1,50 @@
+"""Helpers for the lxml parser backend (compiled XPath, no BeautifulSoup tree)."""
+
+import lxml.html
+from lxml import etree
+
+# Elements whose text BeautifulSoup's get_text() leaves out.
+_SKIP_TEXT = {"script", "style", "template"}
+
+
+def has_class(name: str) -> str:
+    """XPath predicate equivalent to the CSS class selector `.name`."""
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+def document(html: str):
+    """Parse html into an lxml root element, or None for an empty document."""
+    try:
+        return lxml.html.document_fromstring(html)
+    except ValueError:
+        # str input with an XML encoding declaration; lxml wants bytes then
+        parser = lxml.html.HTMLParser(encoding="utf-8")
+        return lxml.html.document_fromstring(html.encode("utf-8"), parser=parser)
+    except etree.ParserError:
+        return None
+
+
+def first(xpath: etree.XPath, root):
+    if root is None:
+        return None
+    found = xpath(root)
+    return found[0] if found else None
+
+
+def text_of(el) -> str | None:
+    """Match BeautifulSoup's `get_text(strip=True)` for an lxml element."""
+    if el is None:
+        return None
+    parts = []
+
+    def walk(node):
+        if node.text and node.tag not in _SKIP_TEXT:
+            parts.append(node.text)
+        for child in node:
+            if isinstance(child.tag, str):
+                walk(child)
+            if child.tail:
+                parts.append(child.tail)
+
+    walk(el)
+    return "".join(p.strip() for p in parts if p.strip())
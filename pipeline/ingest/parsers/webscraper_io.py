@@ -1,17 +1,29 @@
-"""Parse a product page on webscraper.io test e-commerce site."""
+"""Parse product and category pages on webscraper.io test e-commerce site."""
 
-from bs4 import BeautifulSoup
-from urllib.parse import urlparse
+from lxml import etree
+from urllib.parse import urljoin, urlparse
 
-def parse_product_page(html: str, url: str) -> dict:
-    host = urlparse(url).hostname or "unknown"
-    soup = BeautifulSoup(html, "lxml")
+from pipeline.ingest.parsers.lxml_helpers import document, first, has_class, text_of
+from pipeline.ingest.registry import register_site
 
-    name_el = soup.select_one(".caption h4:nth-of-type(2), .product-title, h1")
-    name = name_el.get_text(strip=True) if name_el else None
+SITE = register_site("webscraper.io", concurrency=2, delay=0.5, budget=200)
 
-    price_el = soup.select_one(".price, .price.pull-right, .caption h4.price")
-    raw_price = price_el.get_text(strip=True) if price_el else None
+# XPath unions come back in document order, like select_one over a selector list.
+NAME_XPATH = etree.XPath(
+    f"//*[{has_class('caption')}]//h4[count(preceding-sibling::h4) = 1]"
+    f" | //*[{has_class('product-title')}]"
+    " | //h1"
+)
+PRICE_XPATH = etree.XPath(f"//*[{has_class('price')}]")
+
+# Category pages: one .thumbnail card per product; the static variant paginates.
+CARD_XPATH = etree.XPath(f"//*[{has_class('thumbnail')}][.//a[{has_class('title')}]]")
+CARD_LINK_XPATH = etree.XPath(f".//a[{has_class('title')}]")
+CARD_PRICE_XPATH = etree.XPath(f".//*[{has_class('price')}]")
+NEXT_XPATH = etree.XPath(f"//ul[{has_class('pagination')}]//a[@rel='next']/@href")
+
+def to_record(url: str, name: str | None, raw_price: str | None) -> dict:
+    host = urlparse(url).hostname or "unknown"
     price = None
     currency = "USD"
     if raw_price:
@@ -39,3 +51,44 @@ def parse_product_page(html: str, url: str) -> dict:
         "in_stock": in_stock,
         "on_sale": False,
     }
+
+@SITE.product("bs4")
+def parse_product_page(html: str, url: str) -> dict:
+    from bs4 import BeautifulSoup  # bs4 backend only; keeps it off the default import path
+
+    soup = BeautifulSoup(html, "lxml")
+
+    name_el = soup.select_one(".caption h4:nth-of-type(2), .product-title, h1")
+    name = name_el.get_text(strip=True) if name_el else None
+
+    price_el = soup.select_one(".price, .price.pull-right, .caption h4.price")
+    raw_price = price_el.get_text(strip=True) if price_el else None
+
+    return to_record(url, name, raw_price)
+
+@SITE.product("lxml")
+def parse_product_page_lxml(html: str, url: str) -> dict:
+    """Same output as `parse_product_page`, using compiled XPath on the raw lxml tree."""
+    root = document(html)
+    return to_record(url, text_of(first(NAME_XPATH, root)), text_of(first(PRICE_XPATH, root)))
+
+@SITE.listing
+def parse_listing_page(html: str, url: str) -> dict:
+    """Parse a category page into product records plus the next page's url.
+
+    Listings carry everything a product page does (stock is not shown on
+    either), and the link title holds the untruncated name.
+    """
+    root = document(html)
+    products = []
+    for card in CARD_XPATH(root) if root is not None else []:
+        link = first(CARD_LINK_XPATH, card)
+        if not link.get("href"):
+            continue
+        products.append(to_record(
+            urljoin(url, link.get("href")),
+            link.get("title") or text_of(link),
+            text_of(first(CARD_PRICE_XPATH, card)),
+        ))
+    next_href = first(NEXT_XPATH, root)
+    return {"products": products, "next_url": urljoin(url, next_href) if next_href else None}
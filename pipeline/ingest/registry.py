@@ -0,0 +1,129 @@
+"""Site parsers looked up by host; importable without a database connection.
+
+Every module in `pipeline/ingest/parsers` is imported when this module
+is, and registers its site with `register_site` and its parse functions
+with the returned `Site`'s decorators. Adding a site means adding a
+module there; nothing else needs editing.
+
+A url is matched on its hostname, then on each parent domain in turn
+(`www.books.toscrape.com`, `books.toscrape.com`, `toscrape.com`, ...),
+so a lookup is a few dict probes however many sites are registered,
+and a host that only appears in the path or query string never matches.
+"""
+
+import importlib
+import os
+import pkgutil
+from dataclasses import dataclass, field
+from typing import Callable
+from urllib.parse import urlparse
+
+# Both backends return identical dicts; see pipeline.bench.parsers.
+PARSER_BACKEND = os.getenv("PARSER_BACKEND", "lxml")
+PARSERS_PACKAGE = "pipeline.ingest.parsers"
+
+
+@dataclass
+class Site:
+    """One site's parsers and crawl settings.
+
+    `concurrency` and `delay` override the fetcher's per-host defaults,
+    `budget` caps due products fetched per run (see `pipeline.load.schedule`),
+    and `encoding` is forced on responses (None trusts the headers).
+    """
+
+    host: str
+    concurrency: int | None = None
+    delay: float | None = None
+    budget: int | None = None
+    encoding: str | None = "utf-8"
+    parsers: dict[str, Callable] = field(default_factory=dict)
+    listing_parser: Callable | None = None
+
+    def product(self, backend: str):
+        """Decorator registering a `(html, url) -> record` product page parser."""
+        def register(fn):
+            self.parsers[backend] = fn
+            return fn
+        return register
+
+    def listing(self, fn):
+        """Decorator registering a `(html, url) -> {"products", "next_url"}` listing parser."""
+        self.listing_parser = fn
+        return fn
+
+    @property
+    def parser(self) -> Callable:
+        try:
+            return self.parsers[PARSER_BACKEND]
+        except KeyError:
+            raise ValueError(f"{self.host} has no {PARSER_BACKEND} parser") from None
+
+    @property
+    def limits(self) -> dict:
+        """Fetcher overrides (see `Fetcher.host_limits`)."""
+        limits = {"concurrency": self.concurrency, "delay": self.delay}
+        return {k: v for k, v in limits.items() if v is not None}
+
+
+SITES: dict[str, Site] = {}
+
+def register_site(host: str, **settings) -> Site:
+    host = host.lower()
+    if host in SITES:
+        raise ValueError(f"Site registered twice: {host}")
+    site = SITES[host] = Site(host, **settings)
+    return site
+
+def discover_parsers(package: str = PARSERS_PACKAGE):
+    """Import every module in `package` so it registers its site."""
+    pkg = importlib.import_module(package)
+    for module in pkgutil.iter_modules(pkg.__path__):
+        if not module.name.startswith("_"):
+            importlib.import_module(f"{package}.{module.name}")
+
+def find_site(url: str) -> Site | None:
+    host = (urlparse(url).hostname or "").lower()
+    while host:
+        site = SITES.get(host)
+        if site is not None:
+            return site
+        host = host.partition(".")[2]
+    return None
+
+def get_site(url: str) -> Site:
+    site = find_site(url)
+    if site is None:
+        raise ValueError(f"No parser registered for: {url}")
+    return site
+
+def response_encoding(url: str) -> str | None:
+    """Encoding to force on a response from `url`, if its site declares one."""
+    site = find_site(url)
+    return site.encoding if site else None
+
+def get_parser(url: str):
+    return get_site(url).parser
+
+def parse_page(url: str, html: str) -> dict:
+    """Parse `html` with the parser registered for `url` (parse worker entry point)."""
+    return get_parser(url)(html, url)
+
+def get_listing_parser(url: str):
+    fn = get_site(url).listing_parser
+    if fn is None:
+        raise ValueError(f"No listing parser registered for: {url}")
+    return fn
+
+def parse_listing(url: str, html: str) -> dict:
+    """Parse a listing page into `{"products": [...], "next_url": ...}`."""
+    return get_listing_parser(url)(html, url)
+
+def host_limits() -> dict[str, dict]:
+    return {host: site.limits for host, site in SITES.items() if site.limits}
+
+def site_budgets() -> dict[str, int]:
+    return {host: site.budget for host, site in SITES.items() if site.budget is not None}
+
+
+discover_parsers()
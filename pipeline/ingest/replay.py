@@ -0,0 +1,185 @@
+"""Re-parse archived pages with the current parsers and correct price_history.
+
+Every snapshot whose source_hash is in page_archive is re-parsed from the
+archived body, with no network I/O, and its price, currency, stock and
+on-sale fields are overwritten where today's parsers disagree. Each body
+is parsed once however many snapshots share it, in `--workers` parse
+processes. product_latest_price is rebuilt for every product touched.
+
+dbt's incremental models only pick up new snapshot ids, so run
+`dbt build --full-refresh` after a replay that changed anything.
+
+Usage: python -m pipeline.ingest.replay [--since DATE] [--site SITE] [--workers N] [--dry-run]
+"""
+
+import argparse
+import time
+from collections import Counter
+
+from loguru import logger
+from sqlalchemy import text
+
+from pipeline.common import db
+from pipeline.ingest.registry import get_parser, parse_listing, parse_page
+from pipeline.ingest.stages import PARSE_WORKERS, ParseFailed, ParseTask, Parsed, StageStats, run_pipeline
+from pipeline.load.archive import read_body
+from pipeline.load.latest_price import backfill_latest_prices
+from pipeline.load.upsert import BATCH_SIZE
+
+# price_history column -> parsed record field
+FIELDS = {
+    "price_numeric": "price",
+    "currency": "currency",
+    "in_stock_bool": "in_stock",
+    "on_sale_bool": "on_sale",
+}
+
+PAGES_SQL = """
+    select a.sha256, a.url, a.body,
+           json_agg(json_build_object(
+             'id', ph.id, 'ts_utc', ph.ts_utc, 'product_id', ph.product_id, 'url', p.url,
+             'price_numeric', ph.price_numeric, 'currency', ph.currency,
+             'in_stock_bool', ph.in_stock_bool, 'on_sale_bool', ph.on_sale_bool
+           )) as snapshots
+    from page_archive a
+    join price_history ph on ph.source_hash = a.sha256
+    join product p on p.product_id = ph.product_id
+    where a.kind = :kind
+      and (cast(:since as timestamptz) is null or ph.ts_utc >= cast(:since as timestamptz))
+      and (cast(:site as text) is null or p.site = :site)
+    group by a.sha256
+"""
+
+UPDATE_SQL = """
+    update price_history
+    set price_numeric = :price_numeric, currency = :currency,
+        in_stock_bool = :in_stock_bool, on_sale_bool = :on_sale_bool
+    where id = :id and ts_utc = cast(:ts_utc as timestamptz)
+"""
+
+REFRESH_LATEST_SQL = "delete from product_latest_price where product_id = any(:ids)"
+
+
+def replay_product(url: str, html: str) -> dict:
+    """Parse worker entry point. A product page's record applies to every
+    snapshot of that body, whichever product url it was fetched from."""
+    try:
+        return {"record": parse_page(url, html), "records": {}, "error": None}
+    except Exception as e:
+        return {"record": None, "records": {}, "error": f"{type(e).__name__}: {e}"}
+
+
+def replay_listing(url: str, html: str) -> dict:
+    """Parse worker entry point; records are matched to snapshots by product url."""
+    try:
+        products = parse_listing(url, html)["products"]
+        return {"record": None, "records": {r["url"]: r for r in products}, "error": None}
+    except Exception as e:
+        return {"record": None, "records": {}, "error": f"{type(e).__name__}: {e}"}
+
+
+PASSES = (("product", replay_product), ("listing", replay_listing))
+
+
+def archived_pages(kind: str, since=None, site: str | None = None):
+    """Yield `ParseTask`s for archived bodies of `kind`, with the snapshots
+    taken from them as context.
+
+    The parser follows the url, so a product body shared by several
+    products is parsed once per parser their urls select.
+    """
+    with db.engine.connect() as conn:
+        rows = db.streaming(conn, 100).execute(
+            text(PAGES_SQL), {"kind": kind, "since": since, "site": site}
+        )
+        for sha256, url, body, snapshots in rows:
+            html = read_body(body)
+            if kind == "listing":
+                yield ParseTask(url, html, context=snapshots, size=len(body))
+                continue
+            by_parser = {}
+            for snap in snapshots:
+                by_parser.setdefault(get_parser(snap["url"]), []).append(snap)
+            for group in by_parser.values():
+                yield ParseTask(group[0]["url"], html, context=group, size=len(body))
+
+
+def corrections(snapshots: list[dict], parsed: dict, changed: Counter) -> list[dict]:
+    """Rows of UPDATE_SQL params for snapshots the re-parsed page disagrees with."""
+    updates = []
+    for snap in snapshots:
+        record = parsed["record"] or parsed["records"].get(snap["url"])
+        if record is None:
+            changed["missing"] += 1
+            continue
+        row = {col: record[field] for col, field in FIELDS.items()}
+        diff = [col for col in FIELDS if row[col] != snap[col]]
+        if diff:
+            changed.update(diff)
+            updates.append({**row, "id": snap["id"], "ts_utc": snap["ts_utc"], "product_id": snap["product_id"]})
+    return updates
+
+
+def main(since=None, site: str | None = None, parse_workers: int = PARSE_WORKERS, dry_run: bool = False):
+    """Replay archived pages; returns the number of snapshots corrected."""
+    totals = {name: StageStats(name) for name in ("fetch", "parse", "write")}
+    changed, errors = Counter(), Counter()
+    pending, touched = [], set()
+    corrected = 0
+    started = time.perf_counter()
+
+    with db.SessionLocal() as session:
+        def flush():
+            nonlocal corrected
+            if pending and not dry_run:
+                session.execute(text(UPDATE_SQL), pending)
+                session.commit()
+            corrected += len(pending)
+            pending.clear()
+
+        def write(item: Parsed | ParseFailed):
+            if isinstance(item, ParseFailed):
+                errors[item.error.partition(":")[0]] += 1
+                return
+            if item.result["error"]:
+                errors[item.result["error"]] += 1
+                return
+            updates = corrections(item.context, item.result, changed)
+            touched.update(u["product_id"] for u in updates)
+            pending.extend(updates)
+            if len(pending) >= BATCH_SIZE:
+                flush()
+
+        for kind, parse_fn in PASSES:
+            stats, wall = run_pipeline(archived_pages(kind, since, site), parse_fn, write, parse_workers)
+            flush()
+            for name, s in stats.items():
+                t = totals[name]
+                for field in ("items", "bytes", "busy", "blocked", "idle"):
+                    setattr(t, field, getattr(t, field) + getattr(s, field))
+            logger.info(f"Replayed {stats['parse'].items} archived {kind} pages in {wall:.2f}s")
+
+        if touched and not dry_run:
+            session.execute(text(REFRESH_LATEST_SQL), {"ids": list(touched)})
+            backfill_latest_prices(session.connection())
+            session.commit()
+            logger.info(f"Rebuilt product_latest_price for {len(touched)} products")
+
+    wall = time.perf_counter() - started
+    verb = "Would correct" if dry_run else "Corrected"
+    logger.info(f"{verb} {corrected} snapshots in {wall:.2f}s; differences: {dict(changed)}")
+    for s in totals.values():
+        logger.info(s.summary(wall))
+    if errors:
+        logger.warning(f"Parse errors: {dict(errors)}")
+    return corrected
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--since", help="only snapshots taken at or after this timestamp")
+    ap.add_argument("--site", help="only products of this site")
+    ap.add_argument("--workers", type=int, default=PARSE_WORKERS, help="parse processes (0 = inline)")
+    ap.add_argument("--dry-run", action="store_true", help="report differences without writing")
+    args = ap.parse_args()
+    main(since=args.since, site=args.site, parse_workers=args.workers, dry_run=args.dry_run)
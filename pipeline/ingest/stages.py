@@ -0,0 +1,235 @@
+"""Pipelined ingest: fetch threads -> bounded queue -> parser processes -> one writer.
+
+Every hand-off is bounded: fetched bodies wait in a bounded queue, and
+items reach the writer only after taking a slot (`queue_size` for items
+from the fetch stage, two per worker for parse results) that the writer
+gives back once it has taken the item. A slow stage therefore blocks
+the one feeding it instead of letting bodies pile up in memory, and the
+parse pool's result callbacks never block.
+
+A page whose parser raises reaches the writer as a `ParseFailed` and the
+run goes on; only a broken parse pool ends it.
+"""
+
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor
+from dataclasses import dataclass
+
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", str(os.cpu_count() or 1)))
+QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "64"))
+
+_DONE = object()
+
+
+@dataclass
+class ParseTask:
+    """A fetched body waiting for the parse stage."""
+    url: str
+    html: str
+    context: object = None
+    size: int = 0
+
+
+@dataclass
+class Parsed:
+    """A parse result on its way to the writer."""
+    context: object
+    result: dict
+    seconds: float = 0.0
+
+
+@dataclass
+class ParseFailed:
+    """A page whose parser raised, on its way to the writer."""
+    url: str
+    context: object
+    error: str
+
+
+@dataclass
+class _Failure:
+    error: BaseException
+
+
+@dataclass
+class StageStats:
+    """Throughput counters for one stage.
+
+    `busy` is time spent doing the stage's own work, `blocked` is time
+    waiting on a full downstream queue and `idle` is time waiting for
+    upstream input. The bottleneck is the stage that is busy while the
+    others are blocked or idle.
+    """
+    name: str
+    items: int = 0
+    bytes: int = 0
+    busy: float = 0.0
+    blocked: float = 0.0
+    idle: float = 0.0
+
+    def summary(self, wall: float) -> str:
+        rate = self.items / wall if wall else 0.0
+        return (
+            f"{self.name}: {self.items} items ({rate:.1f}/s), {self.bytes / 1e6:.2f} MB, "
+            f"busy {self.busy:.2f}s, blocked {self.blocked:.2f}s, idle {self.idle:.2f}s"
+        )
+
+
+def _timed_parse(parse_fn, url: str, html: str):
+    start = time.perf_counter()
+    result = parse_fn(url, html)
+    return result, time.perf_counter() - start
+
+
+def _process_pool(workers: int) -> ProcessPoolExecutor:
+    # fork is unsafe once fetch threads are running
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method))
+
+
+def _timed_put(q: queue.Queue, item, stats: StageStats):
+    start = time.perf_counter()
+    q.put(item)
+    stats.blocked += time.perf_counter() - start
+
+
+def _timed_acquire(slots: threading.Semaphore, stats: StageStats):
+    start = time.perf_counter()
+    slots.acquire()
+    stats.blocked += time.perf_counter() - start
+
+
+def _parse_outcome(task: ParseTask, result, seconds: float, error: BaseException | None, parse: StageStats):
+    if error is not None:
+        return ParseFailed(task.url, task.context, f"{type(error).__name__}: {error}")
+    parse.busy += seconds
+    parse.items += 1
+    return Parsed(task.context, result, seconds)
+
+
+def run_pipeline(source, parse_fn, write, parse_workers: int = PARSE_WORKERS, queue_size: int = QUEUE_SIZE):
+    """Drain `source` through the parse pool into `write`.
+
+    `source` is an iterator run on its own thread; it yields `ParseTask`s
+    for bodies that need parsing and any other item to hand straight to
+    the writer. `parse_fn(url, html)` must be a picklable top-level
+    function. `write` runs on the calling thread and receives `Parsed`
+    results, `ParseFailed` for pages whose parser raised, and the
+    pass-through items. Returns the per-stage stats and
+    the wall time in seconds.
+    """
+    raw_q: queue.Queue = queue.Queue(maxsize=queue_size)
+    # unbounded, but every item in it holds one of these slots until the writer takes it
+    out_q: queue.SimpleQueue = queue.SimpleQueue()
+    room = threading.Semaphore(queue_size)
+    slots = threading.Semaphore(max(parse_workers, 1) * 2)
+    stop = threading.Event()
+    stats = {name: StageStats(name) for name in ("fetch", "parse", "write")}
+    fetch, parse, written = stats["fetch"], stats["parse"], stats["write"]
+
+    def produce():
+        try:
+            items = iter(source)
+            while not stop.is_set():
+                start = time.perf_counter()
+                try:
+                    item = next(items)
+                except StopIteration:
+                    break
+                fetch.busy += time.perf_counter() - start
+                fetch.items += 1
+                if isinstance(item, ParseTask):
+                    fetch.bytes += item.size
+                    _timed_put(raw_q, item, fetch)
+                else:
+                    _timed_acquire(room, fetch)
+                    out_q.put((item, room))
+        except BaseException as e:
+            out_q.put((_Failure(e), None))
+        finally:
+            raw_q.put(_DONE)
+
+    def on_parsed(task, fut):
+        # runs on the pool's management thread: must not block
+        try:
+            result, seconds = fut.result()
+        except BrokenExecutor as e:
+            out_q.put((_Failure(e), slots))
+            return
+        except Exception as e:
+            out_q.put((_parse_outcome(task, None, 0.0, e, parse), slots))
+            return
+        out_q.put((_parse_outcome(task, result, seconds, None, parse), slots))
+
+    def dispatch():
+        try:
+            if parse_workers <= 0:
+                while (task := _get(raw_q, parse)) is not _DONE:
+                    if stop.is_set():
+                        continue
+                    try:
+                        result, seconds = _timed_parse(parse_fn, task.url, task.html)
+                        error = None
+                    except Exception as e:
+                        result, seconds, error = None, 0.0, e
+                    _timed_acquire(slots, parse)
+                    out_q.put((_parse_outcome(task, result, seconds, error, parse), slots))
+                return
+            with _process_pool(parse_workers) as pool:
+                while (task := _get(raw_q, parse)) is not _DONE:
+                    if stop.is_set():
+                        continue
+                    _timed_acquire(slots, parse)
+                    fut = pool.submit(_timed_parse, parse_fn, task.url, task.html)
+                    fut.add_done_callback(lambda f, task=task: on_parsed(task, f))
+        except BaseException as e:
+            out_q.put((_Failure(e), None))
+        finally:
+            out_q.put((_DONE, None))
+
+    threads = [
+        threading.Thread(target=produce, name="ingest-fetch", daemon=True),
+        threading.Thread(target=dispatch, name="ingest-parse", daemon=True),
+    ]
+    wall = time.perf_counter()
+    for t in threads:
+        t.start()
+    try:
+        while True:
+            item, slot = _get(out_q, written)
+            if item is _DONE:
+                break
+            if slot is not None:
+                slot.release()
+            if isinstance(item, _Failure):
+                raise item.error
+            start = time.perf_counter()
+            write(item)
+            written.busy += time.perf_counter() - start
+            written.items += 1
+    finally:
+        stop.set()
+        # if we bailed out early, keep draining so blocked stages can finish
+        while any(t.is_alive() for t in threads):
+            try:
+                while True:
+                    _, slot = out_q.get_nowait()
+                    if slot is not None:
+                        slot.release()
+            except queue.Empty:
+                pass
+            for t in threads:
+                t.join(timeout=0.05)
+    wall = time.perf_counter() - wall
+    return stats, wall
+
+
+def _get(q: queue.Queue | queue.SimpleQueue, stats: StageStats):
+    start = time.perf_counter()
+    item = q.get()
+    stats.idle += time.perf_counter() - start
+    return item
@@ -1,75 +1,123 @@
-"""Post Slack alerts for price drops detected in last 12 hours."""
+"""Post Slack alerts for price drops detected in a recent window (12 hours by default).
 
-import os, json, requests
+A drop is alerted once: delivered alerts are recorded in alert_sent by
+product and snapshot time, and later runs whose window still covers
+them skip them.
+"""
+
+import os
+from datetime import datetime, timedelta, timezone
+import numpy as np
 import pandas as pd
-from sqlalchemy import create_engine, text as sql_text
+from sqlalchemy import text as sql_text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from pipeline.common import db
+from pipeline.common.models import AlertSent
+from pipeline.load.notify import Notifier, money
+from pipeline.load.price_series import drops, read_batch, to_us
+
+WINDOW_HOURS = float(os.getenv("ALERT_WINDOW_HOURS", "12"))
+MIN_DROP_PCT = float(os.getenv("ALERT_MIN_DROP_PCT", "0"))
+# "state" compares last vs previous price in product_latest_price (one row per
+# product); "history" replays every snapshot in the window.
+ALERT_SOURCE = os.getenv("ALERT_SOURCE", "state")
+
+STATE_DROPS_SQL = """
+    select
+      p.product_id,
+      p.name,
+      p.site,
+      p.url,
+      l.prev_price,
+      l.last_price as new_price,
+      round(100.0 * (l.prev_price - l.last_price) / nullif(l.prev_price, 0), 2) as drop_pct,
+      l.price_changed_utc as ts_utc
+    from public.product_latest_price l
+    join public.product p
+      on p.product_id = l.product_id
+    where l.price_changed_utc > :since
+      and l.last_price < l.prev_price
+      and 100.0 * (l.prev_price - l.last_price) / nullif(l.prev_price, 0) >= :min_drop_pct
+    order by l.price_changed_utc desc
+"""
+
+PRODUCTS_SQL = """
+    select product_id, name, site, url
+    from public.product
+    where product_id = any(:pids)
+"""
+
+def history_drops(conn, since: datetime, min_drop_pct: float) -> pd.DataFrame:
+    """Every drop in the window. Reads only the window plus each product's
+    last priced snapshot before it, in one binary COPY, and finds the drops
+    with `pipeline.load.price_series.drops`."""
+    found = drops(read_batch(conn, since), to_us(since), min_drop_pct)
+    pids = np.unique(found["product_id"]).tolist()
+    products = pd.read_sql(sql_text(PRODUCTS_SQL), conn, params={"pids": pids})
+    df = pd.DataFrame({
+        "product_id": found["product_id"],
+        "prev_price": found["prev_cents"] / 100,
+        "new_price": found["new_cents"] / 100,
+        "drop_pct": found["drop_pct"],
+        "ts_utc": pd.to_datetime(found["ts"], unit="us", utc=True),
+    }).merge(products, on="product_id", how="left")
+    return df[["product_id", "name", "site", "url", "prev_price", "new_price", "drop_pct", "ts_utc"]]
 
-def main():
-    db_url = os.getenv("DATABASE_URL")
-    slack = os.getenv("SLACK_WEBHOOK_URL")
-    engine = create_engine(db_url, future=True)
+def load_drops(conn, window_hours: float, min_drop_pct: float, source: str = ALERT_SOURCE) -> pd.DataFrame:
+    since = datetime.now(timezone.utc) - timedelta(hours=window_hours)
+    if source != "state":
+        return history_drops(conn, since, min_drop_pct)
+    return pd.read_sql(
+        sql_text(STATE_DROPS_SQL), conn, params={"since": since, "min_drop_pct": min_drop_pct}
+    )
 
-    with engine.connect() as c:
-        df = pd.read_sql(sql_text("""
-        with hist as (
-          select
-            ph.product_id,
-            ph.ts_utc,
-            ph.price_numeric as curr_price,
-            lag(ph.price_numeric) over (
-              partition by ph.product_id
-              order by ph.ts_utc
-            ) as prev_price
-          from public.price_history ph
-          where ph.price_numeric is not null
-        ),
-        drops as (
-          select
-            product_id,
-            ts_utc,
-            prev_price,
-            curr_price,
-            case
-              when prev_price is not null and curr_price < prev_price
-              then round(100.0 * (prev_price - curr_price) / nullif(prev_price, 0), 2)
-              else null
-            end as drop_pct
-          from hist
-        )
-        select
-          p.product_id,
-          p.name,
-          p.site,
-          p.url,
-          d.prev_price,
-          d.curr_price as new_price,
-          d.drop_pct,
-          d.ts_utc
-        from drops d
-        join public.product p
-          on p.product_id = d.product_id
-        where d.drop_pct is not null
-          and d.ts_utc > now() - interval '12 hours'
-        order by d.ts_utc desc
-    """), c)
+def drop_lines(df: pd.DataFrame) -> list[str]:
+    return (
+        df["site"] + " – " + df["name"].fillna("") + ": "
+        + money(df["prev_price"]) + " → " + money(df["new_price"])
+        + " GBP (" + money(df["drop_pct"]) + "%)\n" + df["url"]
+    ).tolist()
 
+def unsent(conn, df: pd.DataFrame) -> pd.DataFrame:
+    """Drop rows whose price event (product, snapshot time) was already alerted."""
     if df.empty:
-        print("No price drops in the last 12 hours.")
-        return
+        return df
+    sent = pd.read_sql(
+        sql_text("select product_id, event_utc as ts_utc from public.alert_sent where event_utc >= :since"),
+        conn,
+        params={"since": df["ts_utc"].min()},
+    )
+    seen = df.merge(sent, on=["product_id", "ts_utc"], how="left", indicator=True)["_merge"] == "both"
+    return df[~seen.to_numpy()]
+
+def record_sent(conn, df: pd.DataFrame):
+    conn.execute(
+        pg_insert(AlertSent).on_conflict_do_nothing(),
+        [
+            {"product_id": int(r.product_id), "event_utc": r.ts_utc, "new_price": r.new_price}
+            for r in df[["product_id", "ts_utc", "new_price"]].itertuples(index=False)
+        ],
+    )
+
+def main(window_hours: float | None = None, min_drop_pct: float | None = None, source: str = ALERT_SOURCE):
+    window_hours = WINDOW_HOURS if window_hours is None else window_hours
+    min_drop_pct = MIN_DROP_PCT if min_drop_pct is None else min_drop_pct
+    with db.engine.connect() as c:
+        df = load_drops(c, window_hours, min_drop_pct, source)
+        found = len(df)
+        df = unsent(c, df).reset_index(drop=True)
 
-    lines = [
-        f"{row.site} – {row.name}: {row.prev_price:.2f} → {row.new_price:.2f} GBP ({row.drop_pct:.2f}%)\n{row.url}"
-        for _, row in df.iterrows()
-    ]
-    text = "Price drops detected:\n" + "\n\n".join(lines)
-    print(text)
+    if df.empty:
+        print(f"No new price drops in the last {window_hours:g} hours ({found} already alerted).")
+        return
 
-    if slack:
-        try:
-            requests.post(slack, data=json.dumps({"text": text}), headers={"Content-Type": "application/json"})
-            print("Posted drop alerts to Slack.")
-        except Exception as e:
-            print("Slack post failed:", e)
+    with Notifier() as notifier:
+        delivered = notifier.send(drop_lines(df), header="Price drops detected:", sep="\n\n")
+    if delivered:
+        with db.engine.begin() as c:
+            record_sent(c, df.iloc[delivered])
+        print(f"Posted {len(delivered)} drop alerts to Slack in {notifier.sent} messages.")
 
 if __name__ == "__main__":
     main()
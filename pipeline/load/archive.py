@@ -0,0 +1,51 @@
+"""Content-addressed archive of fetched page bodies in page_archive.
+
+Bodies are stored zstd-compressed under the sha256 of their UTF-8 text,
+which is also what price_history.source_hash holds, so every snapshot
+can be traced back to (and re-parsed from) the page it came from.
+Identical bodies are stored once: inserts skip hashes already present.
+"""
+
+import hashlib
+import os
+
+import zstandard
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from pipeline.common.models import PageArchive
+
+ARCHIVE_ENABLED = os.getenv("HTML_ARCHIVE", "1") == "1"
+ZSTD_LEVEL = int(os.getenv("HTML_ARCHIVE_LEVEL", "3"))
+
+
+def body_hash(html: str) -> str:
+    return hashlib.sha256(html.encode("utf-8")).hexdigest()
+
+
+def same_body(body_hash: str, last_hash: str | None) -> bool:
+    """Compare with a crawl_state hash; rows written before the archive
+    hold only the first 16 characters."""
+    return bool(last_hash) and body_hash[: len(last_hash)] == last_hash
+
+
+def archive_row(sha256: str, url: str, kind: str, html: str) -> dict | None:
+    """A page_archive row for `html` ("product" or "listing" page), or
+    None when archiving is off."""
+    if not ARCHIVE_ENABLED:
+        return None
+    raw = html.encode("utf-8")
+    return {
+        "sha256": sha256,
+        "kind": kind,
+        "url": url,
+        "size": len(raw),
+        "body": zstandard.compress(raw, ZSTD_LEVEL),
+    }
+
+
+def read_body(body: bytes) -> str:
+    return zstandard.decompress(body).decode("utf-8")
+
+
+def archive_insert():
+    return pg_insert(PageArchive).on_conflict_do_nothing(index_elements=[PageArchive.sha256])
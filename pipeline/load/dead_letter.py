@@ -0,0 +1,62 @@
+"""Dead-letter queue of urls whose fetch failed, in fetch_dead_letter.
+
+A url that still fails after the fetcher's retries (connection error,
+timeout, HTTP error status, or its host's circuit breaker being open),
+or whose page its parser raised on, is recorded here instead of failing
+the run, with a failure count. A failed product's schedule in
+crawl_state is left alone (a lease on it is released), so it stays due
+and the next run retries it among the most overdue. The row is removed
+once a later fetch of the url, or a snapshot of the product, succeeds.
+"""
+
+from dataclasses import dataclass
+
+import requests
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from pipeline.common.models import FetchDeadLetter as D
+
+ERROR_CHARS = 500
+
+
+@dataclass
+class FetchFailure:
+    """A failed fetch on its way to the writer."""
+    url: str
+    kind: str  # "product" or "listing"
+    error: str
+    status: int | None = None
+    product_id: int | None = None
+
+    def row(self) -> dict:
+        return {
+            "url": self.url,
+            "kind": self.kind,
+            "product_id": self.product_id,
+            "error": self.error[:ERROR_CHARS],
+            "status": self.status,
+        }
+
+
+def fetch_failure(url: str, kind: str, outcome, product_id: int | None = None) -> FetchFailure:
+    """Describe a failed fetch from its error response or `requests` exception."""
+    if isinstance(outcome, requests.Response):
+        return FetchFailure(url, kind, f"HTTP {outcome.status_code}", outcome.status_code, product_id)
+    return FetchFailure(url, kind, f"{type(outcome).__name__}: {outcome}", None, product_id)
+
+
+def dead_letter_upsert():
+    """Insert failures; a url already queued gets its count bumped and its last error."""
+    stmt = pg_insert(D)
+    ex = stmt.excluded
+    return stmt.on_conflict_do_update(
+        index_elements=[D.url],
+        set_={
+            "failures": D.failures + 1,
+            "error": ex.error,
+            "status": ex.status,
+            "product_id": func.coalesce(ex.product_id, D.product_id),
+            "last_failed_utc": func.now(),
+        },
+    )
@@ -0,0 +1,179 @@
+"""Export price_history (with product site, name and url) to Parquet for offline analysis.
+
+Rows are read in keyset-paginated batches (`id > last id`, EXPORT_BATCH_ROWS
+at a time) and written through Arrow into a hive-partitioned dataset,
+`date=YYYY-MM-DD/part-<first id>-<n>.parquet`, one directory per UTC day.
+The last exported id is kept in `_watermark.json` next to the data, so
+each run only reads new rows. Rows younger than EXPORT_LAG_SECONDS are
+left for the next run, so a write transaction still in flight can't
+commit a lower id behind the watermark.
+
+Snapshots corrected later (see `pipeline.ingest.replay`) are not
+re-exported; run with `--full` to rebuild the dataset. It also starts
+over on its own when price_history has been recreated (`reset.py`).
+
+Read it back with `open_dataset` or `read_history`, e.g.
+`read_history(product_id=42).to_pandas()`; files are memory-mapped.
+Ingest writes ids in time order, so a batch normally lands in one or two
+day directories; a backfill of out-of-order history spreads each batch
+over many days and leaves many small files.
+
+Usage: python -m pipeline.load.export_parquet [--dir DIR] [--full]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+from pyarrow import fs
+from sqlalchemy import text
+
+from pipeline.common import db
+
+EXPORT_DIR = os.getenv("PARQUET_EXPORT_DIR", "exports/price_history")
+BATCH_ROWS = int(os.getenv("EXPORT_BATCH_ROWS", "50000"))
+LAG_SECONDS = int(os.getenv("EXPORT_LAG_SECONDS", "300"))
+COMPRESSION = os.getenv("EXPORT_COMPRESSION", "zstd")
+WATERMARK_FILE = "_watermark.json"
+
+SCHEMA = pa.schema([
+    ("id", pa.int64()),
+    ("product_id", pa.int32()),
+    ("ts_utc", pa.timestamp("us", tz="UTC")),
+    ("price_numeric", pa.decimal128(12, 2)),
+    ("currency", pa.string()),
+    ("in_stock_bool", pa.bool_()),
+    ("on_sale_bool", pa.bool_()),
+    ("site", pa.string()),
+    ("name", pa.string()),
+    ("url", pa.string()),
+    ("date", pa.date32()),
+])
+
+PARTITIONING = ds.partitioning(pa.schema([("date", pa.date32())]), flavor="hive")
+
+# Highest id safe to export: rows this old belong to committed transactions.
+UPPER_SQL = """
+    select coalesce(max(id), 0) from public.price_history
+    where ts_utc < now() - make_interval(secs => :lag)
+"""
+
+BATCH_SQL = """
+    select h.id, h.product_id, h.ts_utc, h.price_numeric, h.currency,
+           h.in_stock_bool, h.on_sale_bool, p.site, p.name, p.url,
+           (h.ts_utc at time zone 'UTC')::date as date
+    from public.price_history h
+    join public.product p on p.product_id = h.product_id
+    where h.id > :after and h.id <= :upper
+    order by h.id
+    limit :limit
+"""
+
+# Changes whenever price_history is dropped and recreated.
+TABLE_OID_SQL = "select 'public.price_history'::regclass::oid::bigint"
+
+
+def read_watermark(out: Path) -> dict:
+    path = out / WATERMARK_FILE
+    return json.loads(path.read_text()) if path.exists() else {}
+
+def write_watermark(out: Path, watermark: dict):
+    """Write atomically, after the batch's files, so a crash re-exports the batch."""
+    tmp = out / f"{WATERMARK_FILE}.{os.getpid()}.tmp"
+    tmp.write_text(json.dumps(watermark))
+    os.replace(tmp, out / WATERMARK_FILE)
+
+def clear_export(out: Path):
+    for part in out.glob("date=*"):
+        shutil.rmtree(part)
+    (out / WATERMARK_FILE).unlink(missing_ok=True)
+
+def batches(conn, after: int, upper: int, batch_rows: int = BATCH_ROWS):
+    """Yield Arrow tables of rows with ids in (after, upper], in id order."""
+    while after < upper:
+        rows = conn.execute(text(BATCH_SQL), {"after": after, "upper": upper, "limit": batch_rows}).all()
+        if not rows:
+            return
+        columns = dict(zip(SCHEMA.names, zip(*rows)))
+        yield pa.Table.from_pydict(columns, schema=SCHEMA)
+        after = rows[-1][0]
+
+def write_batch(table: pa.Table, out: Path):
+    """Write `table` under out/date=.../; file names are fixed by its first id, so
+    writing the same batch again replaces its files. Rows are sorted by product
+    so row group statistics can skip files on a `product_id` filter."""
+    first_id = table["id"][0].as_py()
+    days = len(pc.unique(table["date"]))
+    ds.write_dataset(
+        table.sort_by([("product_id", "ascending"), ("id", "ascending")]),
+        out,
+        format="parquet",
+        partitioning=PARTITIONING,
+        basename_template=f"part-{first_id}-{{i}}.parquet",
+        existing_data_behavior="overwrite_or_ignore",
+        max_partitions=max(days, 1024),
+        file_options=ds.ParquetFileFormat().make_write_options(compression=COMPRESSION),
+    )
+
+def export(out_dir: str = EXPORT_DIR, full: bool = False, batch_rows: int = BATCH_ROWS, lag: int | None = None) -> int:
+    """Append rows exported since the last run to the dataset at `out_dir`; returns rows written."""
+    lag = LAG_SECONDS if lag is None else lag
+    out = Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    with db.engine.connect() as conn:
+        table_oid = conn.execute(text(TABLE_OID_SQL)).scalar()
+        watermark = read_watermark(out)
+        if full or watermark.get("table_oid") != table_oid:
+            if watermark:
+                print(f"Rebuilding the export in {out} from scratch")
+            clear_export(out)
+            watermark = {"table_oid": table_oid, "last_id": 0}
+        upper = conn.execute(text(UPPER_SQL), {"lag": lag}).scalar()
+
+        start, rows = time.perf_counter(), 0
+        for table in batches(conn, watermark["last_id"], upper, batch_rows):
+            write_batch(table, out)
+            rows += table.num_rows
+            watermark["last_id"] = table["id"][-1].as_py()
+            write_watermark(out, watermark)
+    elapsed = time.perf_counter() - start
+    print(f"Exported {rows} rows to {out} in {elapsed:.2f}s ({rows / max(elapsed, 1e-9):.0f} rows/s), "
+          f"watermark id {watermark['last_id']}")
+    return rows
+
+
+def open_dataset(out_dir: str = EXPORT_DIR) -> ds.Dataset:
+    return ds.dataset(
+        os.path.abspath(out_dir),
+        format="parquet",
+        partitioning=PARTITIONING,
+        filesystem=fs.LocalFileSystem(use_mmap=True),
+    )
+
+def read_history(product_id: int | None = None, start=None, end=None, columns=None, out_dir: str = EXPORT_DIR) -> pa.Table:
+    """Exported rows, filtered on product and `date` partitions (start/end are dates, inclusive)."""
+    filters = []
+    if product_id is not None:
+        filters.append(ds.field("product_id") == product_id)
+    if start is not None:
+        filters.append(ds.field("date") >= start)
+    if end is not None:
+        filters.append(ds.field("date") <= end)
+    expr = None
+    for f in filters:
+        expr = f if expr is None else expr & f
+    return open_dataset(out_dir).to_table(columns=columns, filter=expr)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--dir", default=EXPORT_DIR, help="dataset directory")
+    ap.add_argument("--full", action="store_true", help="discard the existing export and start over")
+    args = ap.parse_args()
+    export(args.dir, full=args.full)
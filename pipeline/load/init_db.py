@@ -1,11 +1,56 @@
 """Script to initialise the database by creating all tables defined in the models."""
 
-from pipeline.common.db import engine
+import os
+
+from sqlalchemy import text
+
+from pipeline.common import db
 from pipeline.common.db import Base
 from pipeline.common import models
+from pipeline.load.latest_price import backfill_latest_prices
+from pipeline.load.partitions import create_partitioned_price_history, ensure_partitions
+
+# Create price_history as a monthly range-partitioned table (new databases only).
+PARTITIONED_HISTORY = os.getenv("PRICE_HISTORY_PARTITIONED", "0") == "1"
+
+# Objects create_all() skips when their table already exists.
+UPGRADES = [
+    "create index if not exists ix_price_history_product_ts on price_history (product_id, ts_utc)",
+    # covered by ix_price_history_product_ts
+    "drop index if exists ix_price_history_product_id",
+    "alter table crawl_state add column if not exists lease_owner text",
+    "alter table crawl_state add column if not exists lease_expires_utc timestamptz",
+    "alter table crawl_state add column if not exists interval_seconds integer",
+    "alter table crawl_state add column if not exists next_due_utc timestamptz",
+    "create index if not exists ix_crawl_state_next_due_utc on crawl_state (next_due_utc)",
+    "alter table product_latest_price add column if not exists stock_changed_utc timestamptz",
+    "alter table ingest_run add column if not exists mode text",
+    "alter table ingest_run add column if not exists worker text",
+]
+
+def apply_upgrades():
+    with db.engine.begin() as conn:
+        for stmt in UPGRADES:
+            conn.execute(text(stmt))
+        ensure_partitions(conn)
+        backfill_latest_prices(conn)
+
+def create_tables(partitioned: bool = PARTITIONED_HISTORY):
+    """Create all tables; with `partitioned`, price_history is created from raw DDL.
+
+    An existing price_history is left as it is either way.
+    """
+    if partitioned:
+        others = [t for t in Base.metadata.sorted_tables if t.name != "price_history"]
+        Base.metadata.create_all(bind=db.engine, tables=others)
+        with db.engine.begin() as conn:
+            create_partitioned_price_history(conn)
+    else:
+        Base.metadata.create_all(bind=db.engine)
+    apply_upgrades()
 
 def main():
-    Base.metadata.create_all(bind=engine)
+    create_tables()
     print("Created tables")
 
 if __name__ == "__main__":
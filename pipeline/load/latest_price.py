@@ -0,0 +1,82 @@
+"""Maintain product_latest_price alongside price_history writes.
+
+`prev_price` / `prev_in_stock_bool` hold the last *different* value, so a
+snapshot that repeats the current price (e.g. the page changed for some
+other reason) does not hide a recent drop.
+"""
+
+from sqlalchemy import case, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from pipeline.common.models import ProductLatestPrice as L
+
+def latest_price_upsert():
+    """Upsert for rows of product_id, price_history_id, last_price, currency,
+    in_stock_bool and last_seen_utc; older snapshots never overwrite newer ones."""
+    stmt = pg_insert(L)
+    ex = stmt.excluded
+    price_moved = ex.last_price.is_distinct_from(L.last_price)
+    stock_moved = ex.in_stock_bool.is_distinct_from(L.in_stock_bool)
+    return stmt.on_conflict_do_update(
+        index_elements=[L.product_id],
+        set_={
+            "price_history_id": ex.price_history_id,
+            "prev_price": case((price_moved, L.last_price), else_=L.prev_price),
+            "last_price": ex.last_price,
+            "currency": ex.currency,
+            "prev_in_stock_bool": case((stock_moved, L.in_stock_bool), else_=L.prev_in_stock_bool),
+            "in_stock_bool": ex.in_stock_bool,
+            "last_seen_utc": ex.last_seen_utc,
+            "price_changed_utc": case((price_moved, ex.last_seen_utc), else_=L.price_changed_utc),
+            "stock_changed_utc": case((stock_moved, ex.last_seen_utc), else_=L.stock_changed_utc),
+        },
+        where=ex.last_seen_utc >= L.last_seen_utc,
+    )
+
+BACKFILL_SQL = """
+    with latest as (
+      select distinct on (product_id)
+        id, product_id, ts_utc, price_numeric, currency, in_stock_bool
+      from price_history
+      order by product_id, ts_utc desc, id desc
+    )
+    insert into product_latest_price (
+      product_id, price_history_id, last_price, prev_price, currency,
+      in_stock_bool, prev_in_stock_bool, last_seen_utc, price_changed_utc
+    )
+    select
+      l.product_id,
+      l.id,
+      l.price_numeric,
+      pp.price_numeric,
+      l.currency,
+      l.in_stock_bool,
+      ps.in_stock_bool,
+      l.ts_utc,
+      coalesce(
+        (select min(ph.ts_utc) from price_history ph
+         where ph.product_id = l.product_id
+           and ph.ts_utc > coalesce(pp.ts_utc, '-infinity')),
+        l.ts_utc
+      )
+    from latest l
+    left join lateral (
+      select ph.price_numeric, ph.ts_utc from price_history ph
+      where ph.product_id = l.product_id
+        and ph.price_numeric is distinct from l.price_numeric
+      order by ph.ts_utc desc
+      limit 1
+    ) pp on true
+    left join lateral (
+      select ph.in_stock_bool from price_history ph
+      where ph.product_id = l.product_id
+        and ph.in_stock_bool is distinct from l.in_stock_bool
+      order by ph.ts_utc desc
+      limit 1
+    ) ps on true
+    on conflict (product_id) do nothing
+"""
+
+def backfill_latest_prices(conn) -> int:
+    """Seed product_latest_price from history for products it doesn't cover yet."""
+    return conn.execute(text(BACKFILL_SQL)).rowcount
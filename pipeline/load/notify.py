@@ -0,0 +1,153 @@
+"""Deliver Slack webhook messages for alerts and reports.
+
+Lines are packed into messages of at most `NOTIFY_MAX_CHARS` characters,
+so a large batch of alerts goes out as several complete messages rather
+than one that Slack truncates. Messages are posted one at a time through
+a pooled session with a timeout, urllib3 retries with backoff on 429 and
+5xx (honouring Retry-After), and a minimum interval between posts to
+stay under Slack's one-message-per-second webhook limit.
+
+Benchmark against a local webhook stub with `python -m pipeline.bench.notify_delivery`.
+"""
+
+import os
+import time
+from typing import TYPE_CHECKING
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+MAX_CHARS = int(os.getenv("NOTIFY_MAX_CHARS", "3500"))
+TIMEOUT = float(os.getenv("NOTIFY_TIMEOUT_SECONDS", "10"))
+RETRIES = int(os.getenv("NOTIFY_RETRIES", "4"))
+BACKOFF = float(os.getenv("NOTIFY_BACKOFF_SECONDS", "0.5"))
+MIN_INTERVAL = float(os.getenv("NOTIFY_MIN_INTERVAL_SECONDS", "1"))
+
+
+def money(values: "pd.Series") -> "pd.Series":
+    """Format a numeric column with two decimals."""
+    return values.astype(float).map("{:.2f}".format)
+
+
+def chunk_lines(lines: list[str], header: str = "", footer: str = "", limit: int = MAX_CHARS, sep: str = "\n"):
+    """Pack `lines` into messages of at most `limit` characters.
+
+    Returns `(text, line_indices)` pairs. Each message repeats `header`
+    (numbered "(i/n)" when there are several) and `footer`; a line too
+    long to fit on its own is cut short.
+    """
+    lines = list(lines)
+    # room for the " (i/n)" suffix and separators around header and footer
+    room = limit - len(header) - len(footer) - 2 * len(sep) - 12
+    if room <= 0:
+        raise ValueError(f"header and footer leave no room in {limit} characters")
+    groups, current, size = [], [], 0
+    for i, line in enumerate(lines):
+        if len(line) > room:
+            lines[i] = line = line[: room - 1] + "…"
+        if current and size + len(sep) + len(line) > room:
+            groups.append(current)
+            current, size = [], 0
+        size += len(line) + (len(sep) if current else 0)
+        current.append(i)
+    if current:
+        groups.append(current)
+
+    chunks = []
+    for n, group in enumerate(groups, 1):
+        head = f"{header} ({n}/{len(groups)})" if len(groups) > 1 and header else header
+        parts = [head] if head else []
+        parts.append(sep.join(lines[i] for i in group))
+        if footer:
+            parts.append(footer)
+        chunks.append((sep.join(parts), group))
+    return chunks
+
+
+class Notifier:
+    """Posts messages to a Slack-style webhook; without a url it only prints them.
+
+    Messages are also printed unless `echo` is off. `retries` counts
+    retried requests across all posts.
+    """
+
+    def __init__(
+        self,
+        url: str | None = None,
+        timeout: float = TIMEOUT,
+        retries: int = RETRIES,
+        backoff: float = BACKOFF,
+        min_interval: float = MIN_INTERVAL,
+        max_chars: int = MAX_CHARS,
+        echo: bool = True,
+    ):
+        self.url = url if url is not None else os.getenv("SLACK_WEBHOOK_URL")
+        self.timeout = timeout
+        self.min_interval = min_interval
+        self.max_chars = max_chars
+        self.echo = echo
+        self.sent = self.failed = self.retries = 0
+        self._next_post = 0.0
+        self.session = requests.Session()
+        # a POST that timed out reading the reply may already have been
+        # delivered, so only connect errors and retryable statuses are retried
+        retry = Retry(
+            total=retries,
+            read=0,
+            other=0,
+            backoff_factor=backoff,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset({"POST"}),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.session.close()
+
+    def _wait_turn(self):
+        now = time.monotonic()
+        if self._next_post > now:
+            time.sleep(self._next_post - now)
+        self._next_post = time.monotonic() + self.min_interval
+
+    def post(self, text: str) -> bool:
+        """Post one message; True once the webhook has accepted it."""
+        if self.echo:
+            print(text)
+        if not self.url:
+            return False
+        self._wait_turn()
+        try:
+            r = self.session.post(self.url, json={"text": text}, timeout=self.timeout)
+        except requests.RequestException as e:
+            self.failed += 1
+            print("Slack post failed:", e)
+            return False
+        if r.raw.retries is not None:
+            self.retries += len(r.raw.retries.history)
+        if r.status_code >= 300:
+            self.failed += 1
+            print(f"Slack post failed: HTTP {r.status_code} {r.text[:200]}")
+            return False
+        self.sent += 1
+        return True
+
+    def send(self, lines: list[str], header: str = "", footer: str = "", sep: str = "\n") -> list[int]:
+        """Post `lines` in size-bounded messages; returns the indices of the
+        lines whose message was delivered."""
+        delivered = []
+        for text, group in chunk_lines(lines, header, footer, self.max_chars, sep):
+            if self.post(text):
+                delivered.extend(group)
+        return delivered
@@ -0,0 +1,157 @@
+"""Monthly range partitioning, retention and daily downsampling for price_history.
+
+Partitioning is opt-in (PRICE_HISTORY_PARTITIONED=1 for init_db/reset.py).
+Run `python -m pipeline.load.partitions` on a schedule to create upcoming
+partitions and roll partitions older than HISTORY_RETENTION_MONTHS into
+price_history_daily before dropping them.
+"""
+
+import os
+from datetime import date
+
+from sqlalchemy import text
+
+MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "2"))
+RETENTION_MONTHS = int(os.getenv("HISTORY_RETENTION_MONTHS", "12"))
+
+# Mirrors models.PriceHistory; the primary key must include the partition key.
+PARTITIONED_DDL = [
+    """
+    create table if not exists price_history (
+      id bigserial not null,
+      product_id integer not null references product (product_id),
+      ts_utc timestamptz not null default now(),
+      price_numeric numeric(12, 2),
+      currency text,
+      in_stock_bool boolean,
+      on_sale_bool boolean,
+      source_hash text,
+      primary key (id, ts_utc)
+    ) partition by range (ts_utc)
+    """,
+    "create index if not exists ix_price_history_ts_utc on price_history (ts_utc)",
+    "create index if not exists ix_price_history_product_ts on price_history (product_id, ts_utc)",
+    "create table if not exists price_history_default partition of price_history default",
+]
+
+ROLLUP_SQL = """
+    insert into price_history_daily (
+      product_id, day, min_price, max_price, last_price, currency, last_in_stock, snapshots
+    )
+    select
+      product_id,
+      (ts_utc at time zone 'UTC')::date as day,
+      min(price_numeric),
+      max(price_numeric),
+      (array_agg(price_numeric order by ts_utc desc))[1],
+      (array_agg(currency order by ts_utc desc))[1],
+      (array_agg(in_stock_bool order by ts_utc desc))[1],
+      count(*)
+    from {partition}
+    group by 1, 2
+    on conflict (product_id, day) do update set
+      min_price = least(price_history_daily.min_price, excluded.min_price),
+      max_price = greatest(price_history_daily.max_price, excluded.max_price),
+      last_price = excluded.last_price,
+      currency = excluded.currency,
+      last_in_stock = excluded.last_in_stock,
+      snapshots = price_history_daily.snapshots + excluded.snapshots
+"""
+
+
+def month_start(d: date, offset: int = 0) -> date:
+    months = d.year * 12 + d.month - 1 + offset
+    return date(months // 12, months % 12 + 1, 1)
+
+
+def partition_name(start: date) -> str:
+    return f"price_history_p{start:%Y_%m}"
+
+
+def is_partitioned(conn) -> bool:
+    return bool(conn.execute(text("""
+        select 1 from pg_partitioned_table pt
+        join pg_class c on c.oid = pt.partrelid
+        where c.relname = 'price_history' and c.relnamespace = 'public'::regnamespace
+    """)).first())
+
+
+def create_partitioned_price_history(conn, months_back: int = 1):
+    """Create price_history as a partitioned table (product must already exist)."""
+    for stmt in PARTITIONED_DDL:
+        conn.execute(text(stmt))
+    ensure_partitions(conn, months_back=months_back)
+
+
+def ensure_partitions(conn, months_ahead: int = MONTHS_AHEAD, months_back: int = 0, today: date | None = None):
+    """Create monthly partitions from `months_back` ago to `months_ahead` ahead.
+
+    A no-op when price_history is a plain table, so ingest can call it
+    every run.
+    """
+    if not is_partitioned(conn):
+        return []
+    today = today or date.today()
+    created = []
+    for offset in range(-months_back, months_ahead + 1):
+        start = month_start(today, offset)
+        name = partition_name(start)
+        exists = conn.execute(text("select to_regclass(:n)"), {"n": f"public.{name}"}).scalar()
+        if exists:
+            continue
+        conn.execute(text(f"""
+            create table {name} partition of price_history
+            for values from ('{start.isoformat()}') to ('{month_start(start, 1).isoformat()}')
+        """))
+        created.append(name)
+    return created
+
+
+def monthly_partitions(conn) -> list[tuple[str, date]]:
+    """Return (name, month start) for each monthly partition, oldest first."""
+    rows = conn.execute(text("""
+        select c.relname
+        from pg_inherits i
+        join pg_class c on c.oid = i.inhrelid
+        join pg_class p on p.oid = i.inhparent
+        where p.relname = 'price_history' and c.relname like 'price_history_p%'
+        order by c.relname
+    """)).scalars()
+    out = []
+    for name in rows:
+        year, month = name.removeprefix("price_history_p").split("_")
+        out.append((name, date(int(year), int(month), 1)))
+    return out
+
+
+def roll_up_old_partitions(engine, keep_months: int = RETENTION_MONTHS, today: date | None = None):
+    """Downsample partitions older than `keep_months` into price_history_daily and drop them.
+
+    Each partition is handled in its own transaction.
+    """
+    cutoff = month_start(today or date.today(), -keep_months)
+    with engine.connect() as conn:
+        old = [name for name, start in monthly_partitions(conn) if month_start(start, 1) <= cutoff]
+    for name in old:
+        with engine.begin() as conn:
+            conn.execute(text(ROLLUP_SQL.format(partition=name)))
+            conn.execute(text(f"alter table price_history detach partition {name}"))
+            conn.execute(text(f"drop table {name}"))
+        print(f"Rolled up and dropped {name}")
+    return old
+
+
+def main():
+    from pipeline.common.db import engine
+
+    with engine.begin() as conn:
+        if not is_partitioned(conn):
+            print("price_history is not partitioned; nothing to do.")
+            return
+        for name in ensure_partitions(conn):
+            print(f"Created {name}")
+    roll_up_old_partitions(engine)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,433 @@
+"""Compact in-memory price series per product, with vectorised change detection.
+
+`PriceSeriesCache` holds each product's price_history as contiguous NumPy
+arrays: snapshot ids and times (microseconds since the Unix epoch, UTC) as
+int64, prices in cents as float64 (NaN where a snapshot has no price) and
+in_stock as a packed bitmask, about 24 bytes a snapshot. Missing products
+are read in full with one binary COPY; after that a call only reads rows
+past the cache's id watermark. Least recently used products are evicted
+beyond PRICE_CACHE_MB. `read_batch` reads just a window (plus the
+snapshot before it) for one-off jobs like the drop alerts.
+
+The primitives at the bottom (`latest`, `previous`, `pct_change`, `drops`,
+`rolling_min`) take a `Batch` of series laid end to end and work on all
+of them with array operations, without a Python loop per product.
+
+The watermark trails rows younger than PRICE_CACHE_LAG_SECONDS, so a
+transaction that commits a lower id late is still picked up; rows read
+twice are skipped by id. Snapshots rewritten in place (see
+`pipeline.ingest.replay`) or rolled up and dropped (`pipeline.load.partitions`)
+show up only after `invalidate()`.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from sqlalchemy import text
+
+CACHE_MB = float(os.getenv("PRICE_CACHE_MB", "256"))
+LAG_SECONDS = int(os.getenv("PRICE_CACHE_LAG_SECONDS", "300"))
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+US_PER_SECOND = 1_000_000
+# Binary COPY sends timestamptz as microseconds since 2000-01-01.
+PG_EPOCH_US = 946_684_800 * US_PER_SECOND
+
+# Every column is fixed-width and never null, so the COPY output is an
+# array of these records between a 19-byte header and a 2-byte trailer.
+COPY_SQL = """
+    copy (
+      select id, product_id, ts_utc,
+             coalesce(price_numeric * 100, 'NaN')::float8,
+             coalesce(in_stock_bool, false),
+             coalesce(currency, '')::char(3)
+      from ({rows}) h
+      order by product_id, ts_utc, id
+    ) to stdout (format binary)
+"""
+AFTER_ROWS_SQL = """
+    select * from public.price_history
+    where product_id = any(%(pids)s) and id > %(after)s
+"""
+# Snapshots after :since plus, per product with any, the last priced one at
+# or before it (an index probe on (product_id, ts_utc)), so a drop at the
+# start of the window still has its previous price. A null :pids means
+# every product.
+SINCE_ROWS_SQL = """
+    with recent as (
+      select * from public.price_history
+      where ts_utc > %(since)s
+        and (%(pids)s::int[] is null or product_id = any(%(pids)s::int[]))
+    )
+    select * from recent
+    union all
+    select b.*
+    from (select distinct product_id from recent) r
+    cross join lateral (
+      select * from public.price_history ph
+      where ph.product_id = r.product_id
+        and ph.ts_utc <= %(since)s
+        and ph.price_numeric is not null
+      order by ph.ts_utc desc
+      limit 1
+    ) b
+"""
+_FIELDS = 6
+_ROW = np.dtype([
+    ("fields", ">i2"),
+    ("id_len", ">i4"), ("id", ">i8"),
+    ("product_id_len", ">i4"), ("product_id", ">i4"),
+    ("ts_len", ">i4"), ("ts", ">i8"),
+    ("cents_len", ">i4"), ("cents", ">f8"),
+    ("in_stock_len", ">i4"), ("in_stock", "u1"),
+    ("currency_len", ">i4"), ("currency", "S3"),
+])
+_HEADER, _TRAILER = 19, 2
+
+# Highest id whose rows all belong to committed transactions (as in export_parquet).
+UPPER_SQL = """
+    select coalesce(max(id), 0) from public.price_history
+    where ts_utc < now() - make_interval(secs => :lag)
+"""
+
+
+def to_us(ts: datetime) -> int:
+    """Microseconds since the Unix epoch for an aware datetime, exactly."""
+    return (ts - EPOCH) // timedelta(microseconds=1)
+
+
+@dataclass(frozen=True, slots=True)
+class PriceSeries:
+    """One product's snapshots in time order; `currency` is the latest one's."""
+    product_id: int
+    ids: np.ndarray
+    ts: np.ndarray
+    cents: np.ndarray
+    stock_bits: np.ndarray
+    currency: str | None = None
+
+    @classmethod
+    def empty(cls, product_id: int) -> "PriceSeries":
+        none = np.empty(0, np.int64)
+        return cls(product_id, none, none, np.empty(0), np.empty(0, np.uint8))
+
+    def __len__(self) -> int:
+        return len(self.ts)
+
+    @property
+    def in_stock(self) -> np.ndarray:
+        return np.unpackbits(self.stock_bits, count=len(self), bitorder="little").astype(bool)
+
+    @property
+    def nbytes(self) -> int:
+        return self.ids.nbytes + self.ts.nbytes + self.cents.nbytes + self.stock_bits.nbytes
+
+    def merge(self, other: "PriceSeries") -> "PriceSeries":
+        """This series plus the snapshots of `other` it doesn't hold yet."""
+        if not len(other):
+            return self
+        new = ~np.isin(other.ids, self.ids[self.ids >= other.ids.min()])
+        if not new.any():
+            return self
+        ids = np.concatenate([self.ids, other.ids[new]])
+        ts = np.concatenate([self.ts, other.ts[new]])
+        cents = np.concatenate([self.cents, other.cents[new]])
+        stock = np.concatenate([self.in_stock, other.in_stock[new]])
+        currency = self.currency
+        if not len(self) or other.ts[new][-1] >= self.ts[-1]:
+            currency = other.currency
+        if len(self) and other.ts[new][0] < self.ts[-1]:
+            order = np.lexsort((ids, ts))
+            ids, ts, cents, stock = ids[order], ts[order], cents[order], stock[order]
+        return PriceSeries(self.product_id, ids, ts, cents, np.packbits(stock, bitorder="little"), currency)
+
+
+def _copy_rows(conn, rows_sql: str, params: dict) -> np.ndarray:
+    """Run COPY_SQL over `rows_sql` and view the output as `_ROW` records."""
+    with conn.connection.driver_connection.cursor() as cur:
+        with cur.copy(COPY_SQL.format(rows=rows_sql), params) as copy:
+            data = b"".join(copy)
+    count, rest = divmod(len(data) - _HEADER - _TRAILER, _ROW.itemsize)
+    rows = np.frombuffer(data, _ROW, count=count, offset=_HEADER)
+    if rest or (rows["fields"] != _FIELDS).any() or (rows["currency_len"] != 3).any():
+        raise ValueError("price_history COPY rows are not in the expected fixed-width layout")
+    return rows
+
+def _product_starts(pids: np.ndarray) -> np.ndarray:
+    """Index of each product's first row in rows sorted by product."""
+    return np.flatnonzero(np.r_[True, pids[1:] != pids[:-1]]) if len(pids) else np.empty(0, np.int64)
+
+def read_series(conn, product_ids, after: int = 0) -> dict[int, PriceSeries]:
+    """Snapshots with id > `after` of `product_ids`, by product (products without any are left out)."""
+    rows = _copy_rows(conn, AFTER_ROWS_SQL, {"pids": [int(p) for p in product_ids], "after": after})
+    pids = rows["product_id"].astype(np.int64)
+    ids = rows["id"].astype(np.int64)
+    ts = rows["ts"].astype(np.int64) + PG_EPOCH_US
+    cents = rows["cents"].astype(np.float64)
+    stock = rows["in_stock"].astype(bool)
+    starts = _product_starts(pids)
+    ends = np.r_[starts[1:], len(rows)]
+    return {
+        int(pids[a]): PriceSeries(
+            int(pids[a]), ids[a:b].copy(), ts[a:b].copy(), cents[a:b].copy(),
+            np.packbits(stock[a:b], bitorder="little"),
+            rows["currency"][b - 1].decode().strip() or None,
+        )
+        for a, b in zip(starts, ends)
+    }
+
+
+class PriceSeriesCache:
+    """LRU cache of `PriceSeries` by product, kept current from an id watermark.
+
+    Thread-safe; loads happen under one lock, so concurrent callers share
+    them instead of reading the same rows twice.
+    """
+
+    def __init__(self, max_mb: float = CACHE_MB, lag: int = LAG_SECONDS):
+        self.max_bytes = int(max_mb * 2**20)
+        self.lag = lag
+        # rows with id <= watermark are held for every cached product
+        self.watermark: int | None = None
+        self.refreshed = 0.0
+        self.hits = self.misses = self.evictions = 0
+        self._series: OrderedDict[int, PriceSeries] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._series)
+
+    @property
+    def nbytes(self) -> int:
+        return self._bytes
+
+    def get(self, conn, product_ids, max_age: float = 0) -> list[PriceSeries]:
+        """Series for `product_ids`, in order. Cached products are brought up
+        to date first unless they were less than `max_age` seconds ago."""
+        product_ids = [int(p) for p in product_ids]
+        with self._lock:
+            if self._series and time.monotonic() - self.refreshed >= max_age:
+                self._refresh(conn)
+            missing = [p for p in dict.fromkeys(product_ids) if p not in self._series]
+            self.misses += len(missing)
+            self.hits += len(product_ids) - len(missing)
+            if missing:
+                if not self._series:
+                    self.watermark = self._upper(conn)
+                    self.refreshed = time.monotonic()
+                loaded = read_series(conn, missing)
+                for p in missing:
+                    self._store(loaded.get(p) or PriceSeries.empty(p))
+            for p in product_ids:
+                self._series.move_to_end(p)
+            result = [self._series[p] for p in product_ids]
+            self._evict()
+            return result
+
+    def invalidate(self, product_ids=None):
+        """Forget `product_ids` (default: everything) so they are read again in full."""
+        with self._lock:
+            for p in list(self._series) if product_ids is None else product_ids:
+                s = self._series.pop(int(p), None)
+                if s is not None:
+                    self._bytes -= s.nbytes
+            if not self._series:
+                self.watermark = None
+
+    def _upper(self, conn) -> int:
+        return conn.execute(text(UPPER_SQL), {"lag": self.lag}).scalar()
+
+    def _refresh(self, conn):
+        upper = self._upper(conn)
+        for p, s in read_series(conn, self._series, after=self.watermark).items():
+            self._store(self._series[p].merge(s))
+        self.watermark = max(self.watermark, upper)
+        self.refreshed = time.monotonic()
+
+    def _store(self, series: PriceSeries):
+        old = self._series.get(series.product_id)
+        if old is not None:
+            self._bytes -= old.nbytes
+        self._series[series.product_id] = series
+        self._bytes += series.nbytes
+
+    def _evict(self):
+        # Requested series are the most recent, so they go last; a request
+        # larger than the budget is returned to the caller but not kept.
+        while self._bytes > self.max_bytes:
+            _, s = self._series.popitem(last=False)
+            self._bytes -= s.nbytes
+            self.evictions += 1
+        if not self._series:
+            self.watermark = None
+
+
+_shared: PriceSeriesCache | None = None
+_shared_lock = threading.Lock()
+
+def shared_cache() -> PriceSeriesCache:
+    """The process-wide cache, e.g. one per dashboard server."""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = PriceSeriesCache()
+        return _shared
+
+
+@dataclass(frozen=True)
+class Batch:
+    """Series laid end to end: points offsets[i]:offsets[i + 1] belong to product_ids[i]."""
+    product_ids: np.ndarray
+    offsets: np.ndarray
+    ts: np.ndarray
+    cents: np.ndarray
+    in_stock: np.ndarray
+
+    @classmethod
+    def of(cls, series) -> "Batch":
+        series = list(series)
+        offsets = np.zeros(len(series) + 1, np.int64)
+        np.cumsum([len(s) for s in series], out=offsets[1:])
+
+        def cat(arrays, dtype):
+            return np.concatenate(arrays) if arrays else np.empty(0, dtype)
+
+        return cls(
+            np.array([s.product_id for s in series], np.int64),
+            offsets,
+            cat([s.ts for s in series], np.int64),
+            cat([s.cents for s in series], np.float64),
+            cat([s.in_stock for s in series], bool),
+        )
+
+    def __len__(self) -> int:
+        return len(self.product_ids)
+
+    @property
+    def starts(self) -> np.ndarray:
+        return self.offsets[:-1]
+
+    @property
+    def lengths(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    def segments(self) -> np.ndarray:
+        """Index of the series each point belongs to."""
+        return np.repeat(np.arange(len(self)), self.lengths)
+
+
+def read_batch(conn, since: datetime, product_ids=None) -> Batch:
+    """Snapshots after `since` of every product with any (or of those among
+    `product_ids`), plus each one's last priced snapshot at or before it,
+    as one `Batch` built without a Python step per product. Enough for
+    `drops(batch, to_us(since))`; not a full history, so not for the cache."""
+    pids = None if product_ids is None else [int(p) for p in product_ids]
+    rows = _copy_rows(conn, SINCE_ROWS_SQL, {"pids": pids, "since": since})
+    products = rows["product_id"].astype(np.int64)
+    starts = _product_starts(products)
+    return Batch(
+        products[starts],
+        np.r_[starts, len(rows)].astype(np.int64),
+        rows["ts"].astype(np.int64) + PG_EPOCH_US,
+        rows["cents"].astype(np.float64),
+        rows["in_stock"].astype(bool),
+    )
+
+
+def latest(batch: Batch) -> dict[str, np.ndarray]:
+    """Each series' last snapshot; ts -1 and NaN cents for an empty series."""
+    filled = np.flatnonzero(batch.lengths > 0)
+    last = batch.offsets[1:][filled] - 1
+    ts = np.full(len(batch), -1, np.int64)
+    cents = np.full(len(batch), np.nan)
+    in_stock = np.zeros(len(batch), bool)
+    ts[filled], cents[filled], in_stock[filled] = batch.ts[last], batch.cents[last], batch.in_stock[last]
+    return {"product_id": batch.product_ids, "ts": ts, "cents": cents, "in_stock": in_stock}
+
+def previous(batch: Batch) -> dict[str, np.ndarray]:
+    """Each series' price before its last price change and when that change
+    happened, like product_latest_price's prev_price and price_changed_utc.
+    A series whose price never changed gets NaN and its first snapshot's time."""
+    c = batch.cents
+    changed = np.zeros(len(c), bool)
+    changed[1:] = ~((c[1:] == c[:-1]) | (np.isnan(c[1:]) & np.isnan(c[:-1])))
+    changed[batch.starts[batch.lengths > 0]] = False
+    # position of the latest change at or before each point
+    at = np.maximum.accumulate(np.where(changed, np.arange(len(c)), -1)) if len(c) else c.astype(np.int64)
+
+    filled = np.flatnonzero(batch.lengths > 0)
+    j = at[batch.offsets[1:][filled] - 1]
+    moved = j >= batch.starts[filled]
+    cents = np.full(len(batch), np.nan)
+    changed_ts = np.full(len(batch), -1, np.int64)
+    changed_ts[filled] = batch.ts[batch.starts[filled]]
+    cents[filled[moved]] = c[j[moved] - 1]
+    changed_ts[filled[moved]] = batch.ts[j[moved]]
+    return {"product_id": batch.product_ids, "cents": cents, "changed_ts": changed_ts}
+
+def pct_change(old, new) -> np.ndarray:
+    """100 * (new - old) / old; NaN where old is 0 or missing."""
+    old, new = np.asarray(old, np.float64), np.asarray(new, np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pct = 100.0 * (new - old) / old
+    return np.where(old == 0, np.nan, pct)
+
+def round_pct(pct: np.ndarray) -> np.ndarray:
+    """Round non-negative percentages to two decimals, halves up like Postgres
+    numeric round(); the epsilon keeps e.g. 12.345 computed as 12.34499... up."""
+    return np.floor(pct * 100 + 0.5 + 1e-9) / 100
+
+def drops(batch: Batch, since_us: int, min_pct: float = 0.0) -> dict[str, np.ndarray]:
+    """Snapshots after `since_us` priced below the series' previous priced
+    snapshot (unpriced snapshots are skipped) by a drop_pct, rounded to two
+    decimals, of at least `min_pct`; newest first."""
+    priced = ~np.isnan(batch.cents)
+    seg, ts, c = batch.segments()[priced], batch.ts[priced], batch.cents[priced]
+    pct = round_pct(-pct_change(c[:-1], c[1:]))
+    hit = (seg[1:] == seg[:-1]) & (c[1:] < c[:-1]) & (ts[1:] > since_us) & (pct >= min_pct)
+    i = np.flatnonzero(hit) + 1
+    i = i[np.argsort(-ts[i], kind="stable")]
+    return {
+        "product_id": batch.product_ids[seg[i]],
+        "ts": ts[i],
+        "prev_cents": c[i - 1],
+        "new_cents": c[i],
+        "drop_pct": pct[i - 1],
+    }
+
+def rolling_min(batch: Batch, window_us: int) -> np.ndarray:
+    """For every point, the lowest price in its series over (ts - window_us, ts];
+    NaN where that window has no priced snapshot."""
+    n = len(batch.ts)
+    if not n:
+        return np.empty(0)
+    seg = batch.segments()
+    # First point of each window: count the points sorting before the query
+    # ts - window_us in (series, time) order, points ahead of equal queries.
+    keys = np.concatenate([batch.ts, batch.ts - window_us])
+    is_query = np.r_[np.zeros(n, bool), np.ones(n, bool)]
+    order = np.lexsort((is_query, keys, np.r_[seg, seg]))
+    points_before = np.cumsum(~is_query[order])
+    left = np.empty(n, np.int64)
+    left[order[is_query[order]] - n] = points_before[is_query[order]]
+
+    # Range minimum by doubling: at level k, level[j] = min(prices[j : j + 2**k]),
+    # and a window of length L is covered by two blocks of 2**floor(log2(L)).
+    right = np.arange(n)
+    k = np.floor(np.log2(right - left + 1)).astype(np.int64)
+    level = np.where(np.isnan(batch.cents), np.inf, batch.cents)
+    out = np.empty(n)
+    width = 1
+    for lvl in range(int(k.max()) + 1):
+        q = np.flatnonzero(k == lvl)
+        out[q] = np.minimum(level[left[q]], level[right[q] - width + 1])
+        level = np.minimum(level[:-width], level[width:])
+        width *= 2
+    out[np.isinf(out)] = np.nan
+    return out
@@ -1,47 +1,59 @@
-"""Generate a short summary of latest price snapshots."""
+"""Generate a short summary of latest price snapshots.
 
-import os
-import pandas as pd
-from sqlalchemy import create_engine, text
-import json
-import requests
+A price that changed in the past 24h is followed by its change from the
+previous price.
+"""
+
+from typing import TYPE_CHECKING
+
+from sqlalchemy import text
+
+from pipeline.common import db
+from pipeline.load.notify import Notifier, money
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+RULE = "_______________________________"
+
+def change_notes(df: "pd.DataFrame") -> "pd.Series":
+    # imported here so importing this module (or the CLI) stays cheap
+    import pandas as pd
+    from pipeline.load.price_series import pct_change
+
+    pct = pd.Series(pct_change(df["prev_price"], df["price"]), index=df.index)
+    recent = df["changed_recently"].fillna(False).astype(bool) & pct.notna()
+    return ("(" + pct.map("{:+.2f}".format) + "%)").where(recent, "")
+
+def summary_lines(df: "pd.DataFrame") -> list[str]:
+    return (
+        df["site"] + " – " + df["name"].fillna("") + ": "
+        + money(df["price"]) + " " + df["currency"].fillna("") + " " + change_notes(df)
+    ).str.rstrip().tolist()
 
 def main():
-    db_url = os.getenv("DATABASE_URL")
-    engine = create_engine(db_url, future=True)
+    import pandas as pd
 
-    with engine.connect() as conn:
+    with db.engine.connect() as conn:
         df = pd.read_sql(
             text("""
-                select p.name, p.site, ph.price_numeric as price, ph.currency, ph.ts_utc
-                from public.price_history ph
-                join public.product p on p.product_id = ph.product_id
-                where ph.ts_utc > now() - interval '1 day'
-                order by ph.ts_utc desc
+                select p.name, p.site, l.last_price as price, l.currency, l.last_seen_utc as ts_utc,
+                       l.prev_price, l.price_changed_utc > now() - interval '1 day' as changed_recently
+                from public.product_latest_price l
+                join public.product p on p.product_id = l.product_id
+                where l.last_seen_utc > now() - interval '1 day'
+                order by p.site, p.name
             """),
             conn,
         )
 
-    if df.empty:
-        msg = "No new price snapshots in the past 24h."
-    else:
-        latest = (
-            df.groupby(["site", "name"])
-            .agg({"price": "last", "currency": "last"})
-            .reset_index()
-        )
-        lines = [f"{row.site} – {row.name}: {row.price:.2f} {row.currency}" for _, row in latest.iterrows()]
-        msg = "_______________________________" + "\n" + "\n*LATEST PRICE SUMMARY:*\n" + "\n".join(lines) + "\n_______________________________"
-
-    print(msg)
-
-    slack_url = os.getenv("SLACK_WEBHOOK_URL")
-    if slack_url:
-        try:
-            requests.post(slack_url, data=json.dumps({"text": msg}), headers={"Content-Type": "application/json"})
-            print("Posted summary to Slack.")
-        except Exception as e:
-            print("Slack post failed:", e)
+    with Notifier() as notifier:
+        if df.empty:
+            notifier.post("No new price snapshots in the past 24h.")
+        else:
+            notifier.send(summary_lines(df), header=RULE + "\n\n*LATEST PRICE SUMMARY:*", footer=RULE)
+    if notifier.sent:
+        print(f"Posted summary to Slack in {notifier.sent} messages.")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,63 @@
+"""Adaptive crawl schedule kept in crawl_state.interval_seconds / next_due_utc.
+
+After every fetch a product's interval is
+- halved (down to CRAWL_MIN_INTERVAL_HOURS) if its price or stock changed
+  since the previous check,
+- kept while its last change is within CRAWL_VOLATILE_DAYS,
+- otherwise multiplied by CRAWL_BACKOFF (up to CRAWL_MAX_INTERVAL_HOURS).
+
+Changes come from product_latest_price, which the writer updates just
+before crawl_state, so the schedule reacts in the same transaction as the
+snapshot that showed the drop or restock.
+"""
+
+import os
+from datetime import timedelta
+
+from sqlalchemy import Integer, case, cast, func, literal_column, or_, select
+
+from pipeline.common.models import CrawlState, Product, ProductLatestPrice as L
+
+MIN_INTERVAL = int(float(os.getenv("CRAWL_MIN_INTERVAL_HOURS", "1")) * 3600)
+BASE_INTERVAL = int(float(os.getenv("CRAWL_BASE_INTERVAL_HOURS", "6")) * 3600)
+MAX_INTERVAL = int(float(os.getenv("CRAWL_MAX_INTERVAL_HOURS", "72")) * 3600)
+BACKOFF = float(os.getenv("CRAWL_BACKOFF", "2"))
+VOLATILE_WINDOW = timedelta(days=float(os.getenv("CRAWL_VOLATILE_DAYS", "7")))
+# Most fetches per site in one run; the most overdue products go first.
+DEFAULT_SITE_BUDGET = int(os.getenv("CRAWL_SITE_BUDGET", "1000"))
+
+
+def next_interval():
+    """Interval expression for the crawl_state upsert's ON CONFLICT branch,
+    where CrawlState columns still hold the previous check."""
+    current = func.coalesce(CrawlState.interval_seconds, BASE_INTERVAL)
+    last_change = (
+        select(func.greatest(L.price_changed_utc, L.stock_changed_utc))
+        .where(L.product_id == literal_column("excluded.product_id"))
+        .scalar_subquery()
+    )
+    return case(
+        (last_change > CrawlState.last_checked_utc, func.greatest(MIN_INTERVAL, current // 2)),
+        (last_change > func.now() - VOLATILE_WINDOW, current),
+        else_=func.least(MAX_INTERVAL, cast(current * BACKOFF, Integer)),
+    )
+
+
+def due_after(seconds):
+    return func.now() + func.make_interval(0, 0, 0, 0, 0, 0, seconds)
+
+
+def is_due():
+    return or_(CrawlState.next_due_utc.is_(None), CrawlState.next_due_utc <= func.now())
+
+
+def site_rank():
+    """Rank of a product within its site, most overdue (or never crawled) first."""
+    return func.row_number().over(
+        partition_by=Product.site,
+        order_by=(CrawlState.next_due_utc.asc().nulls_first(), Product.product_id),
+    )
+
+
+def site_budget(site_col, budgets: dict[str, int]):
+    return case(budgets, value=site_col, else_=DEFAULT_SITE_BUDGET) if budgets else DEFAULT_SITE_BUDGET
@@ -2,7 +2,7 @@
 
 from sqlalchemy import select
 from sqlalchemy.orm import Session
-from pipeline.common.db import SessionLocal
+from pipeline.common import db
 from pipeline.common.models import Product
 
 SEED = [
@@ -13,6 +13,15 @@ SEED = [
     ("webscraper.io", "https://webscraper.io/test-sites/e-commerce/allinone/product/3", "Samsung Galaxy Gold")
 ]
 
+# Category pages crawled by `python -m pipeline.ingest.discover`; every
+# product listed on them (and on their following pages) is tracked.
+CATEGORIES = [
+    "https://books.toscrape.com/catalogue/category/books_1/index.html",
+    "https://webscraper.io/test-sites/e-commerce/allinone/computers/laptops",
+    "https://webscraper.io/test-sites/e-commerce/allinone/computers/tablets",
+    "https://webscraper.io/test-sites/e-commerce/allinone/phones/touch",
+]
+
 def upsert_product(session: Session, site: str, url: str, name: str | None):
     exists = session.execute(select(Product).where(Product.site == site, Product.url == url)).scalar_one_or_none()
     if exists:
@@ -20,7 +29,7 @@ def upsert_product(session: Session, site: str, url: str, name: str | None):
     session.add(Product(site=site, url=url, name=name))
 
 def main():
-    with SessionLocal() as s:
+    with db.SessionLocal() as s:
         for site, url, name in SEED:
             upsert_product(s, site, url, name)
         s.commit()
@@ -1,11 +1,11 @@
 """Test database connectivity to Neon/Postgres."""
 
 from sqlalchemy import text
-from pipeline.common.db import engine
+from pipeline.common import db
 
 def main():
     try:
-        with engine.connect() as conn:
+        with db.engine.connect() as conn:
             result = conn.execute(text("SELECT version();"))
             version = result.scalar_one()
             print(f"Connected to database successfully.")
@@ -1,9 +1,24 @@
 """Handles upserting products and writing price snapshots to the database."""
 
-from sqlalchemy import select
+import os
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import delete, select, insert, func, case, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.orm import Session
-from pipeline.common.db import SessionLocal
-from pipeline.common.models import Product, PriceHistory
+from pipeline.common import db
+from pipeline.common.models import Product, PriceHistory, CrawlState, FetchDeadLetter
+from pipeline.load.archive import archive_insert
+from pipeline.load.dead_letter import FetchFailure, dead_letter_upsert
+from pipeline.load.latest_price import latest_price_upsert
+from pipeline.load.schedule import BASE_INTERVAL, due_after, next_interval
+from pipeline.load.work_queue import release_products
+
+BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "500"))
+# Also flush a partial batch once it is this old, so little finished work
+# is lost (and refetched on resume) if a run dies.
+FLUSH_SECONDS = float(os.getenv("INGEST_FLUSH_SECONDS", "5"))
 
 def get_or_create_product(session: Session, site: str, url: str, name: str | None = None) -> int:
     existing = session.execute(
@@ -25,16 +40,283 @@ def write_price_snapshot(
     on_sale: bool | None,
     source_hash: str | None,
 ):
-    session.add(
-        PriceHistory(
-            product_id=product_id,
-            price_numeric=price,
-            currency=currency,
-            in_stock_bool=in_stock,
-            on_sale_bool=on_sale,
-            source_hash=source_hash,
-        )
+    snapshot = PriceHistory(
+        product_id=product_id,
+        price_numeric=price,
+        currency=currency,
+        in_stock_bool=in_stock,
+        on_sale_bool=on_sale,
+        source_hash=source_hash,
+    )
+    session.add(snapshot)
+    session.flush()
+    session.execute(
+        latest_price_upsert(),
+        [
+            {
+                "product_id": product_id,
+                "price_history_id": snapshot.id,
+                "last_price": price,
+                "currency": currency,
+                "in_stock_bool": in_stock,
+                "last_seen_utc": snapshot.ts_utc,
+                "price_changed_utc": snapshot.ts_utc,
+            }
+        ],
+    )
+
+def _crawl_state_upsert():
+    stmt = pg_insert(CrawlState).values(
+        last_checked_utc=func.now(),
+        interval_seconds=BASE_INTERVAL,
+        next_due_utc=due_after(BASE_INTERVAL),
+    )
+    ex = stmt.excluded
+    interval = next_interval()
+    return stmt.on_conflict_do_update(
+        index_elements=[CrawlState.product_id],
+        set_={
+            "etag": func.coalesce(ex.etag, CrawlState.etag),
+            "last_modified": func.coalesce(ex.last_modified, CrawlState.last_modified),
+            "last_hash": func.coalesce(ex.last_hash, CrawlState.last_hash),
+            "last_checked_utc": ex.last_checked_utc,
+            "last_changed_utc": func.coalesce(ex.last_changed_utc, CrawlState.last_changed_utc),
+            "unchanged_runs": case(
+                (ex.unchanged_runs == 0, 0), else_=CrawlState.unchanged_runs + 1
+            ),
+            "lease_owner": None,
+            "lease_expires_utc": None,
+            "interval_seconds": interval,
+            "next_due_utc": due_after(interval),
+        },
+    )
+
+def crawl_state_row(
+    product_id: int,
+    changed: bool,
+    etag: str | None = None,
+    last_modified: str | None = None,
+    body_hash: str | None = None,
+) -> dict:
+    return {
+        "product_id": product_id,
+        "etag": etag,
+        "last_modified": last_modified,
+        "last_hash": body_hash,
+        "last_changed_utc": datetime.now(timezone.utc) if changed else None,
+        "unchanged_runs": 0 if changed else 1,
+    }
+
+def touch_crawl_state(
+    session: Session,
+    product_id: int,
+    changed: bool,
+    etag: str | None = None,
+    last_modified: str | None = None,
+    body_hash: str | None = None,
+):
+    """Record a fetch of `product_id`; unchanged pages only bump the heartbeat."""
+    session.execute(
+        _crawl_state_upsert(),
+        [crawl_state_row(product_id, changed, etag, last_modified, body_hash)],
+    )
+
+def resolve_product_ids(session: Session, products) -> dict[tuple[str, str], int]:
+    """Map `(site, url, name)` triples to product ids, inserting unknown ones.
+
+    One `INSERT ... ON CONFLICT DO NOTHING RETURNING` covers new rows; rows
+    that already existed (or were inserted concurrently) are read back in a
+    single SELECT.
+    """
+    rows = {(site, url): name for site, url, name in products}
+    if not rows:
+        return {}
+    stmt = (
+        pg_insert(Product)
+        .values([{"site": s, "url": u, "name": n} for (s, u), n in rows.items()])
+        .on_conflict_do_nothing(index_elements=[Product.site, Product.url])
+        .returning(Product.site, Product.url, Product.product_id)
     )
+    ids = {(s, u): pid for s, u, pid in session.execute(stmt)}
+    missing = [key for key in rows if key not in ids]
+    if missing:
+        found = session.execute(
+            select(Product.site, Product.url, Product.product_id).where(
+                tuple_(Product.site, Product.url).in_(missing)
+            )
+        )
+        ids.update({(s, u): pid for s, u, pid in found})
+    return ids
+
+class SnapshotWriter:
+    """Buffer parsed records and write them in batches.
+
+    Product ids come from a site/url map preloaded once, with unknown
+    products resolved per batch by `resolve_product_ids`. Snapshots, their
+    product_latest_price upserts and crawl-state heartbeats are written
+    with executemany in one transaction per batch, so memory stays flat
+    however many products a run covers. A batch is also flushed once it is
+    `flush_seconds` old, and whatever is buffered is still committed when
+    the run fails elsewhere. Archived page bodies go into page_archive in
+    the same transaction as the snapshots that reference them.
+
+    Failed fetches go to fetch_dead_letter (see `pipeline.load.dead_letter`)
+    in the same batches; a queued url is cleared when its product gets a
+    crawl-state row or `fetched(url)` is called for it. With `lease_owner`,
+    a failed product's lease is released in the same batch.
+    """
+
+    def __init__(
+        self,
+        session: Session,
+        batch_size: int = BATCH_SIZE,
+        flush_seconds: float = FLUSH_SECONDS,
+        lease_owner: str | None = None,
+    ):
+        self.session = session
+        self.lease_owner = lease_owner
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.written = 0
+        self._last_flush = time.monotonic()
+        self._ids = {
+            (s, u): pid
+            for s, u, pid in session.execute(select(Product.site, Product.url, Product.product_id))
+        }
+        self._snapshots: list[dict] = []
+        self._states: list[dict] = []
+        self._pages: dict[str, dict] = {}
+        self.failed = 0
+        self.touched = 0
+        self._dead = dict(session.execute(select(FetchDeadLetter.url, FetchDeadLetter.product_id)).all())
+        self._failures: dict[str, dict] = {}
+        self._resolved: set[str] = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.flush()
+            return
+        try:
+            self.flush()
+        except Exception:
+            self.session.rollback()
+
+    def add(self, parsed: dict, source_hash: str | None, state: dict | None = None):
+        """Buffer a snapshot; a `state` row without a product_id gets the
+        id `parsed` resolves to (for products found on listing pages)."""
+        self._snapshots.append({**parsed, "source_hash": source_hash})
+        if state:
+            if state["product_id"] is None:
+                state = {**state, "_key": (parsed["site"], parsed["url"])}
+            self._states.append(state)
+        self._maybe_flush()
+
+    def archive(self, page: dict):
+        """Buffer a page_archive row (see `pipeline.load.archive.archive_row`)."""
+        self._pages.setdefault(page["sha256"], page)
+
+    def touch(self, state: dict):
+        self._states.append(state)
+        self.touched += 1
+        self._maybe_flush()
+
+    @property
+    def dead_letters(self) -> int:
+        """Urls queued in fetch_dead_letter (as of the last flush)."""
+        return len(self._dead)
+
+    def fail(self, failure: FetchFailure):
+        self._failures[failure.url] = failure.row()
+        self.failed += 1
+        self._maybe_flush()
+
+    def fetched(self, url: str):
+        """Note a successful fetch of `url`, clearing its dead letter if it has one."""
+        if url in self._dead:
+            self._resolved.add(url)
+
+    def _maybe_flush(self):
+        if (
+            len(self._snapshots) + len(self._states) + len(self._failures) >= self.batch_size
+            or time.monotonic() - self._last_flush >= self.flush_seconds
+        ):
+            self.flush()
+
+    def flush(self):
+        self._last_flush = time.monotonic()
+        if self._dead:
+            by_product = {pid: url for url, pid in self._dead.items() if pid is not None}
+            self._resolved.update(by_product[s["product_id"]] for s in self._states if s["product_id"] in by_product)
+        if not self._snapshots and not self._states and not self._failures and not self._resolved:
+            return
+        unknown = {
+            (r["site"], r["url"], r["name"])
+            for r in self._snapshots
+            if (r["site"], r["url"]) not in self._ids
+        }
+        if unknown:
+            self._ids.update(resolve_product_ids(self.session, unknown))
+        if self._pages:
+            self.session.execute(archive_insert(), list(self._pages.values()))
+
+        if self._snapshots:
+            rows = [
+                {
+                    "product_id": self._ids[(r["site"], r["url"])],
+                    "price_numeric": r["price"],
+                    "currency": r["currency"],
+                    "in_stock_bool": r["in_stock"],
+                    "on_sale_bool": r["on_sale"],
+                    "source_hash": r["source_hash"],
+                }
+                for r in self._snapshots
+            ]
+            inserted = self.session.execute(
+                insert(PriceHistory).returning(
+                    PriceHistory.id, PriceHistory.ts_utc, sort_by_parameter_order=True
+                ),
+                rows,
+            ).all()
+            self.session.execute(
+                latest_price_upsert(),
+                [
+                    {
+                        "product_id": row["product_id"],
+                        "price_history_id": ph_id,
+                        "last_price": row["price_numeric"],
+                        "currency": row["currency"],
+                        "in_stock_bool": row["in_stock_bool"],
+                        "last_seen_utc": ts_utc,
+                        "price_changed_utc": ts_utc,
+                    }
+                    for row, (ph_id, ts_utc) in zip(rows, inserted)
+                ],
+            )
+        if self._states:
+            for state in self._states:
+                if "_key" in state:
+                    state["product_id"] = self._ids[state.pop("_key")]
+            self.session.execute(_crawl_state_upsert(), self._states)
+        if self._resolved:
+            self.session.execute(delete(FetchDeadLetter).where(FetchDeadLetter.url.in_(self._resolved)))
+        if self._failures:
+            self.session.execute(dead_letter_upsert(), list(self._failures.values()))
+            failed_ids = [row["product_id"] for row in self._failures.values() if row["product_id"] is not None]
+            if self.lease_owner and failed_ids:
+                release_products(self.session.connection(), self.lease_owner, failed_ids)
+        self.session.commit()
+        self.written += len(self._snapshots)
+        for url in self._resolved:
+            self._dead.pop(url, None)
+        self._dead.update((url, row["product_id"]) for url, row in self._failures.items())
+        self._snapshots.clear()
+        self._states.clear()
+        self._pages.clear()
+        self._failures.clear()
+        self._resolved.clear()
 
 def main():
     # currently using hardcoded example data
@@ -47,7 +329,7 @@ def main():
     on_sale = False
     source_hash = "example_v1"
 
-    with SessionLocal() as session:
+    with db.SessionLocal() as session:
         pid = get_or_create_product(session, site, url, name)
         write_price_snapshot(session, pid, price, currency, in_stock, on_sale, source_hash)
         session.commit()
@@ -0,0 +1,79 @@
+"""Lease products to ingest workers through crawl_state.
+
+A worker claims a batch with `FOR UPDATE SKIP LOCKED`, so concurrent
+workers never block on or double-claim the same rows. Writing a
+product's crawl-state row (see `upsert._crawl_state_upsert`) releases
+its lease, as does `release_products` for products whose fetch failed
+or that were skipped; a worker that dies leaves leases that expire
+after `LEASE_SECONDS` and are then claimed by someone else.
+"""
+
+import os
+import socket
+
+from sqlalchemy import text
+
+LEASE_SECONDS = int(os.getenv("INGEST_LEASE_SECONDS", "600"))
+LEASE_BATCH = int(os.getenv("INGEST_LEASE_BATCH", "50"))
+
+ENSURE_ROWS_SQL = """
+    insert into crawl_state (product_id, unchanged_runs)
+    select p.product_id, 0 from product p
+    on conflict (product_id) do nothing
+"""
+
+CLAIM_SQL = """
+    with claim as (
+      select cs.product_id
+      from crawl_state cs
+      where (cs.last_checked_utc is null or cs.last_checked_utc < :checked_before)
+        and (cs.lease_expires_utc is null or cs.lease_expires_utc < now())
+        and (not :due or cs.next_due_utc is null or cs.next_due_utc <= now())
+      order by cs.next_due_utc nulls first, cs.product_id
+      limit :batch
+      for update skip locked
+    )
+    update crawl_state cs
+    set lease_owner = :owner,
+        lease_expires_utc = now() + make_interval(secs => :ttl)
+    from claim
+    where cs.product_id = claim.product_id
+    returning cs.product_id
+"""
+
+RELEASE_SQL = """
+    update crawl_state
+    set lease_owner = null,
+        lease_expires_utc = null,
+        last_checked_utc = now()
+    where product_id = any(:ids) and lease_owner = :owner
+"""
+
+
+def worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def ensure_crawl_state_rows(conn):
+    """Give every product a crawl_state row so it can be leased."""
+    conn.execute(text(ENSURE_ROWS_SQL))
+
+
+def claim_products(
+    conn, owner: str, checked_before, batch: int = LEASE_BATCH, ttl: int = LEASE_SECONDS, due: bool = True
+) -> list[int]:
+    """Lease up to `batch` products not checked since `checked_before`
+    (and, with `due`, whose next_due_utc has passed), most overdue first."""
+    return list(conn.execute(
+        text(CLAIM_SQL),
+        {"owner": owner, "checked_before": checked_before, "batch": batch, "ttl": ttl, "due": due},
+    ).scalars())
+
+
+def release_products(conn, owner: str, product_ids):
+    """Give back `owner`'s leases on products that get no crawl-state row.
+
+    They count as checked, so this round doesn't claim them again, but
+    their next_due_utc is untouched and the next round retries them.
+    """
+    conn.execute(text(RELEASE_SQL), {"owner": owner, "ids": list(product_ids)})
@@ -0,0 +1,13 @@
+-- Highest price_history id whose rows all belong to committed transactions.
+-- Snapshots younger than the commit_lag_seconds var (default 300) wait for the
+-- next run, so a writer still in flight (parallel lease or shard workers)
+-- can't commit a lower id behind an incremental model's watermark.
+-- Pass --vars '{commit_lag_seconds: 0}' when nothing else is writing.
+
+{% macro committed_upper_id() %}
+  (
+    select coalesce(max(id), 0)
+    from {{ ref('stg_price_history') }}
+    where ts_utc < now() - make_interval(secs => {{ var('commit_lag_seconds', 300) }})
+  )
+{% endmacro %}
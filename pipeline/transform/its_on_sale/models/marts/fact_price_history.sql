@@ -1,4 +1,17 @@
--- Fact table for price time series
+-- Fact table for price time series, appended incrementally by price_history id
+-- up to committed_upper_id(), so a late-committing lower id isn't skipped
+
+{{
+  config(
+    materialized='incremental',
+    unique_key='id',
+    incremental_strategy='delete+insert',
+    indexes=[
+      {'columns': ['id'], 'unique': True},
+      {'columns': ['product_id', 'ts_utc']},
+    ],
+  )
+}}
 
 select
   ph.id,
@@ -14,3 +27,7 @@ select
 from {{ ref('stg_price_history') }} ph
 join {{ ref('stg_product') }} p
   on p.product_id = ph.product_id
+where ph.id <= {{ committed_upper_id() }}
+{% if is_incremental() %}
+  and ph.id > (select coalesce(max(id), 0) from {{ this }})
+{% endif %}
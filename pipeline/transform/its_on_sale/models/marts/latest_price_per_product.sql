@@ -1,20 +1,49 @@
--- Latest price per product
+-- Latest price per product, merged incrementally from snapshots newer than the watermark
+-- and no newer than committed_upper_id(), so a late-committing lower id isn't skipped
 
-with ranked as (
+{{
+  config(
+    materialized='incremental',
+    unique_key='product_id',
+    incremental_strategy='delete+insert',
+    indexes=[{'columns': ['product_id'], 'unique': True}],
+  )
+}}
+
+with new_rows as (
   select
+    ph.id,
     ph.product_id,
     ph.ts_utc,
     ph.price,
     ph.currency,
-    ph.in_stock,
-    row_number() over (partition by ph.product_id order by ph.ts_utc desc) as rn
+    ph.in_stock
   from {{ ref('stg_price_history') }} ph
+  where ph.id <= {{ committed_upper_id() }}
+  {% if is_incremental() %}
+    and ph.id > (select coalesce(max(price_history_id), 0) from {{ this }})
+  {% endif %}
+),
+ranked as (
+  select
+    n.*,
+    row_number() over (partition by n.product_id order by n.ts_utc desc, n.id desc) as rn
+  from new_rows n
 )
 select
   r.product_id,
+  r.id as price_history_id,
   r.ts_utc as last_seen_utc,
   r.price,
   r.currency,
   r.in_stock
 from ranked r
+{% if is_incremental() %}
+left join {{ this }} cur
+  on cur.product_id = r.product_id
+{% endif %}
 where r.rn = 1
+{% if is_incremental() %}
+  -- a late-arriving snapshot must not replace a newer one
+  and (cur.last_seen_utc is null or r.ts_utc >= cur.last_seen_utc)
+{% endif %}
@@ -1,14 +1,76 @@
--- Price drop/restock events derived from consecutive snapshots
+-- Price drop/restock events derived from consecutive snapshots.
+-- Incremental runs read only snapshots past the last processed id plus the
+-- snapshot just before them per product, so lag() stays correct across batches.
+-- The processed id lives in price_events_watermark, not in the events, so it
+-- advances on runs that emit nothing: the pre-hook pins this run's upper id
+-- (committed_upper_id(), never below processed_id), the model reads
+-- (processed_id, pending_id], and the post-hook moves processed_id up once
+-- the model has been built.
 
-with hist as (
+{{
+  config(
+    materialized='incremental',
+    unique_key='source_id',
+    incremental_strategy='delete+insert',
+    indexes=[
+      {'columns': ['source_id'], 'unique': True},
+      {'columns': ['product_id', 'ts_utc']},
+    ],
+    pre_hook=[
+      "create table if not exists {{ this.schema }}.price_events_watermark (processed_id bigint not null, pending_id bigint not null)",
+      "insert into {{ this.schema }}.price_events_watermark select 0, 0 where not exists (select 1 from {{ this.schema }}.price_events_watermark)",
+      "update {{ this.schema }}.price_events_watermark set pending_id = greatest(processed_id, {{ committed_upper_id() }})",
+    ],
+    post_hook="update {{ this.schema }}.price_events_watermark set processed_id = pending_id",
+  )
+}}
+
+with
+watermark as (
+  select processed_id, pending_id from {{ this.schema }}.price_events_watermark
+),
+{% if is_incremental() %}
+new_rows as (
+  select ph.id, ph.product_id, ph.ts_utc, ph.price, ph.in_stock, false as carried
+  from {{ ref('stg_price_history') }} ph
+  where ph.id > (select processed_id from watermark)
+    and ph.id <= (select pending_id from watermark)
+),
+carried as (
+  select prior.id, prior.product_id, prior.ts_utc, prior.price, prior.in_stock, true as carried
+  from (select distinct product_id from new_rows) n
+  cross join lateral (
+    select ph.id, ph.product_id, ph.ts_utc, ph.price, ph.in_stock
+    from {{ ref('stg_price_history') }} ph
+    where ph.product_id = n.product_id
+      and ph.id <= (select processed_id from watermark)
+    order by ph.ts_utc desc
+    limit 1
+  ) prior
+),
+batch as (
+  select * from new_rows
+  union all
+  select * from carried
+),
+{% else %}
+batch as (
+  select id, product_id, ts_utc, price, in_stock, false as carried
+  from {{ ref('stg_price_history') }}
+  where id <= (select pending_id from watermark)
+),
+{% endif %}
+hist as (
   select
+    id,
     product_id,
     ts_utc,
     price,
     in_stock,
+    carried,
     lag(price) over (partition by product_id order by ts_utc) as prev_price,
     lag(in_stock) over (partition by product_id order by ts_utc) as prev_stock
-  from {{ ref('stg_price_history') }}
+  from batch
 ),
 events as (
   select
@@ -26,7 +88,19 @@ events as (
       when prev_price is not null and price is not null and price < prev_price
         then round(100.0*(prev_price - price)/prev_price, 2)
       else null
-    end as drop_pct
+    end as drop_pct,
+    id as source_id,
+    carried
   from hist
 )
-select * from events where event_type is not null
+select
+  product_id,
+  ts_utc,
+  prev_price,
+  new_price,
+  event_type,
+  drop_pct,
+  source_id
+from events
+where event_type is not null
+  and not carried
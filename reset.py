@@ -1,17 +1,28 @@
-"""Reset database schemas, rebuild tables, seed, ingest, run dbt and DQ."""
-import os, re, subprocess, sys
+"""Reset database schemas, rebuild tables, seed, ingest, run dbt and DQ.
+
+Stages declare the stages they run after and are started as soon as
+those finish, so independent ones (dbt alongside DQ, the drop alerts
+alongside the summary) run in parallel. A per-stage timing summary and
+the critical path are printed at the end.
+
+With `--keep-data` the schemas are kept and a stage whose inputs (code
+and/or data watermarks, see `Stage.inputs`) match its last successful
+run, as recorded in stage_run, is skipped; dbt then only builds
+`state:modified+` when the models changed but the data did not.
+
+Usage: python reset.py [--keep-data] [--force] [--threads N]
+"""
+import argparse
+import hashlib
+import json
+import os, re, shutil, sys, time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
 from pathlib import Path
+from typing import Callable
 from sqlalchemy import text
-from urllib.parse import urlparse
-from sqlalchemy.orm import Session
 
-from pipeline.common.db import engine, SessionLocal
-from pipeline.common.models import Base
-from pipeline.load.seed_products import main as seed_products
-from pipeline.ingest.fetch_and_parse import main as run_ingestion
-from pipeline.dq.run_dq_checks import main as run_dq
-from pipeline.load.alert_price_drops import main as alert_drops
-from pipeline.load.report_summary import main as report_summary
+from pipeline.common import db
 
 def find_repo_root(start: Path) -> Path:
     """Walk up until we find .git; fallback to current dir."""
@@ -26,11 +37,15 @@ def find_repo_root(start: Path) -> Path:
 ROOT = find_repo_root(Path(__file__).resolve().parent)
 DBT_DIR = ROOT / "pipeline" / "transform" / "its_on_sale"
 PROFILES_DIR = ROOT / "pipeline" / "transform"
+# Manifest of the last successful dbt build, for state:modified+ selection.
+DBT_STATE_DIR = DBT_DIR / "target" / "last_success"
+DBT_THREADS = int(os.getenv("DBT_THREADS", "4"))
+STAGE_WORKERS = int(os.getenv("RESET_STAGE_WORKERS", "4"))
 
 
 def drop_and_recreate_schemas():
     """Drop and recreate public, staging, marts schemas."""
-    with engine.begin() as conn:
+    with db.engine.begin() as conn:
         conn.execute(text("DROP SCHEMA IF EXISTS marts CASCADE;"))
         conn.execute(text("DROP SCHEMA IF EXISTS staging CASCADE;"))
         conn.execute(text("DROP SCHEMA public CASCADE;"))
@@ -40,8 +55,9 @@ def drop_and_recreate_schemas():
     print("Schemas recreated: public, staging, marts.")
 
 def create_orm_tables():
-    """Create ORM tables in public schema."""
-    Base.metadata.create_all(bind=engine)
+    """Create ORM tables in public schema (price_history partitioned if PRICE_HISTORY_PARTITIONED=1)."""
+    from pipeline.load.init_db import create_tables
+    create_tables()
     print("ORM tables created in public.")
 
 def parse_database_url_to_pg_env():
@@ -63,45 +79,244 @@ def parse_database_url_to_pg_env():
         "DBT_PROFILES_DIR": PROFILES_DIR,
     }
 
-def run_dbt():
-    """Run dbt debug, run, and test."""
-    env = os.environ.copy()
-    env.update(parse_database_url_to_pg_env())
-    env["DBT_PROFILES_DIR"] = str(PROFILES_DIR)
-    cmds = [["dbt", "debug"], ["dbt", "run"], ["dbt", "test"]]
-    for cmd in cmds:
-        print(f"Running: {' '.join(cmd)} (cwd={DBT_DIR})")
-        subprocess.run(cmd, cwd=str(DBT_DIR), check=True, env=env)
+def run_dbt(changed: set[str], threads: int = DBT_THREADS, lag: int | None = None):
+    """`dbt build` (models and tests in dependency order) in this process.
+
+    Only `state:modified+` is built when the models changed but the data
+    didn't and a manifest from the last successful build exists. `lag`
+    overrides the models' commit_lag_seconds var.
+    """
+    from dbt.cli.main import dbtRunner
+
+    os.environ.update({k: str(v) for k, v in parse_database_url_to_pg_env().items()})
+    args = [
+        "build",
+        "--project-dir", str(DBT_DIR),
+        "--profiles-dir", str(PROFILES_DIR),
+        "--threads", str(threads),
+    ]
+    if lag is not None:
+        args += ["--vars", json.dumps({"commit_lag_seconds": lag})]
+    if "data" not in changed and (DBT_STATE_DIR / "manifest.json").exists():
+        args += ["--select", "state:modified+", "--state", str(DBT_STATE_DIR)]
+    print(f"Running: dbt {' '.join(args)}")
+    result = dbtRunner().invoke(args)
+    if not result.success:
+        raise RuntimeError(f"dbt build failed: {result.exception or 'see dbt output'}")
+    # dbt resolves a relative DBT_TARGET_PATH against the project
+    target = DBT_DIR / os.getenv("DBT_TARGET_PATH", "target")
+    DBT_STATE_DIR.mkdir(parents=True, exist_ok=True)
+    shutil.copy2(target / "manifest.json", DBT_STATE_DIR / "manifest.json")
+
+
+def files_hash(*paths: Path) -> str:
+    """sha256 over the contents of `paths` (directories recursively)."""
+    h = hashlib.sha256()
+    for path in paths:
+        files = sorted(p for p in path.rglob("*") if p.is_file()) if path.is_dir() else [path]
+        for f in files:
+            h.update(str(f.relative_to(ROOT)).encode())
+            h.update(f.read_bytes())
+    return h.hexdigest()
+
+def watermark(sql: str) -> str:
+    with db.engine.connect() as conn:
+        return str(conn.execute(text(sql)).one())
+
+HISTORY_WATERMARK = "select max(id), count(*) from public.price_history"
+PRODUCT_WATERMARK = "select max(product_id), count(*) from public.product"
+
+
+@dataclass
+class Stage:
+    """One step of the pipeline.
+
+    `run(changed)` gets the names of the inputs that differ from the
+    stage's last successful run (all of them when there is none, and
+    an empty set for stages without inputs).
+    `inputs` returns those inputs' fingerprints, computed when the stage
+    is about to start; stages without it always run.
+    """
+
+    name: str
+    run: Callable[[set[str]], None]
+    after: tuple[str, ...] = ()
+    inputs: Callable[[], dict[str, str]] | None = None
+
+
+@dataclass
+class StageResult:
+    status: str = "not run"
+    start: float = 0.0
+    seconds: float = 0.0
+    error: BaseException | None = None
+
+    @property
+    def end(self) -> float:
+        return self.start + self.seconds
+
+
+def last_fingerprints() -> dict[str, dict]:
+    from sqlalchemy import inspect, select
+    from pipeline.common.models import StageRun
+
+    with db.engine.connect() as conn:
+        if not inspect(conn).has_table(StageRun.__tablename__):
+            return {}
+        return dict(conn.execute(select(StageRun.stage, StageRun.fingerprint)).all())
+
+def record_success(stage: str, fingerprint: dict, seconds: float):
+    from sqlalchemy.dialects.postgresql import insert as pg_insert
+    from pipeline.common.models import StageRun
+
+    stmt = pg_insert(StageRun).values(stage=stage, fingerprint=fingerprint, seconds=seconds)
+    with db.engine.begin() as conn:
+        conn.execute(stmt.on_conflict_do_update(
+            index_elements=[StageRun.stage],
+            set_={"fingerprint": stmt.excluded.fingerprint, "seconds": stmt.excluded.seconds,
+                  "finished_utc": text("now()")},
+        ))
+
+
+def run_stages(stages: list[Stage], skip_unchanged: bool = True, workers: int = STAGE_WORKERS):
+    """Run `stages` as a DAG, each as soon as the stages it runs after have succeeded.
+
+    Once a stage fails no further stages are started; the first failure
+    is re-raised when the ones already running have finished.
+    """
+    by_name = {s.name: s for s in stages}
+    previous = last_fingerprints() if skip_unchanged else {}
+    results = {s.name: StageResult() for s in stages}
+    pending, running, failure = list(stages), {}, None
+    started = time.perf_counter()
+
+    def execute(stage: Stage) -> StageResult:
+        result = StageResult(start=time.perf_counter() - started)
+        try:
+            fingerprint = stage.inputs() if stage.inputs else None
+            last = previous.get(stage.name) or {}
+            if fingerprint is not None and fingerprint == last:
+                result.status = "skipped"
+            else:
+                stage.run({k for k, v in (fingerprint or {}).items() if last.get(k) != v})
+                result.status = "ok"
+            result.seconds = time.perf_counter() - started - result.start
+            if fingerprint is not None and result.status == "ok":
+                record_success(stage.name, fingerprint, result.seconds)
+        except BaseException as e:  # DQ failures exit with SystemExit
+            result.status, result.error = "failed", e
+            result.seconds = time.perf_counter() - started - result.start
+        return result
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while pending or running:
+            if failure is None:
+                for stage in [s for s in pending if all(results[d].status in ("ok", "skipped") for d in s.after)]:
+                    pending.remove(stage)
+                    print(f"[{time.perf_counter() - started:7.2f}s] start {stage.name}")
+                    running[pool.submit(execute, stage)] = stage
+            else:
+                pending.clear()
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                results[stage.name] = future.result()
+                failure = failure or results[stage.name].error
+                print(f"[{time.perf_counter() - started:7.2f}s] {results[stage.name].status} {stage.name}")
 
+    print_timings(by_name, results, time.perf_counter() - started)
+    if failure is not None:
+        raise failure
+    return results
 
+def critical_path(stages: dict[str, Stage], results: dict[str, StageResult]) -> list[str]:
+    """Chain of stages, each waiting on the one before, ending with the last to finish."""
+    ran = {n: r for n, r in results.items() if r.status != "not run"}
+    if not ran:
+        return []
+    name = max(ran, key=lambda n: ran[n].end)
+    path = [name]
+    while True:
+        deps = [d for d in stages[name].after if d in ran]
+        if not deps:
+            return path[::-1]
+        name = max(deps, key=lambda n: ran[n].end)
+        path.append(name)
 
-def reset_and_bootstrap():
-    """Execute full reset and bootstrap pipeline."""
-    drop_and_recreate_schemas()
-    create_orm_tables()
+def print_timings(stages: dict[str, Stage], results: dict[str, StageResult], wall: float):
+    width = max(len("stage"), *map(len, stages))
+    print(f"\n{'stage':<{width}}  {'status':<8} {'start':>8} {'took':>8}")
+    for name, r in sorted(results.items(), key=lambda kv: (kv[1].status == "not run", kv[1].start)):
+        print(f"{name:<{width}}  {r.status:<8} {r.start:7.2f}s {r.seconds:7.2f}s")
+    path = critical_path(stages, results)
+    busy = sum(results[n].seconds for n in path)
+    print(f"critical path: {' -> '.join(path)} ({busy:.2f}s of {wall:.2f}s wall)")
 
-    seed_products()
 
-    with SessionLocal() as s:
-        count = s.execute(text("select count(*) from public.product")).scalar_one()
-        print(f"Seeded products: {count}")
+def pipeline_stages(reset: bool = True, threads: int = DBT_THREADS) -> list[Stage]:
+    """The full pipeline; with `reset`, schemas are dropped and rebuilt first."""
+    # imported here so importing this module (or the CLI) stays cheap
+    from pipeline.load.seed_products import main as seed_products
+    from pipeline.ingest.fetch_and_parse import main as run_ingestion
+    from pipeline.dq.run_dq_checks import main as run_dq
+    from pipeline.load.alert_price_drops import main as alert_drops
+    from pipeline.load.report_summary import main as report_summary
 
-    run_ingestion()
+    def seed(changed):
+        seed_products()
+        with db.SessionLocal() as s:
+            count = s.execute(text("select count(*) from public.product")).scalar_one()
+            print(f"Seeded products: {count}")
 
-    run_dbt()
+    code = lambda *parts: files_hash(*(ROOT / p for p in parts))
+    first = ("schemas",) if reset else ()
+    stages = [
+        Stage("tables", lambda changed: create_orm_tables(), after=first,
+              inputs=lambda: {"code": code("pipeline/common/models.py", "pipeline/load/init_db.py")}),
+        Stage("seed", seed, after=("tables",),
+              inputs=lambda: {"code": code("pipeline/load/seed_products.py")}),
+        Stage("ingest", lambda changed: run_ingestion(), after=("seed",)),
+        # After a reset nothing else is writing, so every snapshot is safe to build.
+        Stage("dbt", lambda changed: run_dbt(changed, threads, lag=0 if reset else None), after=("ingest",),
+              inputs=lambda: {
+                  "models": code("pipeline/transform/profiles.yml", "pipeline/transform/its_on_sale/dbt_project.yml",
+                                 "pipeline/transform/its_on_sale/models", "pipeline/transform/its_on_sale/tests"),
+                  "data": watermark(HISTORY_WATERMARK) + watermark(PRODUCT_WATERMARK),
+              }),
+        # DQ reads price_history, not the dbt models, so it runs alongside dbt.
+        # After a reset nothing else is writing, so every row is safe to check.
+        Stage("dq", lambda changed: run_dq(incremental=not reset, lag=0 if reset else None), after=("ingest",),
+              inputs=lambda: {"suite": code("pipeline/dq/dq_suite.json"), "data": watermark(HISTORY_WATERMARK)}),
+        Stage("alerts", lambda changed: alert_drops(), after=("dq",)),
+        Stage("summary", lambda changed: report_summary(), after=("dq",)),
+    ]
+    if os.getenv("PARQUET_EXPORT_DIR"):
+        from pipeline.load.export_parquet import export
+        # After a reset nothing else is writing, so every row is safe to export.
+        stages.append(Stage("export", lambda changed: export(lag=0 if reset else None), after=("dq",)))
+    if reset:
+        stages.insert(0, Stage("schemas", lambda changed: drop_and_recreate_schemas()))
+    return stages
 
-    run_dq()
+def reset_and_bootstrap(reset: bool = True, force: bool = False, threads: int = DBT_THREADS):
+    """Execute full reset and bootstrap pipeline.
 
-    alert_drops()
-    report_summary()
+    With `reset=False` the data is kept and, unless `force`, stages whose
+    inputs are unchanged since their last successful run are skipped.
+    """
+    return run_stages(pipeline_stages(reset, threads), skip_unchanged=not (reset or force))
 
 if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--keep-data", action="store_true", help="don't drop schemas; skip unchanged stages")
+    ap.add_argument("--force", action="store_true", help="with --keep-data, run every stage anyway")
+    ap.add_argument("--threads", type=int, default=DBT_THREADS, help="dbt threads")
+    args = ap.parse_args()
     try:
-        reset_and_bootstrap()
+        reset_and_bootstrap(reset=not args.keep_data, force=args.force, threads=args.threads)
         print("Reset and bootstrap complete.")
-    except subprocess.CalledProcessError as e:
-        print(f"Command failed with exit code {e.returncode}: {e.cmd}")
-        sys.exit(e.returncode)
     except Exception as e:
         print("Bootstrap failed:", e)
         sys.exit(1)
@@ -1,56 +1,85 @@
-"""Streamlit app showing price trends and metrics."""
+"""Streamlit app showing price trends and metrics.
+
+Queries are cached per argument set and price history is downsampled in
+Postgres to at most `DASHBOARD_MAX_POINTS` time buckets (min/max/last per
+bucket), so a rerun never pulls raw history into pandas. The selected
+product's metrics and recent snapshots come from the shared price-series
+cache (`pipeline.load.price_series`), which only reads new rows on a rerun.
+"""
 
 import os
+import sys
+from datetime import datetime, time, timedelta, timezone
+from pathlib import Path
+
 import pandas as pd
-from sqlalchemy import create_engine, text
+from sqlalchemy import text
 import streamlit as st
 
+# `streamlit run` only puts this file's folder on sys.path
+ROOT = str(Path(__file__).resolve().parents[1])
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+from pipeline.common import db
+from pipeline.load import price_series as ps
+from streamlit_app.queries import HISTORY_BOUNDS_SQL, LATEST_SQL, PRICE_HISTORY_SQL, PRODUCTS_SQL, bucket_seconds
+
 DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     st.stop()
 
-engine = create_engine(DATABASE_URL, future=True)
+STATEMENT_TIMEOUT_MS = int(os.getenv("DASHBOARD_STATEMENT_TIMEOUT_MS", "15000"))
+CACHE_TTL = 60
+LOW_WINDOW_DAYS = 30
+RECENT_SNAPSHOTS = 20
+
+@st.cache_resource
+def get_engine():
+    return db.make_engine(DATABASE_URL, pool_size=2, max_overflow=2, statement_timeout_ms=STATEMENT_TIMEOUT_MS)
+
+def query(sql: str, **params) -> pd.DataFrame:
+    with get_engine().connect() as c:
+        return pd.read_sql(text(sql), c, params=params)
 
 @st.cache_data(ttl=60)
 def load_products():
-    with engine.connect() as c:
-        df = pd.read_sql(text("""
-            select product_id, name, site, url
-            from public.product
-            order by product_id
-        """), c)
-    return df
+    return query(PRODUCTS_SQL)
 
 @st.cache_data(ttl=60)
-def load_price_history(product_id: int):
-    with engine.connect() as c:
-        df = pd.read_sql(text("""
-            select ts_utc, price_numeric as price, currency, in_stock_bool as in_stock
-            from public.price_history
-            where product_id = :pid
-            order by ts_utc
-        """), c, params={"pid": product_id})
-    return df
+def load_latest():
+    return query(LATEST_SQL)
 
-st.title("It’s On Sale — Price Tracker")
+@st.cache_data(ttl=60)
+def load_history_bounds(product_id: int):
+    """First and last snapshot time, including days already rolled up."""
+    row = query(HISTORY_BOUNDS_SQL, pid=product_id).iloc[0]
+    return row.iloc[0], row.iloc[1]
 
+@st.cache_data(ttl=60)
+def load_price_history(product_id: int, start: datetime, end: datetime, bucket_seconds: int):
+    """Min/max/last price per `bucket_seconds` bucket between `start` and `end`."""
+    return query(PRICE_HISTORY_SQL, pid=product_id, start=start, end=end, bucket=bucket_seconds)
+
+def load_series(product_id: int):
+    """The product's snapshots, at most CACHE_TTL seconds behind."""
+    with get_engine().connect() as c:
+        return ps.shared_cache().get(c, [product_id], max_age=CACHE_TTL)[0]
+
+def recent_snapshots(series, low, limit: int = RECENT_SNAPSHOTS) -> pd.DataFrame:
+    newest = slice(None, -limit - 1 if limit < len(series) else None, -1)
+    return pd.DataFrame({
+        "ts_utc": pd.to_datetime(series.ts[newest], unit="us", utc=True),
+        "price": series.cents[newest] / 100,
+        "currency": series.currency,
+        "in_stock": series.in_stock[newest],
+        f"{LOW_WINDOW_DAYS}-day low": low[newest] / 100,
+    })
 
-latest = pd.read_sql(
-    text("""
-      select p.product_id, p.name, p.site, p.url,
-             l.last_seen_utc, l.price, l.currency
-      from public_marts.latest_price_per_product l
-      join public_staging.stg_product p
-        on p.product_id = l.product_id
-      order by p.site, p.name
-    """),
-    engine.connect()
-)
+st.title("It’s On Sale — Price Tracker")
 
+latest = load_latest()
 st.subheader("Latest prices")
-st.dataframe(latest)
-
-
+st.dataframe(latest, hide_index=True)
 
 products = load_products()
 if products.empty:
@@ -68,40 +97,52 @@ if site_filter != "All":
 search = st.text_input("Search product name")
 if search:
     products = products[products["name"].str.contains(search, case=False, na=False)]
+if products.empty:
+    st.info("No products match.")
+    st.stop()
 
+names = dict(zip(products["product_id"], products["name"]))
+pid = st.selectbox("Select a product", list(names), format_func=names.get)
 
-pid = st.selectbox(
-    "Select a product",
-    products["product_id"].tolist(),
-    format_func=lambda i: products.set_index("product_id").loc[i, "name"],
-)
-
-row = products.set_index("product_id").loc[pid]
+row = products[products["product_id"] == pid].iloc[0]
 st.markdown(f"**Site:** {row['site']}  \n**URL:** {row['url']}")
 
-hist = load_price_history(pid)
-if hist.empty:
+first, last = load_history_bounds(pid)
+if pd.isna(first):
     st.info("No price history yet for this product.")
     st.stop()
 
+first, last = pd.Timestamp(first).date(), pd.Timestamp(last).date()
+picked = st.date_input("Date range", value=(first, last), min_value=first, max_value=last)
+if len(picked) != 2:
+    st.stop()
+start = datetime.combine(picked[0], time.min, tzinfo=timezone.utc)
+end = datetime.combine(picked[1] + timedelta(days=1), time.min, tzinfo=timezone.utc)
+bucket = bucket_seconds(start, end)
+
+series = load_series(pid)
+batch = ps.Batch.of([series])
+low = ps.rolling_min(batch, LOW_WINDOW_DAYS * 86400 * ps.US_PER_SECOND)
+if len(series):
+    latest_price = ps.latest(batch)["cents"][0] / 100
+    prev_price = ps.previous(batch)["cents"][0] / 100
+    currency = series.currency or ""
+    col1, col2, col3, col4 = st.columns(4)
+    if pd.notna(latest_price):
+        col1.metric("Latest price", f"{latest_price:.2f} {currency}")
+    if pd.notna(latest_price) and pd.notna(prev_price) and prev_price:
+        pct = ps.pct_change(prev_price, latest_price)
+        col2.metric("Previous price", f"{prev_price:.2f} {currency}")
+        col3.metric("Change %", f"{pct:.2f}%", delta=f"{pct:.2f}")
+    if pd.notna(low[-1]):
+        col4.metric(f"{LOW_WINDOW_DAYS}-day low", f"{low[-1] / 100:.2f} {currency}")
+
+hist = load_price_history(pid, start, end, bucket)
+if hist.empty:
+    st.info("No price history in this range.")
+    st.stop()
+
 hist["ts_utc"] = pd.to_datetime(hist["ts_utc"])
-hist = hist.sort_values("ts_utc")
-
-latest_price = hist.iloc[-1]["price"]
-currency = hist.iloc[-1]["currency"]
-
-if len(hist) > 1:
-    prev_price = hist.iloc[-2]["price"]
-    diff = latest_price - prev_price
-    pct = (diff / prev_price) * 100 if prev_price else 0
-else:
-    prev_price, diff, pct = None, None, 0
-
-col1, col2, col3 = st.columns(3)
-col1.metric("Latest price", f"{latest_price:.2f} {currency}")
-if prev_price:
-    col2.metric("Previous price", f"{prev_price:.2f} {currency}")
-    col3.metric("Change %", f"{pct:.2f}%", delta=f"{pct:.2f}")
-
-st.line_chart(hist.set_index("ts_utc")["price"])
-st.dataframe(hist.tail(20))
+st.caption(f"{int(hist['snapshots'].sum())} snapshots in {len(hist)} buckets of {timedelta(seconds=bucket)}")
+st.line_chart(hist.set_index("ts_utc")[["price", "min_price", "max_price"]].astype(float))
+st.dataframe(recent_snapshots(series, low), hide_index=True)
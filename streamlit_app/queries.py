@@ -0,0 +1,68 @@
+"""SQL behind the Streamlit dashboard, importable without Streamlit.
+
+Kept apart from `app.py` so `pipeline.bench.e2e` can time the same
+queries the dashboard runs.
+"""
+
+import math
+import os
+from datetime import datetime
+
+MAX_POINTS = int(os.getenv("DASHBOARD_MAX_POINTS", "500"))
+MIN_BUCKET_SECONDS = 3600
+
+
+def bucket_seconds(start: datetime, end: datetime) -> int:
+    """Bucket width that keeps a chart of `start`..`end` under MAX_POINTS points."""
+    return max(MIN_BUCKET_SECONDS, math.ceil((end - start).total_seconds() / MAX_POINTS))
+
+
+PRODUCTS_SQL = """
+    select product_id, name, site, url
+    from public.product
+    order by product_id
+"""
+
+LATEST_SQL = """
+    select p.product_id, p.name, p.site, p.url,
+           l.last_seen_utc, l.last_price as price, l.currency
+    from public.product_latest_price l
+    join public.product p
+      on p.product_id = l.product_id
+    order by p.site, p.name
+"""
+
+# First and last snapshot time, including days already rolled up.
+HISTORY_BOUNDS_SQL = """
+    select least(min(h.ts_utc), (select min(day)::timestamp at time zone 'UTC'
+                                 from public.price_history_daily where product_id = :pid)),
+           greatest(max(h.ts_utc), (select max(day)::timestamp at time zone 'UTC'
+                                    from public.price_history_daily where product_id = :pid))
+    from public.price_history h
+    where h.product_id = :pid
+"""
+
+# Min/max/last price per :bucket seconds between :start and :end.
+PRICE_HISTORY_SQL = """
+    with points as (
+      select ts_utc, price_numeric as min_price, price_numeric as max_price,
+             price_numeric as last_price, currency, in_stock_bool as in_stock, 1 as snapshots
+      from public.price_history
+      where product_id = :pid and ts_utc >= :start and ts_utc < :end
+      union all
+      select day::timestamp at time zone 'UTC', min_price, max_price,
+             last_price, currency, last_in_stock, snapshots
+      from public.price_history_daily
+      where product_id = :pid and day >= cast(:start as date) and day < cast(:end as date)
+    )
+    select date_bin(make_interval(secs => :bucket), ts_utc, cast(:start as timestamptz)) as ts_utc,
+           min(min_price) as min_price,
+           max(max_price) as max_price,
+           (array_agg(last_price order by ts_utc desc))[1] as price,
+           (array_agg(currency order by ts_utc desc))[1] as currency,
+           (array_agg(in_stock order by ts_utc desc))[1] as in_stock,
+           sum(snapshots) as snapshots
+    from points
+    group by 1
+    order by 1
+"""
@@ -0,0 +1,205 @@
+"""Circuit breaker states and per-host dispatch in pipeline.ingest.fetcher."""
+
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import pytest
+
+from pipeline.ingest import fetcher
+from pipeline.ingest.fetcher import CircuitBreaker, Fetcher, HostUnavailable
+from pipeline.load import work_queue
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    c = Clock()
+    monkeypatch.setattr(fetcher.time, "monotonic", c)
+    return c
+
+
+def tripped(clock, threshold=3, cooldown=60) -> CircuitBreaker:
+    breaker = CircuitBreaker(threshold=threshold, cooldown=cooldown)
+    for _ in range(threshold):
+        breaker.record(False)
+    return breaker
+
+
+def test_opens_after_threshold_consecutive_failures(clock):
+    breaker = CircuitBreaker(threshold=3, cooldown=60)
+    assert [breaker.record(False) for _ in range(3)] == [False, False, True]
+    assert not breaker.allow()
+    # further failures keep it open without reporting a new trip
+    assert breaker.record(False) is False
+
+
+def test_success_resets_the_failure_count(clock):
+    breaker = CircuitBreaker(threshold=3, cooldown=60)
+    breaker.record(False)
+    breaker.record(False)
+    breaker.record(True)
+    breaker.record(False)
+    breaker.record(False)
+    assert breaker.allow()
+
+
+def test_zero_threshold_never_opens(clock):
+    breaker = CircuitBreaker(threshold=0, cooldown=60)
+    for _ in range(100):
+        assert breaker.record(False) is False
+    assert breaker.allow()
+
+
+def test_half_open_lets_one_probe_through(clock):
+    breaker = tripped(clock)
+    clock.now += 59
+    assert not breaker.allow()
+    clock.now += 1
+    assert breaker.allow()
+    assert not breaker.allow()
+
+
+def test_successful_probe_closes(clock):
+    breaker = tripped(clock)
+    clock.now += 60
+    assert breaker.allow()
+    assert breaker.record(True) is False
+    assert breaker.allow() and breaker.allow()
+    assert breaker.opened_at is None and breaker.failures == 0
+
+
+def test_failed_probe_reopens_for_another_cooldown(clock):
+    breaker = tripped(clock)
+    clock.now += 60
+    assert breaker.allow()
+    breaker.record(False)
+    assert not breaker.allow()
+    clock.now += 59
+    assert not breaker.allow()
+    clock.now += 1
+    assert breaker.allow()
+
+
+def test_cancelled_probe_frees_the_next_one(clock):
+    breaker = tripped(clock)
+    clock.now += 60
+    assert breaker.allow()
+    breaker.cancel()
+    assert breaker.allow()
+    assert breaker.failures == 3
+
+
+def test_probe_raising_a_non_request_error_is_cancelled(clock):
+    f = Fetcher(max_concurrency=1, delay=0)
+    try:
+        host, slot = f._slot("http://a.test/x")
+        slot.breaker.threshold = 1
+        slot.breaker.record(False)
+        clock.now += slot.breaker.cooldown
+        with mock.patch.object(slot.session, "get", side_effect=ValueError("boom")):
+            with pytest.raises(ValueError):
+                f.fetch("http://a.test/x")
+        ok = mock.Mock(status_code=200, content=b"", raw=mock.Mock(retries=None))
+        with mock.patch.object(slot.session, "get", return_value=ok):
+            assert f.fetch("http://a.test/x") is ok
+        assert slot.breaker.opened_at is None
+    finally:
+        f.close()
+
+
+def test_open_breaker_fails_fast(clock):
+    f = Fetcher(max_concurrency=1, delay=0)
+    try:
+        _, slot = f._slot("http://a.test/x")
+        slot.breaker.threshold = 1
+        slot.breaker.record(False)
+        with mock.patch.object(slot.session, "get") as get:
+            with pytest.raises(HostUnavailable):
+                f.fetch("http://a.test/x")
+            get.assert_not_called()
+    finally:
+        f.close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        time.sleep(self.server.delay)
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def serve():
+    servers = []
+
+    def start(delay: float) -> int:
+        server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        server.delay = delay
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server.server_port
+
+    yield start
+    for server in servers:
+        server.shutdown()
+
+
+def test_slow_host_does_not_starve_the_pool(serve):
+    slow, fast = serve(0.5), serve(0)
+    # the slow host's jobs come first and it may only run one at a time;
+    # the fast host must still get the pool's other worker
+    jobs = [("slow", f"http://localhost:{slow}/{i}", None) for i in range(3)]
+    jobs += [("fast", f"http://127.0.0.1:{fast}/{i}", None) for i in range(20)]
+    with Fetcher(max_concurrency=2, per_host=2, delay=0, host_limits={"localhost": {"concurrency": 1}}) as f:
+        order = [tag for tag, r in f.fetch_all(jobs) if r.status_code == 200]
+    assert order.count("fast") == 20 and order.count("slow") == 3
+    assert order.index("slow") > order.index("fast")
+    assert "fast" not in order[order.index("slow"):]
+
+
+def test_fetch_all_respects_host_limits(serve):
+    port = serve(0.05)
+    in_flight = peak = 0
+    lock = threading.Lock()
+    real_fetch = Fetcher.fetch
+
+    def counting_fetch(self, url, headers=None):
+        nonlocal in_flight, peak
+        with lock:
+            in_flight += 1
+            peak = max(peak, in_flight)
+        try:
+            return real_fetch(self, url, headers)
+        finally:
+            with lock:
+                in_flight -= 1
+
+    jobs = [(i, f"http://127.0.0.1:{port}/{i}", None) for i in range(12)]
+    with mock.patch.object(Fetcher, "fetch", counting_fetch):
+        with Fetcher(max_concurrency=8, per_host=3, delay=0) as f:
+            assert len(list(f.fetch_all(jobs))) == 12
+    assert peak <= 3
+
+
+def test_release_products_clears_only_the_owners_leases():
+    conn = mock.Mock()
+    work_queue.release_products(conn, "host:1", (4, 5))
+    (stmt, params), _ = conn.execute.call_args
+    sql = str(stmt)
+    assert "lease_owner = null" in sql and "lease_expires_utc = null" in sql
+    assert "lease_owner = :owner" in sql
+    assert params == {"owner": "host:1", "ids": [4, 5]}
@@ -0,0 +1,182 @@
+"""The array primitives and LRU eviction of pipeline.load.price_series."""
+
+import numpy as np
+import pytest
+
+from pipeline.load import price_series as ps
+from pipeline.load.price_series import Batch, PriceSeries, PriceSeriesCache
+
+NAN = np.nan
+
+
+def series(product_id: int, points, first_id: int = 1) -> PriceSeries:
+    """A series from `(ts, cents, in_stock)` points."""
+    ts = np.array([p[0] for p in points], np.int64)
+    cents = np.array([p[1] for p in points], np.float64)
+    stock = np.array([p[2] for p in points], bool)
+    ids = np.arange(first_id, first_id + len(points), dtype=np.int64)
+    return PriceSeries(product_id, ids, ts, cents, np.packbits(stock, bitorder="little"), "GBP")
+
+
+@pytest.fixture
+def batch() -> Batch:
+    return Batch.of([
+        series(1, [(10, 500, True), (20, 500, True), (30, 450, False), (40, NAN, False), (50, 400, True)]),
+        PriceSeries.empty(2),
+        series(3, [(15, 999, True), (25, 999, True)]),
+        series(4, [(5, 100, True), (6, 120, True), (7, 120, True)]),
+    ])
+
+
+def test_latest(batch):
+    out = ps.latest(batch)
+    assert out["product_id"].tolist() == [1, 2, 3, 4]
+    assert out["ts"].tolist() == [50, -1, 25, 7]
+    np.testing.assert_array_equal(out["cents"], [400, NAN, 999, 120])
+    assert out["in_stock"].tolist() == [True, False, True, True]
+
+
+def test_previous_is_the_price_before_the_last_change(batch):
+    out = ps.previous(batch)
+    # product 1: 450 -> NaN -> 400, so the last change is NaN -> 400 at ts 50
+    np.testing.assert_array_equal(out["cents"], [NAN, NAN, NAN, 100])
+    assert out["changed_ts"].tolist() == [50, -1, 15, 6]
+
+
+def test_previous_ignores_changes_across_series():
+    b = Batch.of([series(1, [(1, 100, True)]), series(2, [(2, 200, True), (3, 200, True)])])
+    out = ps.previous(b)
+    np.testing.assert_array_equal(out["cents"], [NAN, NAN])
+    assert out["changed_ts"].tolist() == [1, 2]
+
+
+def test_pct_change():
+    np.testing.assert_allclose(ps.pct_change([200, 0, NAN, 50], [150, 10, 5, 75]), [-25, NAN, NAN, 50])
+
+
+def test_round_pct_rounds_halves_up():
+    # 12.345 and 0.125 are not exact in binary; Postgres rounds both up
+    pct = -ps.pct_change([20000.0, 80000.0], [17531.0, 79900.0])
+    assert ps.round_pct(pct).tolist() == [12.35, 0.13]
+    assert ps.round_pct(np.array([1.004, 1.005, 99.994999])).tolist() == [1.0, 1.01, 99.99]
+
+
+def test_drops(batch):
+    out = ps.drops(batch, since_us=0)
+    # newest first; the unpriced snapshot at 40 is skipped, so 450 -> 400 is a drop
+    assert out["product_id"].tolist() == [1, 1]
+    assert out["ts"].tolist() == [50, 30]
+    assert out["prev_cents"].tolist() == [450, 500]
+    assert out["new_cents"].tolist() == [400, 450]
+    assert out["drop_pct"].tolist() == [11.11, 10.0]
+
+
+def test_drops_window_and_threshold(batch):
+    assert ps.drops(batch, since_us=30)["ts"].tolist() == [50]
+    assert ps.drops(batch, since_us=0, min_pct=10.5)["ts"].tolist() == [50]
+    assert ps.drops(batch, since_us=0, min_pct=11.12)["ts"].tolist() == []
+
+
+def test_drops_threshold_uses_the_rounded_pct():
+    b = Batch.of([series(1, [(1, 20000, True), (2, 17531, True)])])
+    out = ps.drops(b, since_us=0, min_pct=12.35)
+    assert out["drop_pct"].tolist() == [12.35]
+
+
+def test_drops_never_pair_points_of_different_series():
+    b = Batch.of([series(1, [(1, 900, True)]), series(2, [(2, 100, True)])])
+    assert len(ps.drops(b, since_us=0)["ts"]) == 0
+
+
+def brute_rolling_min(b: Batch, window: int) -> np.ndarray:
+    out = np.full(len(b.ts), NAN)
+    for s in range(len(b)):
+        lo, hi = b.offsets[s], b.offsets[s + 1]
+        for i in range(lo, hi):
+            # a window ends at its own point, even if later points share its time
+            inside = (b.ts[lo:hi] > b.ts[i] - window) & (np.arange(lo, hi) <= i)
+            prices = b.cents[lo:hi][inside]
+            prices = prices[~np.isnan(prices)]
+            if len(prices):
+                out[i] = prices.min()
+    return out
+
+
+def test_rolling_min(batch):
+    np.testing.assert_array_equal(ps.rolling_min(batch, 20), [500, 500, 450, 450, 400, 999, 999, 100, 100, 100])
+    np.testing.assert_array_equal(ps.rolling_min(batch, 1), [500, 500, 450, NAN, 400, 999, 999, 100, 120, 120])
+
+
+def test_rolling_min_matches_brute_force():
+    rng = np.random.default_rng(7)
+    members = []
+    for p in range(30):
+        n = int(rng.integers(0, 40))
+        ts = np.sort(rng.integers(0, 200, n))  # with repeated times
+        cents = rng.integers(50, 150, n).astype(float)
+        cents[rng.random(n) < 0.2] = NAN
+        members.append(series(p, [(t, c, True) for t, c in zip(ts, cents)]))
+    b = Batch.of(members)
+    for window in (1, 5, 37, 500):
+        np.testing.assert_array_equal(ps.rolling_min(b, window), brute_rolling_min(b, window))
+
+
+def test_rolling_min_empty():
+    assert len(ps.rolling_min(Batch.of([]), 10)) == 0
+
+
+class FakeSource:
+    """Stands in for the database behind `read_series` and the cache's upper id."""
+
+    def __init__(self, monkeypatch, sizes: dict[int, int]):
+        self.sizes = sizes
+        self.reads = []
+        monkeypatch.setattr(ps, "read_series", self.read_series)
+        monkeypatch.setattr(PriceSeriesCache, "_upper", lambda cache, conn: 1_000_000)
+
+    def read_series(self, conn, product_ids, after=0):
+        product_ids = list(product_ids)
+        self.reads.append((product_ids, after))
+        if after:
+            return {}
+        return {p: series(p, [(t, 100, True) for t in range(self.sizes[p])]) for p in product_ids}
+
+
+def test_cache_evicts_least_recently_used(monkeypatch):
+    FakeSource(monkeypatch, {p: 1000 for p in range(5)})
+    one = series(0, [(t, 100, True) for t in range(1000)]).nbytes
+    cache = PriceSeriesCache(max_mb=3.5 * one / 2**20)
+    cache.get(None, [0, 1, 2])
+    cache.get(None, [0])
+    cache.get(None, [3])
+    assert list(cache._series) == [2, 0, 3]
+    assert cache.evictions == 1
+    assert cache.nbytes <= cache.max_bytes
+
+
+def test_cache_hits_and_refresh_after_watermark(monkeypatch):
+    source = FakeSource(monkeypatch, {1: 10, 2: 10})
+    cache = PriceSeriesCache(max_mb=1)
+    cache.get(None, [1, 2])
+    cache.get(None, [2, 1])
+    assert (cache.hits, cache.misses) == (2, 2)
+    # the second call only reads rows past the watermark
+    assert source.reads[-1] == ([1, 2], 1_000_000)
+
+
+def test_over_budget_request_is_returned_but_not_kept(monkeypatch):
+    FakeSource(monkeypatch, {1: 5000, 2: 5000, 3: 5000})
+    one = series(1, [(t, 100, True) for t in range(5000)]).nbytes
+    cache = PriceSeriesCache(max_mb=1.5 * one / 2**20)
+    got = cache.get(None, [1, 2, 3])
+    assert [len(s) for s in got] == [5000, 5000, 5000]
+    # only the most recently requested series fits
+    assert list(cache._series) == [3]
+    assert cache.nbytes <= cache.max_bytes
+
+
+def test_series_larger_than_the_cache_is_not_kept(monkeypatch):
+    FakeSource(monkeypatch, {1: 5000})
+    cache = PriceSeriesCache(max_mb=1 / 2**20)
+    assert len(cache.get(None, [1])[0]) == 5000
+    assert len(cache) == 0 and cache.nbytes == 0 and cache.watermark is None